@@ -1,28 +1,40 @@
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
 from extensions import db, migrate, login_manager
 from models import User, Movie
+from services.principal import user_principals  # registers the user loader
+from services.progress import init_progress_buffer
+from services.token_store import init_token_store
 from urllib.parse import urlparse 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # Client addresses behind a reverse proxy
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    init_token_store(app)
+    init_progress_buffer(app)
     
     # Register blueprints
     from routes.auth import auth_bp
     from routes.movies import movies_bp
     from routes.watchlist import watchlist_bp
     from routes.streaming import streaming_bp
+    from routes.api import api_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(movies_bp)
     app.register_blueprint(watchlist_bp)
     app.register_blueprint(streaming_bp)
+    app.register_blueprint(api_bp)
     
     # Create tables
     with app.app_context():
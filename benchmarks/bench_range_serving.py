@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Benchmark MP4 range delivery: the old 8 KB generator in stream_video
+against the paths used by services/media.py.
+
+Each strategy pushes the same byte ranges of a temporary file into a local
+socket pair (a drain thread reads the other end), so the numbers include
+the per-chunk Python overhead and syscalls but no HTTP parsing.
+
+Usage:
+    python benchmarks/bench_range_serving.py [file_size_mb] [range_mb] [rounds]
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.media import FileRangeIterator  # noqa: E402
+from services.media_index import FileHandle  # noqa: E402
+
+
+def legacy_generator(path, start, end):
+    """The pre-existing stream_video range loop (tell() + 8 KB reads)."""
+    video_file = open(path, 'rb')
+    video_file.seek(start)
+    while video_file.tell() <= end:
+        chunk = video_file.read(8192)
+        if not chunk:
+            break
+        yield chunk
+    video_file.close()
+
+
+def send_iterable(sock, iterable):
+    for chunk in iterable:
+        sock.sendall(chunk)
+    close = getattr(iterable, 'close', None)
+    if close:
+        close()
+
+
+def run_legacy(sock, path, start, length):
+    send_iterable(sock, legacy_generator(path, start, start + length - 1))
+
+
+_shared_handles = {}
+
+
+def run_iterator(sock, path, start, length):
+    # pread from one long-lived descriptor, as with services.media_index;
+    # iterated directly because close() would release it to the app cache
+    if path not in _shared_handles:
+        _shared_handles[path] = FileHandle(os.open(path, os.O_RDONLY), None)
+    for chunk in FileRangeIterator(_shared_handles[path], start, length):
+        sock.sendall(chunk)
+
+
+def run_sendfile(sock, path, start, length):
+    # What gunicorn does with wsgi.file_wrapper plus Content-Length
+    with open(path, 'rb') as fileobj:
+        offset, remaining = start, length
+        while remaining:
+            sent = os.sendfile(sock.fileno(), fileobj.fileno(), offset, remaining)
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+
+
+def drain(sock):
+    while sock.recv(1 << 20):
+        pass
+
+
+def bench(name, func, path, file_size, range_size, rounds):
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,), daemon=True)
+    reader.start()
+    starts = [(i * 7919 * 4096) % (file_size - range_size) for i in range(rounds)]
+    t0 = time.perf_counter()
+    for start in starts:
+        func(sender, path, start, range_size)
+    elapsed = time.perf_counter() - t0
+    sender.close()
+    reader.join()
+    receiver.close()
+    mb = range_size * rounds / (1 << 20)
+    print(f'{name:<22} {elapsed * 1000 / rounds:8.2f} ms/range  {mb / elapsed:9.1f} MB/s')
+    return elapsed
+
+
+def main():
+    file_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    range_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    file_size, range_size = file_mb << 20, range_mb << 20
+
+    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp:
+        tmp.write(os.urandom(file_size))
+        path = tmp.name
+    try:
+        print(f'{file_mb} MB file, {range_mb} MB ranges, {rounds} rounds')
+        legacy = bench('legacy 8KB generator', run_legacy, path, file_size, range_size, rounds)
+        bench('FileRangeIterator', run_iterator, path, file_size, range_size, rounds)
+        if hasattr(os, 'sendfile'):
+            fast = bench('os.sendfile', run_sendfile, path, file_size, range_size, rounds)
+            print(f'sendfile speedup over legacy: {legacy / fast:.1f}x')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
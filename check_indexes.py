@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Check that the hot queries in routes/ are answered from their indexes.
+
+Runs EXPLAIN (FORMAT JSON) on the queries the services build (catalog
+pages, search, Continue Watching) and looks for the expected index in the
+plan. Sequential scans are disabled for the session so small
+development tables still show whether an index is *usable*; on production
+sized tables the planner picks them on its own.
+
+Usage:
+    python check_indexes.py
+
+Exits with status 1 if any query does not use its index. PostgreSQL only.
+"""
+
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import create_app
+from extensions import db
+from models import Movie, watchlist
+from services.catalog import catalog_query
+from services.continue_watching import continue_watching_query
+from services.pagination import keyset_query
+from services.sql import explain_json
+
+
+def hot_queries():
+    """(description, query, expected index) for each hot access path."""
+    per_page = 12
+    cursor_key = (datetime(2024, 1, 1), 1000)
+    browse, _ = catalog_query()
+    drama, _ = catalog_query(category='Drama')
+    return [
+        ('movies.index browse (first page)',
+         keyset_query(browse, per_page),
+         'ix_movies_created_at_id'),
+        ('movies.index browse (cursor page)',
+         keyset_query(browse, per_page, cursor_key),
+         'ix_movies_created_at_id'),
+        ('movies.index category filter',
+         keyset_query(drama, per_page),
+         'ix_movies_category_created_at_id'),
+        ('movies.index full-text search',
+         catalog_query('knight')[0],
+         'ix_movies_search_vector'),
+        ('movies.index fuzzy search',
+         catalog_query('knigt', mode='fuzzy')[0],
+         'ix_movies_title_trgm'),
+        ('streaming.continue_watching',
+         continue_watching_query(1, 10),
+         'ix_watch_progress_user_in_progress'),
+        ('watchlist.index',
+         Movie.query.join(watchlist, watchlist.c.movie_id == Movie.id)
+         .filter(watchlist.c.user_id == 1).order_by(watchlist.c.added_at.desc()),
+         'ix_watchlist_user_added_at'),
+    ]
+
+
+def plan_indexes(node):
+    """Yield every index name referenced in an EXPLAIN JSON plan tree."""
+    if 'Index Name' in node:
+        yield node['Index Name']
+    for child in node.get('Plans', []):
+        yield from plan_indexes(child)
+
+
+def check():
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            print('Index check requires PostgreSQL; skipping.')
+            return True
+
+        db.session.execute(text('SET enable_seqscan = off'))
+        ok = True
+        for description, query, expected in hot_queries():
+            used = set(plan_indexes(explain_json(query)))
+            if expected in used:
+                print(f'  OK    {description}: {expected}')
+            else:
+                ok = False
+                print(f'  MISS  {description}: expected {expected}, plan uses {sorted(used) or "no index"}')
+        db.session.rollback()
+        return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check() else 1)
@@ -13,7 +13,8 @@ class Config:
 
     DB_PASSWORD_ESCAPED = urllib.parse.quote_plus(DB_PASSWORD)
 
-    SQLALCHEMY_DATABASE_URI = f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD_ESCAPED}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+        f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD_ESCAPED}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
@@ -25,3 +26,139 @@ class Config:
 
     # Pagination
     MOVIES_PER_PAGE = 12
+    # 'keyset' pages the catalog by (created_at, id) cursors; 'offset' uses
+    # numbered pages with a full COUNT(*)
+    CATALOG_PAGINATION = 'keyset'
+
+    # Catalog search: 'auto' uses PostgreSQL full-text search when available
+    # and falls back to a title ilike match; 'fulltext' or 'ilike' force one
+    SEARCH_BACKEND = 'auto'
+
+    # Fuzzy title search: minimum word similarity (0-1) for a match, the
+    # result cap for the in-process trigram index used off PostgreSQL, and how
+    # often (in seconds) each worker rebuilds that index from the database
+    FUZZY_SEARCH_THRESHOLD = 0.5
+    FUZZY_SEARCH_LIMIT = 200
+    FUZZY_INDEX_TTL = 300
+
+    # Search-box typeahead: default number of completions and how often (in
+    # seconds) each worker rebuilds its in-memory title index from the database
+    SUGGEST_LIMIT = 8
+    SUGGEST_INDEX_TTL = 300
+
+    # Browse facets (category counts, decade and rating buckets) are cached
+    # per worker; local writes drop the cache, this bounds cross-worker staleness
+    FACET_CACHE_TTL = 300
+
+    # Total count for numbered pages: 'exact' (COUNT(*)), 'capped' (count up
+    # to PAGINATION_COUNT_CAP rows, shown as "1,000+") or 'estimated'
+    # (PostgreSQL planner estimate, capped count elsewhere)
+    PAGINATION_COUNT = 'capped'
+    PAGINATION_COUNT_CAP = 1000
+
+    # Read-through movie metadata cache used by the detail, watch and
+    # streaming routes: entry lifetime, negative-lookup lifetime (seconds)
+    # and the maximum number of cached movies per worker
+    MOVIE_CACHE_TTL = 300
+    MOVIE_CACHE_NEGATIVE_TTL = 30
+    MOVIE_CACHE_SIZE = 10000
+
+    # Streaming tokens: 'signed' (stateless, default), 'memory' (per-process
+    # store) or 'sqlite' (store shared by all workers on a host)
+    STREAM_TOKEN_BACKEND = 'signed'
+    STREAM_TOKEN_TTL = 4 * 3600  # seconds
+    # Server-side stores only: size bound, SQLite file (defaults to the
+    # instance folder) and background purge interval in seconds
+    STREAM_TOKEN_MAX = 100000
+    STREAM_TOKEN_STORE_PATH = None
+    STREAM_TOKEN_REAP_INTERVAL = 60
+
+    # Media delivery: 'direct' (Flask sends the bytes), 'x-accel' (nginx
+    # X-Accel-Redirect to MEDIA_ACCEL_LOCATION, an internal location aliased
+    # to MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd). MEDIA_ROOT defaults
+    # to static/videos
+    MEDIA_DELIVERY = 'direct'
+    MEDIA_ROOT = None
+    MEDIA_ACCEL_LOCATION = '/protected-media/'
+
+    # Resolved media paths are re-stat'ed (to notice replaced or new files)
+    # at most every MEDIA_INDEX_RECHECK seconds; up to MEDIA_FD_CACHE_SIZE
+    # open descriptors are shared between requests in each worker
+    MEDIA_INDEX_RECHECK = 5
+    MEDIA_FD_CACHE_SIZE = 256
+
+    # HLS over local MP4s: segments are cut at the first keyframe after
+    # HLS_SEGMENT_TARGET seconds; parsed indexes are stored as JSON in
+    # HLS_INDEX_DIR (defaults to instance/hls_index). fMP4 segments are built
+    # from the sample tables of the HLS_SOURCE_CACHE_SIZE most recently used
+    # files, kept in memory per worker (a few MB per hour of video)
+    HLS_SEGMENT_TARGET = 6
+    HLS_INDEX_DIR = None
+    HLS_SOURCE_CACHE_SIZE = 8
+
+    # Compiled playlists kept per process, and how long players may reuse
+    # a fetched playlist (private: playlists embed the viewer's token)
+    HLS_PLAYLIST_CACHE_SIZE = 2000
+    HLS_PLAYLIST_MAX_AGE = 300
+
+    # Hot media segments kept in memory per worker (segmented LRU); 0
+    # disables. Ranges above SEGMENT_CACHE_MAX_ITEM always stream from disk
+    SEGMENT_CACHE_BYTES = 256 * 1024 * 1024
+    SEGMENT_CACHE_MAX_ITEM = 8 * 1024 * 1024
+    SEGMENT_CACHE_PROTECTED_RATIO = 0.8
+
+    # Readahead of the next HLS segments after each segment request:
+    # 'fadvise' (page cache hint), 'cache' (load into the segment cache) or
+    # 'off'. READAHEAD_SEGMENTS grows by one per doubling of the viewers
+    # seen on the title within READAHEAD_SESSION_WINDOW seconds
+    READAHEAD_MODE = 'fadvise'
+    READAHEAD_SEGMENTS = 2
+    READAHEAD_MAX_SEGMENTS = 6
+    READAHEAD_SESSION_WINDOW = 30
+    READAHEAD_WORKERS = 4
+    READAHEAD_QUEUE_MAX = 256
+
+    # Watch-progress reports are buffered per worker and upserted in one
+    # batch every PROGRESS_FLUSH_INTERVAL seconds (the most a crashed worker
+    # can lose), or once PROGRESS_FLUSH_MAX are waiting. 0 writes through
+    PROGRESS_FLUSH_INTERVAL = 5
+    PROGRESS_FLUSH_MAX = 5000
+
+    # Continue Watching rail: items shown, and per-user caching in each
+    # worker (dropped whenever that user's progress is flushed)
+    CONTINUE_WATCHING_LIMIT = 10
+    CONTINUE_WATCHING_CACHE_TTL = 60
+    CONTINUE_WATCHING_CACHE_SIZE = 10000
+
+    # Logged-in identity (id, username, is_admin) cached per worker instead
+    # of loading the user row on every request; committed user writes drop
+    # the entry locally, the TTL bounds staleness in other workers
+    USER_CACHE_TTL = 60
+    USER_CACHE_SIZE = 10000
+
+    # Password hashing runs on PASSWORD_HASH_WORKERS threads per worker
+    # process; calls beyond PASSWORD_HASH_QUEUE_MAX waiting (or waiting over
+    # PASSWORD_HASH_TIMEOUT seconds) get a 503. Hashes made with other
+    # parameters than PASSWORD_HASH_METHOD are upgraded at login
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_MAX = 16
+    PASSWORD_HASH_TIMEOUT = 5
+
+    # Login, signup and password-reset attempts allowed per client IP, and
+    # logins per username from one client IP and per username across all
+    # IPs, within LOGIN_THROTTLE_WINDOW seconds (429 beyond)
+    LOGIN_THROTTLE_WINDOW = 300
+    LOGIN_IP_LIMIT = 30
+    LOGIN_USERNAME_IP_LIMIT = 10
+    LOGIN_USERNAME_LIMIT = 100
+    LOGIN_THROTTLE_MAX_KEYS = 100000
+
+    # Reverse proxies in front of the app that append to X-Forwarded-For.
+    # With N > 0 the client address (request.remote_addr, used by the login
+    # throttle) is taken from that header via werkzeug's ProxyFix; 0 trusts
+    # no forwarding header
+    PROXY_FIX_X_FOR = 0
+
+    # Movie ids accepted by one bulk watchlist request (POST /api/watchlist)
+    WATCHLIST_BULK_MAX = 500
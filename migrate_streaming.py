@@ -24,7 +24,6 @@ def migrate():
         columns_to_add = {
             'video_url': 'VARCHAR(500)',
             'hls_url': 'VARCHAR(500)',
-            'quality_variants': 'TEXT',
             'duration_seconds': 'INTEGER'
         }
         
@@ -0,0 +1,92 @@
+"""add movie full-text search vector
+
+Revision ID: a3c1f9d2e4b7
+Revises: 5b971e9f447a
+Create Date: 2026-10-17 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f9d2e4b7'
+down_revision = '5b971e9f447a'
+branch_labels = None
+depends_on = None
+
+# Rows updated per backfill statement. Each batch commits on its own so
+# the backfill never holds row locks on the whole table.
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('movies', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('search_vector', sa.Text(), nullable=True))
+        return
+
+    op.add_column('movies', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION movies_search_vector(title text, description text, category text)
+        RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+                || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+                || setweight(to_tsvector('english', coalesce(category, '')), 'C')
+        $$ LANGUAGE sql IMMUTABLE
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION movies_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := movies_search_vector(NEW.title, NEW.description, NEW.category);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    # Install the trigger before backfilling so rows written during the
+    # backfill are already covered.
+    op.execute("""
+        CREATE TRIGGER movies_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, description, category ON movies
+        FOR EACH ROW EXECUTE FUNCTION movies_search_vector_update()
+    """)
+
+    with op.get_context().autocommit_block():
+        last_id = 0
+        while True:
+            rows = bind.execute(sa.text("""
+                UPDATE movies
+                SET search_vector = movies_search_vector(title, description, category)
+                WHERE id IN (
+                    SELECT id FROM movies
+                    WHERE id > :last_id AND search_vector IS NULL
+                    ORDER BY id
+                    LIMIT :batch_size
+                )
+                RETURNING id
+            """), {'last_id': last_id, 'batch_size': BACKFILL_BATCH_SIZE}).fetchall()
+            if not rows:
+                break
+            last_id = max(row[0] for row in rows)
+
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_movies_search_vector '
+            'ON movies USING gin (search_vector)'
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('movies', schema=None) as batch_op:
+            batch_op.drop_column('search_vector')
+        return
+
+    op.execute('DROP INDEX IF EXISTS ix_movies_search_vector')
+    op.execute('DROP TRIGGER IF EXISTS movies_search_vector_trigger ON movies')
+    op.execute('DROP FUNCTION IF EXISTS movies_search_vector_update()')
+    op.execute('DROP FUNCTION IF EXISTS movies_search_vector(text, text, text)')
+    op.drop_column('movies', 'search_vector')
@@ -0,0 +1,124 @@
+"""add movie_variants table, migrate movies.quality_variants
+
+Revision ID: b8d4f2a6c913
+Revises: e41b6d0c9a52
+Create Date: 2026-10-17 16:05:12.418230
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4f2a6c913'
+down_revision = 'e41b6d0c9a52'
+branch_labels = None
+depends_on = None
+
+# Movies are copied this many at a time so the migration never holds a
+# large result set or one huge INSERT in memory
+BATCH_SIZE = 500
+
+movies = sa.table(
+    'movies',
+    sa.column('id', sa.Integer),
+    sa.column('quality_variants', sa.Text),
+)
+
+movie_variants = sa.table(
+    'movie_variants',
+    sa.column('movie_id', sa.Integer),
+    sa.column('quality', sa.String),
+    sa.column('url', sa.String),
+    sa.column('height', sa.Integer),
+)
+
+
+def parse_quality_variants(movie_id, text):
+    """Rows for a legacy "360p:url,720p:url" string (first entry wins per quality)."""
+    rows = {}
+    for entry in (text or '').split(','):
+        if ':' not in entry:
+            continue
+        quality, url = (part.strip() for part in entry.split(':', 1))
+        if not quality or not url or quality in rows:
+            continue
+        match = re.fullmatch(r'(\d+)p', quality)
+        rows[quality] = {
+            'movie_id': movie_id,
+            'quality': quality[:20],
+            'url': url[:500],
+            'height': int(match.group(1)) if match else None,
+        }
+    return list(rows.values())
+
+
+def _batches(bind, query, key):
+    """Yield rows of ``query`` (ordered by ``key``, selected first) in batches."""
+    last_id = 0
+    while True:
+        rows = bind.execute(query.where(key > last_id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.create_table(
+        'movie_variants',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('quality', sa.String(length=20), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('bitrate', sa.Integer(), nullable=True),
+        sa.Column('average_bitrate', sa.Integer(), nullable=True),
+        sa.Column('codec', sa.String(length=100), nullable=True),
+        sa.Column('byte_size', sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('movie_id', 'quality', name='uq_movie_variants_movie_quality'),
+    )
+
+    bind = op.get_bind()
+    # Only databases set up by migrate_streaming.py have the legacy column
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('movies')}
+    if 'quality_variants' not in columns:
+        return
+
+    query = sa.select(movies.c.id, movies.c.quality_variants) \
+        .where(movies.c.quality_variants.isnot(None)) \
+        .where(movies.c.quality_variants != '') \
+        .order_by(movies.c.id)
+    for batch in _batches(bind, query, movies.c.id):
+        rows = [row for movie_id, text in batch for row in parse_quality_variants(movie_id, text)]
+        if rows:
+            bind.execute(movie_variants.insert(), rows)
+
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('quality_variants')
+
+
+def downgrade():
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.add_column(sa.Column('quality_variants', sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    # 'source' rows are added by ingest and have no place in the old string
+    query = sa.select(movie_variants.c.movie_id, movie_variants.c.quality, movie_variants.c.url) \
+        .where(movie_variants.c.quality != 'source') \
+        .order_by(movie_variants.c.movie_id, movie_variants.c.height)
+    strings = {}
+    for movie_id, quality, url in bind.execute(query):
+        strings.setdefault(movie_id, []).append(f'{quality}:{url}')
+    for movie_id, parts in strings.items():
+        bind.execute(
+            movies.update().where(movies.c.id == movie_id)
+            .values(quality_variants=','.join(parts))
+        )
+
+    op.drop_table('movie_variants')
@@ -0,0 +1,36 @@
+"""add movie title trigram index
+
+Revision ID: c7e2a8b1d5f3
+Revises: a3c1f9d2e4b7
+Create Date: 2026-10-17 11:04:09.552817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a8b1d5f3'
+down_revision = 'a3c1f9d2e4b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_movies_title_trgm '
+            'ON movies USING gin (title gin_trgm_ops)'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_movies_title_trgm')
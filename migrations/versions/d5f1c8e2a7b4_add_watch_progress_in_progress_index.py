@@ -0,0 +1,48 @@
+"""add partial index for the Continue Watching rail
+
+Revision ID: d5f1c8e2a7b4
+Revises: b8d4f2a6c913
+Create Date: 2026-10-17 18:20:41.662105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f1c8e2a7b4'
+down_revision = 'b8d4f2a6c913'
+branch_labels = None
+depends_on = None
+
+NAME = 'ix_watch_progress_user_in_progress'
+
+# Must match models.IN_PROGRESS_SQL (COMPLETION_THRESHOLD = 0.9)
+IN_PROGRESS_SQL = (
+    'total_duration IS NULL OR total_duration <= 0 '
+    'OR "current_time" < total_duration * 0.9'
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index(NAME, 'watch_progress', ['user_id', 'last_watched_at'],
+                        sqlite_where=sa.text(IN_PROGRESS_SQL))
+        return
+
+    # CONCURRENTLY cannot run inside a transaction block, and builds without
+    # blocking writes to the table.
+    with op.get_context().autocommit_block():
+        op.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {NAME} '
+            f'ON watch_progress (user_id, last_watched_at) WHERE {IN_PROGRESS_SQL}'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index(NAME, table_name='watch_progress')
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {NAME}')
@@ -0,0 +1,55 @@
+"""add catalog, watchlist and progress indexes
+
+Revision ID: e41b6d0c9a52
+Revises: c7e2a8b1d5f3
+Create Date: 2026-10-17 11:47:30.104662
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b6d0c9a52'
+down_revision = 'c7e2a8b1d5f3'
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns) - each matches one hot query in routes/
+INDEXES = [
+    # movies.index browse, keyset-paginated by (created_at, id)
+    ('ix_movies_created_at_id', 'movies', ['created_at', 'id']),
+    # movies.index filtered by category
+    ('ix_movies_category_created_at_id', 'movies', ['category', 'created_at', 'id']),
+    # streaming.continue_watching
+    ('ix_watch_progress_user_last_watched', 'watch_progress', ['user_id', 'last_watched_at']),
+    # watchlist.index
+    ('ix_watchlist_user_added_at', 'watchlist', ['user_id', 'added_at']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+        return
+
+    # CONCURRENTLY cannot run inside a transaction block, and builds without
+    # blocking writes to the table.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                f'ON {table} ({", ".join(columns)})'
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(INDEXES):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,49 @@
+"""backfill movies.created_at and make it NOT NULL
+
+Revision ID: f3a9c6d1b2e8
+Revises: d5f1c8e2a7b4
+Create Date: 2026-10-17 21:42:09.318457
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6d1b2e8'
+down_revision = 'd5f1c8e2a7b4'
+branch_labels = None
+depends_on = None
+
+# Keyset pagination compares (created_at, id) tuples, which never match a
+# NULL created_at. Movies without one sort as the oldest.
+EPOCH = datetime(1970, 1, 1)
+
+# Rows are updated this many at a time to keep each statement short
+BATCH_SIZE = 500
+
+movies = sa.table(
+    'movies',
+    sa.column('id', sa.Integer),
+    sa.column('created_at', sa.DateTime),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    missing = sa.select(movies.c.id).where(movies.c.created_at.is_(None)).limit(BATCH_SIZE)
+    while True:
+        ids = bind.execute(missing).scalars().all()
+        if not ids:
+            break
+        bind.execute(movies.update().where(movies.c.id.in_(ids)).values(created_at=EPOCH))
+
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
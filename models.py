@@ -4,21 +4,49 @@ from urllib.parse import urlparse
 from flask_login import UserMixin
 from itsdangerous import URLSafeTimedSerializer
 from flask import current_app, session
-from extensions import db, login_manager
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
+from extensions import db
 
 # Association table for watchlist (many-to-many relationship)
 watchlist = db.Table('watchlist',
     db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
     db.Column('movie_id', db.Integer, db.ForeignKey('movies.id'), primary_key=True),
-    db.Column('added_at', db.DateTime, default=datetime.utcnow)
+    db.Column('added_at', db.DateTime, default=datetime.utcnow),
+    # Watchlist page: WHERE user_id = ? ORDER BY added_at DESC
+    db.Index('ix_watchlist_user_added_at', 'user_id', 'added_at')
 )
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+# The Flask-Login user loader lives in services/principal.py
 
 
-class User(UserMixin, db.Model):
+class UserLibrary:
+    """
+    Watchlist and progress helpers keyed by ``self.id``; shared by ``User``
+    and the cached ``Principal`` (services/principal.py).
+    """
+
+    # Single-statement writes (services/watchlist.py); the caller commits
+    def add_to_watchlist(self, movie):
+        from services.watchlist import add_to_watchlist
+        return add_to_watchlist(self.id, [movie.id]) > 0
+
+    def remove_from_watchlist(self, movie):
+        from services.watchlist import remove_from_watchlist
+        return remove_from_watchlist(self.id, [movie.id]) > 0
+
+    def is_in_watchlist(self, movie):
+        return db.session.query(
+            db.exists().where(watchlist.c.user_id == self.id,
+                              watchlist.c.movie_id == movie.id)
+        ).scalar()
+
+    def get_watch_progress(self, movie_id):
+        """Get user's watch progress for a specific movie"""
+        return WatchProgress.query.filter_by(user_id=self.id, movie_id=movie_id).first()
+
+
+class User(UserLibrary, UserMixin, db.Model):
     """
     User model for authentication and user management.
     """
@@ -37,8 +65,11 @@ class User(UserMixin, db.Model):
                                         lazy='dynamic')
     watch_progress = db.relationship('WatchProgress', backref='user', lazy='dynamic')
     
+    # Inline versions; request handlers use services/passwords.py, which
+    # runs these on a bounded pool
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, current_app.config['PASSWORD_HASH_METHOD'])
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -58,21 +89,6 @@ class User(UserMixin, db.Model):
             return None
         return User.query.get(user_id)
     
-    def add_to_watchlist(self, movie):
-        if not self.is_in_watchlist(movie):
-            self.watchlist_movies.append(movie)
-    
-    def remove_from_watchlist(self, movie):
-        if self.is_in_watchlist(movie):
-            self.watchlist_movies.remove(movie)
-    
-    def is_in_watchlist(self, movie):
-        return self.watchlist_movies.filter(watchlist.c.movie_id == movie.id).count() > 0
-    
-    def get_watch_progress(self, movie_id):
-        """Get user's watch progress for a specific movie"""
-        return self.watch_progress.filter_by(movie_id=movie_id).first()
-    
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -98,19 +114,34 @@ class Movie(db.Model):
     release_year = db.Column(db.Integer)
     rating = db.Column(db.Float, default=0.0)
     
-    # Video quality variants (comma-separated for multiple qualities)
-    # Format: "360p:url,720p:url,1080p:url"
-    quality_variants = db.Column(db.Text, nullable=True)
-    
     # Duration in seconds
     duration_seconds = db.Column(db.Integer, nullable=True)
     
-    # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Timestamps; created_at is part of the catalog's keyset sort key
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Full-text search document (title, description, category).
+    # Maintained by a database trigger on PostgreSQL; see services/search.py
+    search_vector = deferred(db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite'), nullable=True))
+    
     # Relationships
     watch_progress = db.relationship('WatchProgress', backref='movie', lazy='dynamic')
+    # Packaged quality renditions; load with selectinload(Movie.variants)
+    # when serializing more than one movie
+    variants = db.relationship('MovieVariant', backref='movie',
+                               order_by='MovieVariant.height',
+                               cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Catalog browse: ORDER BY created_at DESC, id DESC (keyset pagination),
+        # optionally filtered by category
+        db.Index('ix_movies_created_at_id', 'created_at', 'id'),
+        db.Index('ix_movies_category_created_at_id', 'category', 'created_at', 'id'),
+        db.Index('ix_movies_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_movies_title_trgm', 'title', postgresql_using='gin',
+                 postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
     
     def __repr__(self):
         return f'<Movie {self.title}>'
@@ -139,20 +170,14 @@ class Movie(db.Model):
     
     def get_quality_url(self, quality='720p'):
         """Get URL for specific quality"""
-        if not self.quality_variants:
-            return self.hls_url
-        variants = {}
-        for variant in self.quality_variants.split(','):
-            if ':' in variant:
-                q, url = variant.split(':', 1)
-                variants[q] = url.strip()
-        return variants.get(quality, self.hls_url)
+        for variant in self.variants:
+            if variant.quality == quality:
+                return variant.url
+        return self.hls_url
     
     def get_qualities(self):
         """Return list of available qualities"""
-        if not self.quality_variants:
-            return []
-        return [v.split(':')[0].strip() for v in self.quality_variants.split(',') if ':' in v]
+        return [variant.quality for variant in self.variants]
     
     def to_dict(self):
         return {
@@ -173,6 +198,59 @@ class Movie(db.Model):
         }
 
 
+class MovieVariant(db.Model):
+    """
+    One quality rendition of a movie: packaged HLS (e.g. 720p), or the
+    'source' MP4 repackaged on the fly, whose row ingest adds.
+    
+    Bitrates, codec and size are measured at ingest (services/ladder.py)
+    and are NULL until then; the master playlist advertises measured rows.
+    """
+    __tablename__ = 'movie_variants'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    movie_id = db.Column(db.Integer, db.ForeignKey('movies.id', ondelete='CASCADE'),
+                         nullable=False)
+    quality = db.Column(db.String(20), nullable=False)      # "720p"
+    url = db.Column(db.String(500), nullable=False)
+    height = db.Column(db.Integer, nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    bitrate = db.Column(db.Integer, nullable=True)          # Peak, bits/s
+    average_bitrate = db.Column(db.Integer, nullable=True)  # bits/s
+    codec = db.Column(db.String(100), nullable=True)        # RFC 6381, "avc1.64001f"
+    byte_size = db.Column(db.BigInteger, nullable=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('movie_id', 'quality', name='uq_movie_variants_movie_quality'),
+    )
+    
+    def __repr__(self):
+        return f'<MovieVariant {self.movie_id} {self.quality}>'
+    
+    def to_dict(self):
+        return {
+            'quality': self.quality,
+            'url': self.url,
+            'height': self.height,
+            'width': self.width,
+            'bitrate': self.bitrate,
+            'average_bitrate': self.average_bitrate,
+            'codec': self.codec,
+            'byte_size': self.byte_size,
+        }
+
+
+# Share of a movie watched after which it no longer shows in Continue Watching
+COMPLETION_THRESHOLD = 0.9
+
+# Rows still in progress, as SQL. The partial index below and
+# WatchProgress.in_progress() must agree for PostgreSQL to use the index
+IN_PROGRESS_SQL = (
+    'total_duration IS NULL OR total_duration <= 0 '
+    f'OR "current_time" < total_duration * {COMPLETION_THRESHOLD}'
+)
+
+
 class WatchProgress(db.Model):
     """
     Track user's watch progress for each movie.
@@ -201,6 +279,12 @@ class WatchProgress(db.Model):
     # Unique constraint to prevent duplicate entries
     __table_args__ = (
         db.UniqueConstraint('user_id', 'movie_id', name='_user_movie_progress_uc'),
+        # Continue Watching: WHERE user_id = ? ORDER BY last_watched_at DESC
+        db.Index('ix_watch_progress_user_last_watched', 'user_id', 'last_watched_at'),
+        # Continue Watching rail: the same, restricted to unfinished titles
+        db.Index('ix_watch_progress_user_in_progress', 'user_id', 'last_watched_at',
+                 postgresql_where=db.text(IN_PROGRESS_SQL),
+                 sqlite_where=db.text(IN_PROGRESS_SQL)),
     )
     
     def update_progress(self, current_time, total_duration=None):
@@ -210,12 +294,21 @@ class WatchProgress(db.Model):
             self.total_duration = total_duration
         self.last_watched_at = datetime.utcnow()
     
-    def is_completed(self, threshold=0.9):
+    def is_completed(self, threshold=COMPLETION_THRESHOLD):
         """Check if movie is considered completed (90% watched)"""
         if self.total_duration and self.total_duration > 0:
             return self.current_time >= (self.total_duration * threshold)
         return False
     
+    @classmethod
+    def in_progress(cls):
+        """SQL counterpart of ``not is_completed()`` (matches IN_PROGRESS_SQL)."""
+        return db.or_(
+            cls.total_duration.is_(None),
+            cls.total_duration <= db.literal_column('0'),
+            cls.current_time < cls.total_duration * db.literal_column(str(COMPLETION_THRESHOLD)),
+        )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -0,0 +1,131 @@
+"""
+JSON API used by client-side widgets (catalog grid, search box, watchlist).
+"""
+
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required, current_user
+from sqlalchemy.orm import selectinload
+from extensions import db
+from models import Movie
+from services.catalog import catalog_query
+from services.facets import facet_cache
+from services.pagination import keyset_paginate, InvalidCursor
+from services.suggest import title_suggestions
+from services.watchlist import add_to_watchlist, remove_from_watchlist
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+
+@api_bp.route('/movies')
+def movies():
+    """
+    Paginated catalog listing.
+    
+    Query parameters:
+    - cursor: opaque cursor from a previous response (next_cursor/prev_cursor)
+    - page: page number, used instead of cursors for relevance-ranked searches
+    - search, category: same filters as the HTML grid
+    - mode: 'fuzzy' for typo-tolerant title matching
+    - per_page: page size, capped at 100
+    - include_total: set to 1 to also compute the exact total (costs a COUNT)
+    """
+    search = request.args.get('search', '')
+    category = request.args.get('category', '')
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', current_app.config['MOVIES_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, 100))
+    include_total = request.args.get('include_total', 0, type=int) == 1
+    mode = request.args.get('mode', 'default')
+    
+    query, ranked = catalog_query(search, category, mode)
+    # to_dict() lists each movie's qualities: load them for the whole page
+    # in one extra query
+    query = query.options(selectinload(Movie.variants))
+    
+    if ranked:
+        # Ranked results: fetch one extra row to learn whether a next page exists
+        page = max(request.args.get('page', 1, type=int), 1)
+        rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        return jsonify({
+            'items': [movie.to_dict() for movie in rows[:per_page]],
+            'per_page': per_page,
+            'page': page,
+            'has_next': len(rows) > per_page,
+            'has_prev': page > 1,
+            'next_cursor': None,
+            'prev_cursor': None,
+            'total': query.order_by(None).count() if include_total else None,
+        })
+    
+    try:
+        page = keyset_paginate(query, per_page, cursor=cursor, with_total=include_total)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify(page.to_dict())
+
+
+@api_bp.route('/search/suggest')
+def suggest():
+    """
+    Title completions for the search box.
+    
+    Served entirely from the in-process prefix index; no database query
+    runs per keystroke once the index is warm.
+    """
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', current_app.config['SUGGEST_LIMIT'], type=int)
+    limit = max(1, min(limit, 20))
+    
+    title_suggestions.ensure_fresh(current_app.config['SUGGEST_INDEX_TTL'])
+    
+    response = jsonify({'query': q, 'suggestions': title_suggestions.suggest(q, limit)})
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+@api_bp.route('/facets')
+def facets():
+    """Catalog facet counts (categories, decades, rating bands)."""
+    return jsonify(facet_cache.get(current_app.config['FACET_CACHE_TTL']).to_dict())
+
+
+def _movie_ids(value):
+    """``value`` as a list of movie ids, or None if it is not one."""
+    if value is None:
+        return []
+    if not isinstance(value, list) or \
+            not all(isinstance(i, int) and not isinstance(i, bool) for i in value):
+        return None
+    return value
+
+
+@api_bp.route('/watchlist', methods=['POST'])
+@login_required
+def update_watchlist():
+    """
+    Add and remove many watchlist entries in one transaction.
+    
+    JSON body:
+    - add: movie ids to add (ids of missing movies are ignored)
+    - remove: movie ids to remove
+    
+    Both are single statements and idempotent, so retried requests are
+    safe. At most WATCHLIST_BULK_MAX ids per request.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    add_ids = _movie_ids(data.get('add'))
+    remove_ids = _movie_ids(data.get('remove'))
+    if add_ids is None or remove_ids is None:
+        return jsonify({'error': 'add and remove must be lists of movie ids'}), 400
+    if len(add_ids) + len(remove_ids) > current_app.config['WATCHLIST_BULK_MAX']:
+        return jsonify({'error': 'Too many movie ids'}), 400
+    
+    removed = remove_from_watchlist(current_user.id, remove_ids)
+    added = add_to_watchlist(current_user.id, add_ids)
+    db.session.commit()
+    
+    return jsonify({'added': added, 'removed': removed})
@@ -1,10 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, make_response
 from flask_login import login_user, logout_user, current_user, login_required
 from models import User
 from extensions import db
+from services.passwords import (
+    PasswordHashBusy, check_password, clear_login_attempts, set_password, throttle_login,
+)
 
 auth_bp = Blueprint('auth', __name__)
 
+
+def _retry_later(template, status, retry_after, **context):
+    """Re-render ``template`` with a 429/503 status and Retry-After."""
+    if status == 429:
+        flash('Too many attempts. Please wait a moment and try again.', 'danger')
+    else:
+        flash('The server is busy. Please try again in a moment.', 'warning')
+    response = make_response(render_template(template, **context), status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -13,9 +28,22 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        
+        wait = throttle_login(request.remote_addr, username)
+        if wait:
+            return _retry_later('auth/login.html', 429, wait)
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and check_password(user, password)
+        except PasswordHashBusy as exc:
+            return _retry_later('auth/login.html', 503, exc.retry_after)
+        
+        if valid:
+            # check_password may have upgraded the hash
+            db.session.commit()
+            clear_login_attempts(request.remote_addr, username)
             login_user(user)
             next_page = request.args.get('next')
             flash(f'Welcome back, {user.username}!', 'success')
@@ -35,12 +63,19 @@ def signup():
         email = request.form.get('email')
         password = request.form.get('password')
         
+        wait = throttle_login(request.remote_addr)
+        if wait:
+            return _retry_later('auth/signup.html', 429, wait)
+        
         user_exists = User.query.filter((User.username==username) | (User.email==email)).first()
         if user_exists:
             flash('Username or email already exists.', 'danger')
         else:
             user = User(username=username, email=email)
-            user.set_password(password)
+            try:
+                set_password(user, password)
+            except PasswordHashBusy as exc:
+                return _retry_later('auth/signup.html', 503, exc.retry_after)
             db.session.add(user)
             db.session.commit()
             flash('Account created! You can now login.', 'success')
@@ -94,7 +129,13 @@ def reset_token(token):
         if password != confirm_password:
             flash('Passwords do not match.', 'danger')
         else:
-            user.set_password(password)
+            wait = throttle_login(request.remote_addr)
+            if wait:
+                return _retry_later('auth/reset_token.html', 429, wait, token=token)
+            try:
+                set_password(user, password)
+            except PasswordHashBusy as exc:
+                return _retry_later('auth/reset_token.html', 503, exc.retry_after, token=token)
             db.session.commit()
             flash('Your password has been reset! You can now login.', 'success')
             return redirect(url_for('auth.login'))
@@ -1,37 +1,71 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
 from flask_login import current_user
 from models import Movie
 from flask_login import login_required, current_user
 from extensions import db
+from services.catalog import catalog_query
+from services.facets import facet_cache
+from services.ladder import ingest_ladder
+from services.movie_cache import get_movie_or_404
+from services.pagination import keyset_paginate, count_paginate, InvalidCursor
+from services.playback import watch_bootstrap
+from services.suggest import title_suggestions
 
 movies_bp = Blueprint('movies', __name__)
 
+def _paginate_catalog(search, category, mode, page, cursor, per_page):
+    """Return ``(movies, use_keyset)`` for one page of the catalog grid."""
+    query, ranked = catalog_query(search, category, mode)
+    
+    # Keyset mode avoids OFFSET scans and COUNT(*) on deep pages;
+    # an explicit ?page= keeps old numbered links working. Relevance-ranked
+    # search results have no stable key, so they use numbered pages.
+    use_keyset = (current_app.config['CATALOG_PAGINATION'] == 'keyset'
+                  and 'page' not in request.args and not ranked)
+    
+    if use_keyset:
+        try:
+            return keyset_paginate(query, per_page, cursor=cursor), True
+        except InvalidCursor:
+            return keyset_paginate(query, per_page), True
+    
+    if not ranked:
+        query = query.order_by(Movie.created_at.desc(), Movie.id.desc())
+    movies = count_paginate(query, page, per_page,
+                            strategy=current_app.config['PAGINATION_COUNT'],
+                            cap=current_app.config['PAGINATION_COUNT_CAP'])
+    return movies, False
+
 @movies_bp.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     search = request.args.get('search', '')
     category = request.args.get('category', '')
-    
-    query = Movie.query
-    
-    if search:
-        query = query.filter(Movie.title.ilike(f'%{search}%'))
-    
-    if category:
-        query = query.filter_by(category=category)
-    
-    movies = query.order_by(Movie.created_at.desc()).paginate(
-        page=page, per_page=12, error_out=False
-    )
-    
-    categories = db.session.query(Movie.category).distinct().all()
-    categories = [c[0] for c in categories]
-    
-    return render_template('movies/index.html', movies=movies, categories=categories)
+    mode = request.args.get('mode', 'default')
+    per_page = current_app.config['MOVIES_PER_PAGE']
+    
+    movies, use_keyset = _paginate_catalog(search, category, mode, page, cursor, per_page)
+    
+    # Nothing matched exactly: retry as a typo-tolerant search
+    fuzzy_fallback = False
+    if search and mode != 'fuzzy' and not movies.items and not cursor and page == 1:
+        mode = 'fuzzy'
+        movies, use_keyset = _paginate_catalog(search, category, mode, page, cursor, per_page)
+        fuzzy_fallback = bool(movies.items)
+    
+    # The filter dropdown (base.html) shows each category with its count;
+    # decade and rating buckets are only served by /api/facets
+    facets = facet_cache.get(current_app.config['FACET_CACHE_TTL'])
+    
+    return render_template('movies/index.html', movies=movies, categories=facets.category_names,
+                           category_counts=facets.category_counts,
+                           search=search, category=category, mode=mode,
+                           use_keyset=use_keyset, fuzzy_fallback=fuzzy_fallback)
 
 @movies_bp.route('/movie/<int:movie_id>')
 def detail(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     in_watchlist = False
     has_streaming = bool(movie.video_url or movie.hls_url)
     if current_user.is_authenticated:
@@ -49,8 +83,11 @@ def watch(movie_id):
     - Secure token-based access
     - Progress tracking for "Continue Watching"
     - Quality selection (when HLS is available)
+    
+    The stream token, resume position and Continue Watching rail are
+    inlined into the page, so playback starts without further requests.
     """
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     
     # Check if movie has streaming available
     has_streaming = bool(movie.video_url or movie.hls_url)
@@ -63,7 +100,8 @@ def watch(movie_id):
         'movies/watch.html', 
         movie=movie, 
         in_watchlist=in_watchlist,
-        has_streaming=has_streaming
+        has_streaming=has_streaming,
+        bootstrap=watch_bootstrap(movie)
     )
 
 @movies_bp.route('/movie/new', methods=['GET', 'POST'])
@@ -86,6 +124,9 @@ def create():
         )
         db.session.add(movie)
         db.session.commit()
+        title_suggestions.upsert(movie)
+        ingest_ladder(movie)
+        db.session.commit()
         flash('Movie added successfully!', 'success')
         return redirect(url_for('movies.index'))
     
@@ -110,6 +151,9 @@ def edit(movie_id):
         movie.release_year = int(request.form['release_year'])
         movie.rating = float(request.form.get('rating', 0))
         db.session.commit()
+        title_suggestions.upsert(movie)
+        ingest_ladder(movie)
+        db.session.commit()
         flash('Movie updated successfully!', 'success')
         return redirect(url_for('movies.detail', movie_id=movie.id))
     
@@ -124,6 +168,8 @@ def delete(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     db.session.delete(movie)
     db.session.commit()
+    title_suggestions.remove(movie_id)
+    variant_ladders.invalidate(movie_id)
     flash('Movie deleted!', 'success')
     return redirect(url_for('movies.index'))
 
@@ -3,124 +3,80 @@ Streaming routes for secure video delivery.
 Implements HLS streaming, progress tracking, and access control.
 """
 
-from flask import Blueprint, send_file, request, jsonify, session, Response, current_app
+from flask import Blueprint, request, jsonify, Response, current_app
 from flask_login import login_required, current_user
-from models import Movie, WatchProgress
-from extensions import db
-import os
-import secrets
-import time
-from datetime import datetime, timedelta
+from werkzeug.utils import secure_filename
+from services.continue_watching import continue_watching_cache
+from services.hls import (
+    TOKEN, fragment_playlist, master_playlist, playlist_cache, playlist_response,
+    segment_indexes, segment_playlist, source_files, source_init_segment, source_media_segment,
+)
+from services.ladder import master_ladder, variant_ladders
+from services.media import deliver_file
+from services.media_index import segment_location, video_location
+from services.movie_cache import get_movie_or_404, movie_cache
+from services.playback import stream_session, validate_stream_token, watch_bootstrap
+from services.principal import user_principals
+from services.progress import parse_seconds, progress_buffer, progress_dict
+from services.readahead import prefetch_after_fragment, prefetch_after_segment, readahead
+from services.segment_cache import segment_cache
+from datetime import datetime
 
 streaming_bp = Blueprint('streaming', __name__)
 
-# Token-based streaming security
-# In production, use Redis for token storage with expiry
-STREAM_TOKENS = {}
-
-
-def generate_stream_token(movie_id, user_id):
+@streaming_bp.route('/stream/<int:movie_id>/token')
+@login_required
+def get_stream_token(movie_id):
     """
     Generate a secure streaming token for a movie.
+    This token is used to access the video stream.
+    """
+    movie = get_movie_or_404(movie_id)
     
-    Architecture:
-    - Token is generated when user accesses the movie
-    - Token is valid for a limited time (e.g., 4 hours)
-    - Token is tied to specific movie and user
-    - Prevents sharing of direct video URLs
+    data = stream_session(movie)
+    if data is None:
+        return jsonify({'error': 'Streaming not available for this movie'}), 404
     
-    Production Enhancement:
-    - Use Redis with TTL for token storage
-    - Add rate limiting per user
-    - Track streaming sessions
-    """
-    token = secrets.token_urlsafe(32)
-    expiry = datetime.utcnow() + timedelta(hours=4)
-    
-    STREAM_TOKENS[token] = {
-        'movie_id': movie_id,
-        'user_id': user_id,
-        'expiry': expiry,
-        'created_at': datetime.utcnow()
-    }
-    return token
+    return jsonify(data)
 
 
-def validate_stream_token(token, movie_id):
+@streaming_bp.route('/stream/<int:movie_id>/bootstrap')
+@login_required
+def get_watch_bootstrap(movie_id):
     """
-    Validate a streaming token.
+    Token, stream URL, resume position and Continue Watching in one call.
     
-    Returns True if valid, False otherwise.
+    The watch page gets the same data inlined; this endpoint is for
+    clients that start playback without rendering that page.
     """
-    token_data = STREAM_TOKENS.get(token)
-    if not token_data:
-        return False
-    
-    # Check expiry
-    if token_data['expiry'] < datetime.utcnow():
-        del STREAM_TOKENS[token]
-        return False
-    
-    # Verify movie match
-    if token_data['movie_id'] != movie_id:
-        return False
-    
-    return True
+    data = watch_bootstrap(get_movie_or_404(movie_id))
+    if 'error' in data:
+        return jsonify(data), 404
+    return jsonify(data)
 
 
-def cleanup_expired_tokens():
-    """Remove expired tokens from memory."""
-    now = datetime.utcnow()
-    expired = [t for t, data in STREAM_TOKENS.items() if data['expiry'] < now]
-    for t in expired:
-        del STREAM_TOKENS[t]
+def _index_stamp(index):
+    return ('source', index.size, index.mtime_ns, index.target_duration)
 
 
-@streaming_bp.route('/stream/<int:movie_id>/token')
-@login_required
-def get_stream_token(movie_id):
-    """
-    Generate a secure streaming token for a movie.
-    This token is used to access the video stream.
-    """
-    movie = Movie.query.get_or_404(movie_id)
-    
-    # Check if movie has streaming available
-    if not movie.video_url and not movie.hls_url:
-        return jsonify({'error': 'Streaming not available for this movie'}), 404
-    
-    # Check subscription/access (extend for subscription system)
-    # For now, any authenticated user can stream
-    
-    # Generate token
-    token = generate_stream_token(movie_id, current_user.id)
-    
-    # Determine stream URL based on available sources
-    if movie.hls_url:
-        # Use HLS streaming with token protection
-        stream_base = url_for('streaming.stream_hls_manifest', 
-                              movie_id=movie_id, token=token, _external=True)
-        stream_type = 'hls'
-    else:
-        # Use direct MP4 with token protection
-        stream_base = url_for('streaming.stream_video', 
-                              movie_id=movie_id, token=token, _external=True)
-        stream_type = 'mp4'
-    
-    # Get or create watch progress
-    progress = current_user.get_watch_progress(movie_id)
-    if not progress:
-        progress = WatchProgress(user_id=current_user.id, movie_id=movie_id)
-        db.session.add(progress)
-        db.session.commit()
-    
-    return jsonify({
-        'token': token,
-        'stream_url': stream_base,
-        'stream_type': stream_type,
-        'movie': movie.to_dict(),
-        'progress': progress.to_dict() if progress else None
-    })
+def source_segment_index(movie):
+    """``(location, segment index)`` of the movie's local MP4, or None."""
+    if not movie.video_url or movie.video_url.startswith(('http://', 'https://')):
+        return None
+    location = video_location(movie)
+    if location is None:
+        return None
+    index = segment_indexes.get(movie.id, location)
+    if index is None:
+        return None
+    return location, index
+
+
+def fragment_response(data, location, name):
+    """A built fMP4 segment, conditional and range-capable like file segments."""
+    response = Response(data, mimetype='video/mp4')
+    response.set_etag(f'{location.etag}-{name}')
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 
 @streaming_bp.route('/stream/<int:movie_id>/hls/playlist.m3u8')
@@ -133,61 +89,109 @@ def stream_hls_manifest(movie_id):
     - Server validates token
     - Returns master playlist with quality variants
     - Player requests segments from segment endpoint
+    
+    Only variants that exist are advertised, with measured peak and
+    average bitrates, resolution and codecs (see services/ladder.py). The
+    playlist is compiled once per movie and cached; only the token is
+    filled in per request (see services/hls.py).
     """
     token = request.args.get('token')
     if not token or not validate_stream_token(token, movie_id):
         return jsonify({'error': 'Invalid or expired token'}), 403
     
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     
-    # Master playlist with quality variants
-    base_url = request.host_url.rstrip('/')
-    
-    master_playlist = f"""#EXTM3U
-#EXT-X-VERSION:3
-#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
-{base_url}{url_for('streaming.stream_hls_quality', movie_id=movie_id, quality='360p', token=token, _external=True)}
-#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720
-{base_url}{url_for('streaming.stream_hls_quality', movie_id=movie_id, quality='720p', token=token, _external=True)}
-#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080
-{base_url}{url_for('streaming.stream_hls_quality', movie_id=movie_id, quality='1080p', token=token, _external=True)}
-"""
+    stamp, variants = master_ladder(movie)
+    if not variants:
+        return jsonify({'error': 'No playable variants for this movie'}), 404
     
-    return Response(master_playlist, mimetype='application/vnd.apple.mpegurl')
+    playlist = playlist_cache.get(
+        (movie_id, 'master'), stamp,
+        lambda: master_playlist(variants, f'{{name}}/playlist.m3u8?token={TOKEN}')
+    )
+    return playlist_response(playlist, token)
 
 
 @streaming_bp.route('/stream/<int:movie_id>/hls/<quality>/playlist.m3u8')
 def stream_hls_quality(movie_id, quality):
     """
     Serve HLS playlist for specific quality.
-    In production, this would point to pre-processed HLS files.
+    
+    The 'source' quality lists fMP4 segments repackaged on the fly from
+    the movie's MP4 (see services/hls.py), so no re-encoding or packaged
+    files are needed. Other qualities list the packaged .ts segments
+    measured for the ladder.
     """
     token = request.args.get('token')
     if not token or not validate_stream_token(token, movie_id):
         return jsonify({'error': 'Invalid or expired token'}), 403
     
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
+    
+    if quality == 'source':
+        source = source_segment_index(movie)
+        if source is None:
+            return jsonify({'error': 'Source video cannot be segmented'}), 404
+        _, index = source
+        # Relative to /stream/<id>/hls/source/playlist.m3u8
+        playlist = playlist_cache.get(
+            (movie_id, 'source'), _index_stamp(index),
+            lambda: fragment_playlist(index, f'init.mp4?token={TOKEN}',
+                                      f'{{n}}.m4s?token={TOKEN}')
+        )
+        return playlist_response(playlist, token)
     
-    # For demo, create segments from MP4 or placeholder
-    # In production, these would be pre-processed .ts files
-    base_url = request.host_url.rstrip('/')
+    stamp, variants = variant_ladders.get(movie)
+    variant = next((v for v in variants if v.name == quality), None)
+    if variant is None:
+        return jsonify({'error': f'Quality {quality} not available'}), 404
     
-    # Generate segment playlist (simplified)
-    segment_playlist = f"""#EXTM3U
-#EXT-X-VERSION:3
-#EXT-X-TARGETDURATION:10
-#EXT-X-MEDIA-SEQUENCE:0
-#EXT-X-PLAYLIST-TYPE:VOD
-"""
+    playlist = playlist_cache.get(
+        (movie_id, quality), ('ladder', stamp),
+        lambda: segment_playlist(variant.segment_durations, f'{{n}}.ts?token={TOKEN}')
+    )
+    return playlist_response(playlist, token)
+
+
+@streaming_bp.route('/stream/<int:movie_id>/hls/source/init.mp4')
+def stream_source_init(movie_id):
+    """Serve the fMP4 initialization segment of the 'source' quality."""
+    token = request.args.get('token')
+    if not token or not validate_stream_token(token, movie_id):
+        return jsonify({'error': 'Invalid or expired token'}), 403
+    
+    source = source_segment_index(get_movie_or_404(movie_id))
+    if source is None:
+        return jsonify({'error': 'Source video cannot be segmented'}), 404
+    location, _ = source
+    
+    return fragment_response(source_init_segment(location), location, 'init')
+
+
+@streaming_bp.route('/stream/<int:movie_id>/hls/source/<int:segment>.m4s')
+def stream_source_segment(movie_id, segment):
+    """
+    Serve one fMP4 segment of the 'source' quality.
+    
+    Built from the source MP4's samples on first request and then served
+    from the hot-segment cache; the following segments are prefetched
+    (services/readahead.py).
+    """
+    token = request.args.get('token')
+    if not token or not validate_stream_token(token, movie_id):
+        return jsonify({'error': 'Invalid or expired token'}), 403
     
-    # Add segment entries (demo - 10 segments)
-    for i in range(10):
-        segment_playlist += f"#EXTINF:10.0,\n"
-        segment_playlist += f"{base_url}{url_for('streaming.stream_hls_segment', movie_id=movie_id, quality=quality, segment=i, token=token, _external=True)}\n"
+    source = source_segment_index(get_movie_or_404(movie_id))
+    if source is None:
+        return jsonify({'error': 'Source video cannot be segmented'}), 404
+    location, index = source
+    if segment >= len(index.segments):
+        return jsonify({'error': 'Segment not found'}), 404
     
-    segment_playlist += "#EXT-X-ENDLIST"
+    prefetch_after_fragment(movie_id, location, index, segment, token)
     
-    return Response(segment_playlist, mimetype='application/vnd.apple.mpegurl')
+    return fragment_response(source_media_segment(location, index, segment),
+                             location, segment)
 
 
 @streaming_bp.route('/stream/<int:movie_id>/hls/<quality>/<int:segment>.ts')
@@ -195,28 +199,31 @@ def stream_hls_segment(movie_id, quality, segment):
     """
     Serve HLS video segment (.ts file).
     
+    Segments are read from MEDIA_ROOT/hls/<movie_id>/<quality>/<segment>.ts
+    and delivered per MEDIA_DELIVERY (directly or via X-Accel-Redirect /
+    X-Sendfile).
+    
     Production Optimization:
     - Serve from CDN/static file server
-    - Use nginx with X-Accel-Redirect for efficient delivery
     - Cache segments at CDN edge
     """
     token = request.args.get('token')
     if not token or not validate_stream_token(token, movie_id):
         return jsonify({'error': 'Invalid or expired token'}), 403
     
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     
-    # In production, serve actual .ts files
-    # For demo, return a small video chunk
+    location = segment_location(movie_id, secure_filename(quality), segment)
+    if location is None:
+        return jsonify({'error': 'Segment not found'}), 404
     
-    # Demo: Return placeholder response
-    # In production: send_file(f"/path/to/hls/{movie_id}/{quality}/{segment}.ts")
+    # The player will ask for the next segments shortly: start reading them
+    # in the background (services/readahead.py)
+    prefetch_after_segment(movie_id, secure_filename(quality), segment, token)
     
-    return Response(
-        b'\x00' * 1024,  # Dummy segment data
-        mimetype='video/mp2t',
-        headers={'Content-Length': '1024'}
-    )
+    # The first segments of a title are fetched by every viewer; keep hot
+    # ones in memory (services/segment_cache.py)
+    return deliver_file(location.path, 'video/mp2t', location, cacheable=True)
 
 
 @streaming_bp.route('/stream/<int:movie_id>/video')
@@ -226,20 +233,19 @@ def stream_video(movie_id):
     Direct MP4 video streaming with range support.
     
     Features:
-    - Supports HTTP Range requests for seeking
-    - Streams in chunks (4MB by default)
+    - Supports HTTP Range requests for seeking (see services/media.py)
+    - Byte ranges are handed to the server's sendfile where available
     - Token validated for each request
     
     Production Enhancement:
     - Use nginx X-Accel-Redirect for efficient file serving
-    - Implement proper chunked transfer encoding
     - Add CDN support
     """
     token = request.args.get('token')
     if not token or not validate_stream_token(token, movie_id):
         return jsonify({'error': 'Invalid or expired token'}), 403
     
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     
     if not movie.video_url:
         return jsonify({'error': 'Direct streaming not available'}), 404
@@ -253,64 +259,18 @@ def stream_video(movie_id):
             'type': 'redirect'
         })
     
-    # Local file streaming
-    video_path = os.path.join(
-        current_app.root_path,
-        'static',
-        'videos',
-        movie.video_url.lstrip('/static/videos/')
-    )
+    # Local file streaming; the path, size and ETag come from the media
+    # index instead of a stat per range request
+    location = video_location(movie)
     
-    if not os.path.exists(video_path):
+    if location is None:
         return jsonify({'error': 'Video file not found'}), 404
     
-    # Get file size
-    file_size = os.path.getsize(video_path)
-    
-    # Handle range requests for seeking
-    range_header = request.headers.get('Range')
-    
-    if range_header:
-        # Parse range header
-        range_spec = range_header.replace('bytes=', '')
-        start, end = range_spec.split('-')
-        start = int(start)
-        end = int(end) if end else file_size - 1
-        
-        # Limit chunk size (4MB)
-        chunk_size = 4 * 1024 * 1024
-        end = min(end, start + chunk_size - 1)
-        
-        # Open file and seek to position
-        video_file = open(video_path, 'rb')
-        video_file.seek(start)
-        
-        def generate():
-            while video_file.tell() <= end:
-                chunk = video_file.read(8192)
-                if not chunk:
-                    break
-                yield chunk
-            video_file.close()
-        
-        return Response(
-            generate(),
-            status=206,
-            mimetype='video/mp4',
-            headers={
-                'Content-Range': f'bytes {start}-{end}/{file_size}',
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(end - start + 1)
-            }
-        )
-    
-    # Full file download (fallback)
-    return send_file(
-        video_path,
-        mimetype='video/mp4',
-        as_attachment=False,
-        conditional=True
-    )
+    # Either handed to nginx/Apache (MEDIA_DELIVERY) or served here with
+    # full Range/If-Range/ETag support through the server's sendfile path.
+    # Short ranges are cached like .ts segments; long open-ended ranges
+    # stream from disk
+    return deliver_file(location.path, 'video/mp4', location, cacheable=True)
 
 
 @streaming_bp.route('/stream/<int:movie_id>/progress', methods=['POST'])
@@ -325,36 +285,37 @@ def update_progress(movie_id):
     - Every 5-10 seconds during playback
     - On pause
     - On video ended
-    """
-    data = request.get_json()
     
-    current_time = data.get('current_time', 0)
-    total_duration = data.get('total_duration', 0)
+    Reports are buffered and written in batches (services/progress.py).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
     
-    # Get or create progress record
-    progress = current_user.get_watch_progress(movie_id)
-    if not progress:
-        progress = WatchProgress(user_id=current_user.id, movie_id=movie_id)
-        db.session.add(progress)
+    try:
+        current_time = parse_seconds(data.get('current_time', 0))
+        total_duration = parse_seconds(data.get('total_duration', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'current_time and total_duration must be '
+                                 'non-negative numbers of seconds'}), 400
     
-    # Update progress
-    progress.update_progress(current_time, total_duration)
-    db.session.commit()
+    progress_buffer.record(current_user.id, movie_id, current_time, total_duration)
     
     return jsonify({
         'success': True,
-        'progress': progress.to_dict()
+        'progress': progress_dict(current_user.id, movie_id)
     })
 
 
 @streaming_bp.route('/stream/<int:movie_id>/progress')
 @login_required
 def get_progress(movie_id):
-    """Get user's watch progress for a movie."""
-    progress = current_user.get_watch_progress(movie_id)
+    """Get user's watch progress for a movie, including unsaved reports."""
+    progress = progress_dict(current_user.id, movie_id,
+                             current_user.get_watch_progress(movie_id))
     
     if progress:
-        return jsonify(progress.to_dict())
+        return jsonify(progress)
     
     return jsonify({
         'current_time': 0,
@@ -373,42 +334,33 @@ def continue_watching():
     
     Returns movies sorted by last watch time,
     excluding fully watched movies.
-    """
-    from sqlalchemy import desc
-    
-    # Get progress records sorted by last watched
-    progress_list = current_user.watch_progress.order_by(
-        desc(WatchProgress.last_watched_at)
-    ).limit(10).all()
     
-    continue_watching = []
-    for progress in progress_list:
-        if not progress.is_completed():
-            movie = Movie.query.get(progress.movie_id)
-            if movie:
-                continue_watching.append({
-                    'movie': movie.to_dict(),
-                    'progress': progress.to_dict()
-                })
-    
-    return jsonify(continue_watching)
+    One joined query, cached per user (services/continue_watching.py).
+    """
+    return jsonify(continue_watching_cache.get(current_user.id))
 
 
 @streaming_bp.route('/streaming-stats')
 @login_required
 def streaming_stats():
     """Get streaming statistics for admin."""
-    cleanup_expired_tokens()
-    
+    store = current_app.extensions['stream_token_store']
     stats = {
-        'active_tokens': len(STREAM_TOKENS),
-        'active_users': len(set(t['user_id'] for t in STREAM_TOKENS.values())),
+        'token_mode': current_app.config['STREAM_TOKEN_BACKEND'],
+        'token_ttl_seconds': current_app.config['STREAM_TOKEN_TTL'],
+        'movie_cache': movie_cache.stats(),
+        'playlist_cache': playlist_cache.stats(),
+        'source_files': source_files.stats(),
+        'segment_cache': segment_cache.stats(),
+        'readahead': readahead.stats(),
+        'progress_buffer': progress_buffer.stats(),
+        'continue_watching_cache': continue_watching_cache.stats(),
+        'user_cache': user_principals.stats(),
         'server_time': datetime.utcnow().isoformat()
     }
+    if store is not None:
+        stats.update(store.stats())
     
     return jsonify(stats)
 
 
-# Import url_for at module level to avoid circular imports
-from flask import url_for
-
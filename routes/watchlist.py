@@ -1,14 +1,15 @@
 from flask import Blueprint, redirect, url_for, flash, render_template
 from flask_login import login_required, current_user
-from models import Movie, watchlist
+from models import watchlist
 from extensions import db
+from services.movie_cache import get_movie_or_404
 
 watchlist_bp = Blueprint('watchlist', __name__)
 
 @watchlist_bp.route('/watchlist/add/<int:movie_id>')
 @login_required
 def add(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     current_user.add_to_watchlist(movie)
     db.session.commit()
     flash(f'"{movie.title}" added to your watchlist!', 'success')
@@ -17,7 +18,7 @@ def add(movie_id):
 @watchlist_bp.route('/watchlist/remove/<int:movie_id>')
 @login_required
 def remove(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    movie = get_movie_or_404(movie_id)
     current_user.remove_from_watchlist(movie)
     db.session.commit()
     flash(f'"{movie.title}" removed from your watchlist.', 'info')
@@ -0,0 +1,6 @@
+"""
+Service layer shared by the route blueprints.
+
+Routes stay thin: query building, caching and media handling live here
+so the HTML pages and the JSON API use the same code paths.
+"""
@@ -0,0 +1,29 @@
+"""
+Catalog query building shared by the HTML grid and the JSON API.
+"""
+
+from models import Movie
+from services.search import apply_search
+
+
+def catalog_query(search='', category='', mode='default'):
+    """
+    Return ``(query, ranked)`` for the catalog grid.
+    
+    Without a search the query is unordered so the caller can paginate it
+    by its own key. With a search the active backend may order results by
+    relevance, in which case ``ranked`` is True. ``mode='fuzzy'`` matches
+    misspelled titles.
+    """
+    query = Movie.query
+    ranked = False
+
+    # Filter before searching: fuzzy search caps its matches and must only
+    # count those that pass the filter
+    if category:
+        query = query.filter_by(category=category)
+
+    if search:
+        query, ranked = apply_search(query, search, mode)
+
+    return query, ranked
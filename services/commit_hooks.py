@@ -0,0 +1,44 @@
+"""
+Run cache invalidation once a transaction commits.
+
+Caches must not be dropped at flush time: a concurrent reader could load
+and re-cache the old rows before the transaction commits. ``on_commit``
+collects keys from ORM write events into ``session.info`` and hands them
+to a callback after the commit; a rollback discards them.
+"""
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+WRITES = ('after_insert', 'after_update', 'after_delete')
+
+
+def on_commit(model, key_fn, callback, events=WRITES):
+    """
+    Call ``callback(keys)`` after a transaction that wrote ``model`` commits.
+
+    ``key_fn(target)`` maps each written instance to a hashable key, or to
+    None to ignore that write; ``keys`` is the set of collected keys.
+    """
+    info_key = object()
+
+    def remember(mapper, connection, target):
+        session = inspect(target).session
+        if session is None:
+            return
+        key = key_fn(target)
+        if key is not None:
+            session.info.setdefault(info_key, set()).add(key)
+
+    def run(session):
+        keys = session.info.pop(info_key, None)
+        if keys:
+            callback(keys)
+
+    def forget(session):
+        session.info.pop(info_key, None)
+
+    for name in events:
+        event.listen(model, name, remember)
+    event.listen(Session, 'after_commit', run)
+    event.listen(Session, 'after_rollback', forget)
@@ -0,0 +1,62 @@
+"""
+Continue Watching rail.
+
+The rail is the user's ``CONTINUE_WATCHING_LIMIT`` most recently watched
+unfinished titles. Completion is filtered in SQL
+(``WatchProgress.in_progress()``, served by the partial index
+``ix_watch_progress_user_in_progress``) and the movies are joined in the
+same query, so the rail always has the full number of items when the user
+has that many in progress, whatever they finished recently.
+
+Rails are cached per user for ``CONTINUE_WATCHING_CACHE_TTL`` seconds. A
+flush of buffered progress (services/progress.py) drops the rails of the
+users it wrote, so a rail is at most one flush interval behind this
+worker's own reports; the TTL bounds staleness from other workers and from
+movie edits.
+"""
+
+from flask import current_app
+from sqlalchemy.orm import contains_eager
+
+from models import Movie, WatchProgress
+from services.lru import LRUCache
+
+
+def continue_watching_query(user_id, limit):
+    """The rail's query: unfinished ``WatchProgress`` rows with their movies."""
+    return (
+        WatchProgress.query
+        .join(Movie, Movie.id == WatchProgress.movie_id)
+        .options(contains_eager(WatchProgress.movie).selectinload(Movie.variants))
+        .filter(WatchProgress.user_id == user_id, WatchProgress.in_progress())
+        .order_by(WatchProgress.last_watched_at.desc())
+        .limit(limit)
+    )
+
+
+def query_continue_watching(user_id, limit):
+    """``[{'movie', 'progress'}]`` for the user's unfinished titles, newest first."""
+    rows = continue_watching_query(user_id, limit).all()
+    return [{'movie': row.movie.to_dict(), 'progress': row.to_dict()} for row in rows]
+
+
+class ContinueWatchingCache(LRUCache):
+    """LRU of user id -> rail, bounded by ``CONTINUE_WATCHING_CACHE_SIZE``."""
+
+    def __init__(self):
+        super().__init__('CONTINUE_WATCHING_CACHE_SIZE')
+
+    def get(self, user_id):
+        config = current_app.config
+        return self.fetch(
+            user_id,
+            lambda: query_continue_watching(user_id, config['CONTINUE_WATCHING_LIMIT']),
+            ttl=config['CONTINUE_WATCHING_CACHE_TTL'],
+        )
+
+    def invalidate_users(self, user_ids):
+        user_ids = set(user_ids)
+        self.invalidate_where(lambda user_id: user_id in user_ids)
+
+
+continue_watching_cache = ContinueWatchingCache()
@@ -0,0 +1,117 @@
+"""
+Cached catalog facets for the browse page.
+
+The category dropdown used to cost a ``SELECT DISTINCT category`` over the
+whole movies table on every catalog view. Facets are now computed once by
+a single ``GROUP BY`` over (category, decade, rating band) and rolled up in
+Python into per-category counts, year buckets and rating buckets.
+
+The result is cached per process. Any committed insert, delete, or update
+that touches a faceted column drops the cache; ``FACET_CACHE_TTL`` bounds
+staleness for writes made by other workers.
+"""
+
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import Integer, cast, func, inspect
+
+from extensions import db
+from models import Movie
+from services.commit_hooks import on_commit
+
+_FACET_COLUMNS = ('category', 'release_year', 'rating')
+
+
+class CatalogFacets:
+    """Immutable snapshot of facet counts."""
+
+    def __init__(self, categories, years, ratings, total):
+        self.categories = categories    # [(category, count)] by name
+        self.years = years              # [(decade, count)] newest first
+        self.ratings = ratings          # [(whole-star floor, count)] best first
+        self.total = total
+
+    @property
+    def category_names(self):
+        return [name for name, _ in self.categories]
+
+    @property
+    def category_counts(self):
+        return dict(self.categories)
+
+    def to_dict(self):
+        return {
+            'categories': [{'name': name, 'count': count} for name, count in self.categories],
+            'years': [{'decade': decade, 'count': count} for decade, count in self.years],
+            'ratings': [{'min_rating': band, 'count': count} for band, count in self.ratings],
+            'total': self.total,
+        }
+
+
+def compute_facets():
+    """Run the single aggregate query and roll it up."""
+    decade = (Movie.release_year // 10) * 10
+    band = cast(Movie.rating, Integer)
+    rows = db.session.query(Movie.category, decade, band, func.count(Movie.id)) \
+        .group_by(Movie.category, decade, band).all()
+
+    categories, years, ratings = Counter(), Counter(), Counter()
+    total = 0
+    for category, decade_value, band_value, count in rows:
+        total += count
+        if category:
+            categories[category] += count
+        if decade_value is not None:
+            years[int(decade_value)] += count
+        if band_value is not None:
+            ratings[int(band_value)] += count
+
+    return CatalogFacets(
+        categories=sorted(categories.items()),
+        years=sorted(years.items(), reverse=True),
+        ratings=sorted(ratings.items(), reverse=True),
+        total=total,
+    )
+
+
+class FacetCache:
+    """Process-level facet cache, dropped on committed catalog writes."""
+
+    def __init__(self):
+        self._facets = None
+        self._computed_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._facets = None
+
+    def get(self, ttl):
+        facets = self._facets
+        if facets is not None and time.monotonic() - self._computed_at < ttl:
+            return facets
+        with self._lock:
+            if self._facets is None or time.monotonic() - self._computed_at >= ttl:
+                self._facets = compute_facets()
+                self._computed_at = time.monotonic()
+            return self._facets
+
+
+facet_cache = FacetCache()
+
+
+def _faceted_change(movie):
+    state = inspect(movie)
+    if any(state.attrs[name].history.has_changes() for name in _FACET_COLUMNS):
+        return True
+    return None
+
+
+def _drop_facets(_):
+    facet_cache.invalidate()
+
+
+# Drop the cache once a transaction that changed a faceted value commits
+on_commit(Movie, lambda movie: True, _drop_facets, events=('after_insert', 'after_delete'))
+on_commit(Movie, _faceted_change, _drop_facets, events=('after_update',))
@@ -0,0 +1,164 @@
+"""
+Typo-tolerant title search.
+
+On PostgreSQL this uses ``pg_trgm``: the ``<%`` (word similarity) operator
+is answered from the GIN trigram index on ``movies.title`` and results are
+ordered by ``word_similarity``. Other databases use ``TrigramIndex``, an
+in-process inverted index from trigram to movie ids built from the
+``movies`` table with the same trigram rules as ``pg_trgm``, so both
+backends rank misspellings ("interstelar", "dark knigt") the same way.
+
+The in-process index is dropped once a transaction that changed a title
+commits, and rebuilt after ``FUZZY_INDEX_TTL`` seconds regardless so that
+workers which did not handle the write converge.
+"""
+
+import re
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import DDL, case, event, func, inspect, text
+
+from extensions import db
+from models import Movie
+from services.commit_hooks import on_commit
+
+# The trigram index on movies.title (declared on the model) needs the
+# extension to exist before db.create_all() builds it.
+event.listen(
+    Movie.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def trigrams(value):
+    """
+    Return the set of trigrams of ``value`` the way pg_trgm computes them:
+    lower-cased alphanumeric words, each padded with two leading spaces and
+    one trailing space.
+    """
+    grams = set()
+    for word in _WORD_RE.findall(value.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Inverted trigram index over movie titles.
+
+    Similarity is the share of the query's trigrams found in a title, which
+    tracks pg_trgm's ``word_similarity`` closely enough for ranking. The
+    index is rebuilt lazily on the first search after ``invalidate`` or
+    once it is older than the ``ttl`` passed to ``search``.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._built_at = None
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _stale(self, ttl):
+        return self._built_at is None or time.monotonic() - self._built_at > ttl
+
+    def _build(self):
+        postings = defaultdict(set)
+        sizes = {}
+        for movie_id, title in db.session.query(Movie.id, Movie.title):
+            grams = trigrams(title or '')
+            sizes[movie_id] = len(grams)
+            for gram in grams:
+                postings[gram].add(movie_id)
+        self._postings = postings
+        self._sizes = sizes
+        self._built_at = time.monotonic()
+
+    def search(self, value, threshold, ttl):
+        """Return every ``(movie_id, score)`` at or above ``threshold``, best first."""
+        query_grams = trigrams(value)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            if self._stale(ttl):
+                self._build()
+            hits = defaultdict(int)
+            for gram in query_grams:
+                for movie_id in self._postings.get(gram, ()):
+                    hits[movie_id] += 1
+
+        scored = [
+            (movie_id, count / len(query_grams))
+            for movie_id, count in hits.items()
+            if count / len(query_grams) >= threshold
+        ]
+        scored.sort(key=lambda item: (-item[1], -item[0]))
+        return scored
+
+
+title_index = TrigramIndex()
+
+
+def _title_change(movie):
+    if inspect(movie).attrs.title.history.has_changes():
+        return True
+    return None
+
+
+def _drop_title_index(_):
+    title_index.invalidate()
+
+
+# Drop the index once a transaction that changed a title commits
+on_commit(Movie, lambda movie: True, _drop_title_index, events=('after_insert', 'after_delete'))
+on_commit(Movie, _title_change, _drop_title_index, events=('after_update',))
+
+
+def fuzzy_search(query, search):
+    """
+    Filter ``query`` to titles similar to ``search``, best match first.
+
+    Returns ``(query, True)``; the result is always ranked.
+    """
+    threshold = current_app.config['FUZZY_SEARCH_THRESHOLD']
+
+    if db.engine.dialect.name == 'postgresql':
+        # Scope the operator threshold to this transaction only.
+        db.session.execute(
+            text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+            {'t': str(threshold)}
+        )
+        similarity = func.word_similarity(search, Movie.title)
+        query = query.filter(Movie.title.op('%>')(search)) \
+            .order_by(similarity.desc(), Movie.id.desc())
+        return query, True
+
+    matches = title_index.search(search, threshold, current_app.config['FUZZY_INDEX_TTL'])
+    if matches:
+        # Apply the caller's filters (e.g. category) before the cap, so a
+        # narrow filter still sees its best matches
+        allowed = {
+            movie_id for movie_id, in query.with_entities(Movie.id).order_by(None)
+            .filter(Movie.id.in_([movie_id for movie_id, _ in matches]))
+        }
+        matches = [match for match in matches if match[0] in allowed]
+        matches = matches[:current_app.config['FUZZY_SEARCH_LIMIT']]
+    if not matches:
+        return query.filter(db.false()), True
+
+    ranking = case(
+        {movie_id: position for position, (movie_id, _) in enumerate(matches)},
+        value=Movie.id
+    )
+    query = query.filter(Movie.id.in_([movie_id for movie_id, _ in matches])) \
+        .order_by(ranking)
+    return query, True
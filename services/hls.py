@@ -0,0 +1,330 @@
+"""
+HLS for movies stored as a single MP4, served as fragmented MP4.
+
+The first request for a movie's playlist parses the MP4's sample tables
+(``services/mp4.py``) into keyframe-aligned segments and persists the
+result as JSON under ``HLS_INDEX_DIR``. Later requests, in this or any
+other worker, read the stored index instead of the file; an index is
+rebuilt when the source file's size or mtime, or ``HLS_SEGMENT_TARGET``,
+no longer match what it was built from.
+
+The media playlist points at an initialization segment (``EXT-X-MAP``)
+and one fMP4 segment per index entry, each built on request from the
+source samples and kept in the hot-segment cache. Building one needs the
+parsed sample tables, which are kept for the ``HLS_SOURCE_CACHE_SIZE``
+most recently used files in each worker.
+
+Playlist text only differs between viewers in the stream token, so each
+(movie, quality) playlist is compiled once into the text around a token
+placeholder and cached in ``playlist_cache``; a request just joins the
+pieces with its own token. A compiled playlist carries a stamp of what it
+was built from (the source file identity, or the movie's ``updated_at``)
+and is rebuilt when the stamp changes; committed movie writes drop the
+movie's playlists in this process immediately. URIs inside playlists are
+relative, so they resolve against whatever host the player used.
+"""
+
+import hashlib
+import json
+import math
+import os
+import threading
+import zlib
+from collections import namedtuple
+
+from flask import Response, current_app, request
+from models import Movie
+from services.commit_hooks import on_commit
+from services.lru import LRUCache
+from services.mp4 import (
+    Segment, UnsupportedMP4, init_segment, keyframe_segments, media_segment, read_mp4,
+)
+from services.segment_cache import cached_bytes, read_segment
+
+INDEX_FORMAT = 4
+
+
+class SegmentIndex:
+    """Keyframe segments of one source MP4."""
+
+    def __init__(self, size, mtime_ns, target_duration, duration, width, height, codecs,
+                 segments):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.target_duration = target_duration
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.codecs = codecs
+        self.segments = segments
+
+    def matches(self, location, target_duration):
+        return (self.size, self.mtime_ns, self.target_duration) == \
+            (location.size, location.mtime_ns, target_duration)
+
+    @property
+    def bandwidth(self):
+        """Peak bits per second over all segments (EXT-X-STREAM-INF BANDWIDTH)."""
+        return max(
+            math.ceil(seg.size * 8 / seg.duration) if seg.duration else 0
+            for seg in self.segments
+        )
+
+    @property
+    def average_bandwidth(self):
+        """Mean bits per second (EXT-X-STREAM-INF AVERAGE-BANDWIDTH)."""
+        if not self.duration:
+            return self.bandwidth
+        return math.ceil(sum(seg.size for seg in self.segments) * 8 / self.duration)
+
+    def to_dict(self):
+        return {
+            'format': INDEX_FORMAT,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'target_duration': self.target_duration,
+            'duration': self.duration,
+            'width': self.width,
+            'height': self.height,
+            'codecs': self.codecs,
+            'segments': [[seg.start, seg.duration, seg.size, [list(r) for r in seg.samples]]
+                         for seg in self.segments],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('format') != INDEX_FORMAT:
+            raise ValueError('unknown index format')
+        return cls(
+            data['size'], data['mtime_ns'], data['target_duration'], data['duration'],
+            data['width'], data['height'], data['codecs'],
+            [Segment(start, duration, size, tuple(tuple(r) for r in samples))
+             for start, duration, size, samples in data['segments']],
+        )
+
+
+class SourceFileCache(LRUCache):
+    """LRU of file identity -> parsed ``SourceMP4``, bounded by ``HLS_SOURCE_CACHE_SIZE``."""
+
+    def __init__(self):
+        super().__init__('HLS_SOURCE_CACHE_SIZE')
+
+    def get(self, location):
+        def load():
+            with open(location.path, 'rb') as fileobj:
+                return read_mp4(fileobj)
+
+        return self.fetch((location.path, location.size, location.mtime_ns), load)
+
+
+source_files = SourceFileCache()
+
+
+def build_segment_index(location, target_duration):
+    """Parse ``location``'s MP4 into a ``SegmentIndex``."""
+    tracks = source_files.get(location).tracks
+    video = tracks[0]
+    # CODECS must list every codec in the variant; omit it if one is unknown
+    codecs = None
+    if all(track.codec for track in tracks):
+        codecs = ','.join(track.codec for track in tracks)
+    return SegmentIndex(
+        location.size, location.mtime_ns, target_duration, video.duration,
+        video.width, video.height, codecs, keyframe_segments(tracks, target_duration),
+    )
+
+
+def source_init_segment(location):
+    """fMP4 initialization segment of ``location``'s MP4."""
+    return cached_bytes(
+        ('fmp4', location.path, location.size, location.mtime_ns, 'init'),
+        lambda: init_segment(source_files.get(location)),
+    )
+
+
+def source_media_segment(location, index, n):
+    """fMP4 media segment ``n`` of ``location``'s MP4 (``index`` must match it)."""
+    def build():
+        source = source_files.get(location)
+        return media_segment(source, index.segments[n], n + 1,
+                             lambda start, stop: read_segment(location, start, stop))
+
+    return cached_bytes(('fmp4', location.path, location.size, location.mtime_ns, n), build)
+
+
+def _index_path(movie_id):
+    directory = current_app.config['HLS_INDEX_DIR'] or \
+        os.path.join(current_app.instance_path, 'hls_index')
+    return os.path.join(directory, f'{movie_id}.json')
+
+
+def _read_index(path):
+    try:
+        with open(path) as f:
+            return SegmentIndex.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_index(path, index):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index.to_dict(), f, separators=(',', ':'))
+    # Atomic so concurrent workers never read a half-written index
+    os.replace(tmp_path, path)
+
+
+class SegmentIndexStore:
+    """Process-local view of the persisted indexes, keyed by movie id."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._unsupported = {}
+        self._lock = threading.Lock()
+
+    def get(self, movie_id, location):
+        """Return the ``SegmentIndex`` for ``location`` or None if it cannot be segmented."""
+        target = current_app.config['HLS_SEGMENT_TARGET']
+        identity = (location.size, location.mtime_ns, target)
+        index = self._indexes.get(movie_id)
+        if index is not None and index.matches(location, target):
+            return index
+        if self._unsupported.get(movie_id) == identity:
+            return None
+
+        path = _index_path(movie_id)
+        index = _read_index(path)
+        if index is None or not index.matches(location, target):
+            try:
+                index = build_segment_index(location, target)
+            except (OSError, UnsupportedMP4) as exc:
+                current_app.logger.warning('Cannot segment movie %s: %s', movie_id, exc)
+                with self._lock:
+                    self._unsupported[movie_id] = identity
+                return None
+            try:
+                _write_index(path, index)
+            except OSError as exc:
+                # Still served from memory; rebuilt by the next process
+                current_app.logger.warning('Cannot store the segment index of movie %s: %s',
+                                           movie_id, exc)
+
+        with self._lock:
+            self._indexes[movie_id] = index
+            self._unsupported.pop(movie_id, None)
+        return index
+
+    def invalidate(self, movie_id):
+        with self._lock:
+            self._indexes.pop(movie_id, None)
+            self._unsupported.pop(movie_id, None)
+
+
+segment_indexes = SegmentIndexStore()
+
+
+# Stands in for the stream token in compiled playlists; cannot occur in a
+# URL-safe token or anywhere else in playlist text
+TOKEN = '\0'
+
+
+def master_playlist(variants, uri_template, version=3):
+    """
+    Master playlist for ``services.ladder.Variant`` rungs, in the given
+    order; ``uri_template`` takes ``{name}``.
+    """
+    lines = ['#EXTM3U', f'#EXT-X-VERSION:{version}']
+    for variant in variants:
+        attributes = [f'BANDWIDTH={variant.bandwidth}']
+        if variant.average_bandwidth:
+            attributes.append(f'AVERAGE-BANDWIDTH={variant.average_bandwidth}')
+        if variant.codecs:
+            attributes.append(f'CODECS="{variant.codecs}"')
+        if variant.width and variant.height:
+            attributes.append(f'RESOLUTION={variant.width}x{variant.height}')
+        lines.append(f'#EXT-X-STREAM-INF:{",".join(attributes)}')
+        lines.append(uri_template.format(name=variant.name))
+    return '\n'.join(lines) + '\n'
+
+
+def _media_playlist(durations, uri_template, version, map_uri=None):
+    """VOD playlist of segments ``uri_template.format(n=n)`` with ``durations``."""
+    lines = [
+        '#EXTM3U',
+        f'#EXT-X-VERSION:{version}',
+        f'#EXT-X-TARGETDURATION:{math.ceil(max(durations))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    if map_uri:
+        lines.append(f'#EXT-X-MAP:URI="{map_uri}"')
+    for n, duration in enumerate(durations):
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(uri_template.format(n=n))
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def fragment_playlist(index, init_uri, uri_template):
+    """Media playlist of fMP4 segments initialized by ``init_uri``; ``uri_template`` takes ``{n}``."""
+    return _media_playlist([seg.duration for seg in index.segments], uri_template,
+                           version=7, map_uri=init_uri)
+
+
+def segment_playlist(durations, uri_template):
+    """Media playlist of separate segment files; ``uri_template`` takes ``{n}``."""
+    return _media_playlist(durations, uri_template, version=3)
+
+
+CompiledPlaylist = namedtuple('CompiledPlaylist', 'stamp version parts')
+
+
+class PlaylistCache(LRUCache):
+    """LRU of (movie_id, name) -> ``CompiledPlaylist``, bounded by ``HLS_PLAYLIST_CACHE_SIZE``."""
+
+    def __init__(self):
+        super().__init__('HLS_PLAYLIST_CACHE_SIZE')
+
+    def get(self, key, stamp, build):
+        """Return the compiled playlist for ``key``, calling ``build()`` if stale."""
+        def load():
+            text = build()
+            return CompiledPlaylist(
+                stamp,
+                hashlib.sha1(text.encode()).hexdigest()[:16],
+                tuple(text.split(TOKEN)),
+            )
+
+        return self.fetch(key, load, fresh=lambda entry: entry.stamp == stamp)
+
+    def invalidate_movie(self, movie_id):
+        self.invalidate_where(lambda key: key[0] == movie_id)
+
+
+playlist_cache = PlaylistCache()
+
+
+def playlist_response(playlist, token):
+    """
+    Render a compiled playlist for ``token``.
+
+    Playlists embed the viewer's token, so they may only be cached
+    privately; the ETag covers both the compiled text and the token.
+    """
+    response = Response(token.join(playlist.parts), mimetype='application/vnd.apple.mpegurl')
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['HLS_PLAYLIST_MAX_AGE']
+    response.set_etag(f'{playlist.version}-{zlib.crc32(token.encode()):08x}')
+    return response.make_conditional(request)
+
+
+def _drop_changed_media(movie_ids):
+    for movie_id in movie_ids:
+        playlist_cache.invalidate_movie(movie_id)
+        segment_indexes.invalidate(movie_id)
+
+
+# Drop a movie's playlists and segment index once a write to it commits
+on_commit(Movie, lambda movie: movie.id, _drop_changed_media,
+          events=('after_update', 'after_delete'))
@@ -0,0 +1,256 @@
+"""
+Quality ladder: the HLS variants a movie actually has.
+
+A rung is either
+
+- 'source': the movie's local MP4 repackaged as fMP4 segments
+  (services/hls.py), measured from its segment index, with codecs read
+  from the MP4; or
+- a packaged rendition (a ``MovieVariant`` row, e.g. '720p') whose
+  segments exist as ``MEDIA_ROOT/hls/<movie_id>/<quality>/<n>.ts``
+  next to the packager's ``playlist.m3u8``. Bitrates are measured from
+  the segment file sizes and the durations in that playlist.
+
+Remote variant URLs cannot be measured and are not advertised.
+
+The ladder is measured at ingest (``ingest_ladder`` after a movie is
+created or edited) and written onto the movie's ``MovieVariant`` rows,
+with a 'source' row for the MP4; the master playlist is built from those
+rows, so every host advertises the same rungs without touching the
+media. A movie that was never ingested falls back to a ladder measured
+on the host serving it.
+
+Each host also keeps the measured ladder as JSON next to the segment
+indexes, together with the segment durations the rendition playlists are
+generated from. It is re-measured when the movie's ``video_url``, its
+variants, or the size or mtime of the source file or of a packaged
+``playlist.m3u8`` no longer match.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import namedtuple
+
+from flask import current_app
+
+from models import MovieVariant
+from services.hls import segment_indexes
+from services.media_index import media_root, playlist_location, video_location
+
+LADDER_FORMAT = 3
+
+# Bitrates in bits per second; segment_durations is None for 'source'
+Variant = namedtuple(
+    'Variant',
+    'name width height bandwidth average_bandwidth codecs byte_size segment_durations',
+)
+
+_EXTINF = re.compile(r'#EXTINF:([0-9.]+)')
+
+SOURCE = 'source'
+
+
+def _is_local(url):
+    return url and not url.startswith(('http://', 'https://'))
+
+
+def _source_variant(movie, location):
+    index = segment_indexes.get(movie.id, location)
+    if index is None:
+        return None
+    return Variant(SOURCE, index.width, index.height, index.bandwidth,
+                   index.average_bandwidth, index.codecs, index.size, None)
+
+
+def _packaged_variant(movie_id, quality, aspect):
+    """Measure ``MEDIA_ROOT/hls/<id>/<quality>``, or None if not packaged."""
+    directory = os.path.join(media_root(), 'hls', str(movie_id), quality)
+    try:
+        with open(os.path.join(directory, 'playlist.m3u8')) as f:
+            durations = [float(d) for d in _EXTINF.findall(f.read())]
+        sizes = [os.path.getsize(os.path.join(directory, f'{n}.ts'))
+                 for n in range(len(durations))]
+    except (OSError, ValueError):
+        return None
+    if not durations or not sum(durations):
+        return None
+
+    peak = max(math.ceil(size * 8 / d) for size, d in zip(sizes, durations) if d)
+    average = math.ceil(sum(sizes) * 8 / sum(durations))
+    match = re.fullmatch(r'(\d+)p', quality)
+    height = int(match.group(1)) if match else None
+    # Width is not recorded in MPEG-TS headers; derive it from the aspect
+    width = 2 * round(height * aspect / 2) if height else None
+    return Variant(quality, width, height, peak, average, None, sum(sizes), durations)
+
+
+def _packaged_rows(movie):
+    return [row for row in movie.variants if row.quality != SOURCE]
+
+
+def measure_ladder(movie):
+    """Return the movie's variants, lowest bandwidth first."""
+    variants = []
+    aspect = 16 / 9
+    location = video_location(movie) if _is_local(movie.video_url) else None
+    if location is not None:
+        source = _source_variant(movie, location)
+        if source is not None:
+            variants.append(source)
+            if source.width and source.height:
+                aspect = source.width / source.height
+
+    for row in _packaged_rows(movie):
+        variant = _packaged_variant(movie.id, os.path.basename(row.quality), aspect)
+        if variant is not None:
+            variants.append(variant)
+
+    variants.sort(key=lambda v: v.bandwidth)
+    return variants
+
+
+def store_measurements(movie, variants):
+    """
+    Write measured ``variants`` onto the movie's ``MovieVariant`` rows
+    (caller commits). Adds or drops the 'source' row; rows of rungs that
+    were not measured lose their measurements and are no longer advertised.
+    """
+    measured = {v.name: v for v in variants}
+    rows = {row.quality: row for row in movie.variants}
+    if SOURCE in measured and SOURCE not in rows:
+        rows[SOURCE] = MovieVariant(quality=SOURCE, url=movie.video_url)
+        movie.variants.append(rows[SOURCE])
+    elif SOURCE not in measured and SOURCE in rows:
+        movie.variants.remove(rows.pop(SOURCE))
+    if SOURCE in rows:
+        rows[SOURCE].url = movie.video_url
+
+    for quality, row in rows.items():
+        variant = measured.get(os.path.basename(quality))
+        if variant is None:
+            row.bitrate = row.average_bitrate = row.codec = row.byte_size = None
+            continue
+        row.width = variant.width
+        row.height = variant.height or row.height
+        row.bitrate = variant.bandwidth
+        row.average_bitrate = variant.average_bandwidth
+        row.codec = variant.codecs
+        row.byte_size = variant.byte_size
+
+
+def ingest_ladder(movie):
+    """
+    Measure ``movie``'s ladder and store it on its rows (caller commits).
+
+    Runs once the movie itself is saved, so a filesystem error is logged
+    rather than failing the request; the master playlist then falls back
+    to measuring on the serving host. Returns whether the rows were updated.
+    """
+    try:
+        _, variants = variant_ladders.refresh(movie)
+    except OSError:
+        current_app.logger.exception('Cannot measure the quality ladder of movie %s', movie.id)
+        return False
+    store_measurements(movie, variants)
+    return True
+
+
+def master_ladder(movie):
+    """
+    ``(stamp, variants)`` to advertise in the master playlist: the
+    measured ``MovieVariant`` rows, lowest bandwidth first, or the ladder
+    measured on this host if the movie was never ingested.
+    """
+    rows = sorted((row for row in movie.variants if row.bitrate), key=lambda row: row.bitrate)
+    if not rows:
+        stamp, variants = variant_ladders.get(movie)
+        return ('measured', stamp), variants
+    variants = [
+        Variant(os.path.basename(row.quality), row.width, row.height, row.bitrate,
+                row.average_bitrate, row.codec, row.byte_size, None)
+        for row in rows
+    ]
+    return ('rows', variants), variants
+
+
+def _file_stamp(location):
+    return [location.size, location.mtime_ns] if location else None
+
+
+def _ladder_stamp(movie):
+    location = video_location(movie) if _is_local(movie.video_url) else None
+    # Re-packaging a rendition rewrites its playlist
+    packaged = [
+        [v.quality, v.url, _file_stamp(playlist_location(movie.id, os.path.basename(v.quality)))]
+        for v in _packaged_rows(movie)
+    ]
+    return [movie.video_url, packaged, _file_stamp(location)]
+
+
+def _ladder_path(movie_id):
+    directory = current_app.config['HLS_INDEX_DIR'] or \
+        os.path.join(current_app.instance_path, 'hls_index')
+    return os.path.join(directory, f'{movie_id}.ladder.json')
+
+
+class LadderStore:
+    """Process-local view of the stored ladders: movie id -> (stamp, variants)."""
+
+    def __init__(self):
+        self._ladders = {}
+        self._lock = threading.Lock()
+
+    def get(self, movie):
+        """Return ``(stamp, variants)`` for ``movie``, measuring only if stale."""
+        stamp = _ladder_stamp(movie)
+        cached = self._ladders.get(movie.id)
+        if cached is not None and cached[0] == stamp:
+            return cached
+
+        cached = None
+        try:
+            with open(_ladder_path(movie.id)) as f:
+                data = json.load(f)
+            if data['format'] == LADDER_FORMAT and data['stamp'] == stamp:
+                cached = (stamp, [Variant(**v) for v in data['variants']])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        if cached is None:
+            return self.refresh(movie)
+        with self._lock:
+            self._ladders[movie.id] = cached
+        return cached
+
+    def refresh(self, movie):
+        """Measure and store ``movie``'s ladder now (called at ingest)."""
+        stamp = _ladder_stamp(movie)
+        variants = measure_ladder(movie)
+        path = _ladder_path(movie.id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'format': LADDER_FORMAT,
+                    'stamp': stamp,
+                    'variants': [v._asdict() for v in variants],
+                }, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            # Still served from memory; measured again by the next process
+            current_app.logger.warning('Cannot store the ladder of movie %s: %s', movie.id, exc)
+
+        with self._lock:
+            self._ladders[movie.id] = (stamp, variants)
+        return stamp, variants
+
+    def invalidate(self, movie_id):
+        with self._lock:
+            self._ladders.pop(movie_id, None)
+
+
+variant_ladders = LadderStore()
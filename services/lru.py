@@ -0,0 +1,82 @@
+"""
+Thread-safe LRU cache shared by the per-worker read-through caches
+(principals, movies, parsed source files, playlists, rails).
+
+Entries optionally expire after a TTL and can be checked against the
+caller's idea of freshness (a file stamp, say). On a miss the value is
+loaded outside the lock, so a slow load never blocks hits on other keys;
+two requests missing the same key at once may both load it, and the last
+one wins. The size bound is read from the app config on every insert so
+tests and deployments can tune it at runtime.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LRUCache:
+    """
+    LRU of key -> (expires_at, value), bounded by the config setting ``size_setting``.
+
+    Subclasses wrap ``fetch`` in a ``get`` that knows how to load their values.
+    """
+
+    def __init__(self, size_setting):
+        self._size_setting = size_setting
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, key, load, ttl=None, fresh=None):
+        """
+        Return the cached value for ``key``, calling ``load()`` on a miss.
+
+        ``ttl`` is a number of seconds, a function of the loaded value, or
+        None for no expiry. ``fresh(value)``, when given, must return True
+        for a cached value to be served. A load that returns None is not
+        cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > now) \
+                    and (fresh is None or fresh(entry[1])):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load()
+        if value is None:
+            return None
+        if callable(ttl):
+            ttl = ttl(value)
+        expires_at = None if ttl is None else now + ttl
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > current_app.config[self._size_setting]:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key satisfies ``predicate(key)``."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
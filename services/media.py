@@ -0,0 +1,304 @@
+"""
+Byte-range file delivery for the streaming routes.
+
+``serve_file`` answers plain, conditional and ``Range`` requests for a
+local media file:
+
+- single ranges (``bytes=a-b``, open-ended ``bytes=a-``, suffix
+  ``bytes=-N``) return 206 with the file positioned at the range start and
+  handed to the server's ``wsgi.file_wrapper`` as a ``FileSlice``, which
+  stops reading at the end of the range. Servers such as gunicorn turn it
+  into ``os.sendfile`` bounded by ``Content-Length``, so the bytes go from
+  page cache to socket without passing through Python.
+- multiple ranges return a ``multipart/byteranges`` body read with
+  ``os.pread`` in large blocks.
+- ``If-Range`` is honoured against a strong ETag (mtime + size) or the
+  Last-Modified date; a mismatch sends the full file.
+- ranges that start past the end of the file return 416.
+
+Without a ``wsgi.file_wrapper`` (the development server, the test client)
+the file is streamed in ``BLOCK_SIZE`` positional reads from a descriptor
+shared through ``services.media_index.file_handles``; the iterator's
+``close()`` releases it even if the client disconnects midway.
+
+``deliver_file`` is what the routes call. Depending on ``MEDIA_DELIVERY``
+it either serves the bytes itself (``serve_file``) or only authorises the
+request and hands the transfer to the front proxy:
+
+- 'direct':     Flask sends the bytes (default)
+- 'x-accel':    nginx ``X-Accel-Redirect`` to ``MEDIA_ACCEL_LOCATION``, an
+                ``internal`` location aliased to ``MEDIA_ROOT``
+- 'x-sendfile': ``X-Sendfile`` with the absolute path (Apache mod_xsendfile,
+                lighttpd)
+
+With offload the proxy handles Range, If-Range and ETags itself.
+"""
+
+import os
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, current_app, request
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import ClosingIterator
+
+from services.media_index import file_handles, location_for, media_root
+from services.segment_cache import cached_segment
+
+# Read size for the non-sendfile paths
+BLOCK_SIZE = 256 * 1024
+
+# More ranges than this in one request are ignored and the full file is sent
+MAX_RANGES = 16
+
+
+class FileRangeIterator:
+    """
+    Yield ``length`` bytes of a shared descriptor starting at ``offset``.
+
+    Reads with ``os.pread`` so concurrent readers of the same cached handle
+    do not disturb each other; ``close()`` returns the handle to the cache.
+    """
+
+    def __init__(self, handle, offset, length, block_size=BLOCK_SIZE):
+        self.handle = handle
+        self.offset = offset
+        self.remaining = length
+        self.block_size = block_size
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        chunk = os.pread(self.handle.fd, min(self.block_size, self.remaining), self.offset)
+        if not chunk:
+            raise StopIteration
+        self.offset += len(chunk)
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            file_handles.release(self.handle)
+
+
+class FileSlice:
+    """
+    The next ``length`` bytes of an open file, for ``wsgi.file_wrapper``.
+
+    ``read()`` stops at the end of the slice, so servers that read the
+    file (werkzeug's wrapper and most others) never send more than
+    ``Content-Length``; ``fileno()`` keeps sendfile available to servers
+    that bound it by ``Content-Length`` themselves.
+    """
+
+    def __init__(self, fileobj, length):
+        self._file = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return b''
+        data = self._file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def _file_body(location, start, length):
+    """Let the WSGI server send the file itself when it can."""
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # sendfile starts at the descriptor's own offset, so this path
+        # needs a private descriptor rather than a shared cached one.
+        fileobj = open(location.path, 'rb')
+        fileobj.seek(start)
+        return file_wrapper(FileSlice(fileobj, length), BLOCK_SIZE)
+    return FileRangeIterator(file_handles.acquire(location), start, length)
+
+
+def _multipart_body(location, ranges, mimetype, boundary):
+    """Generate a multipart/byteranges body; returns (iterator, length)."""
+    headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{location.size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    trailer = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(h) for h in headers) + sum(stop - start for start, stop in ranges) \
+        + 2 * (len(ranges) - 1) + len(trailer)
+
+    # Acquired now, while the app context is still active, and released by
+    # the server's close() even if the body is never iterated
+    handle = file_handles.acquire(location)
+
+    def generate():
+        for i, (start, stop) in enumerate(ranges):
+            if i:
+                yield b'\r\n'
+            yield headers[i]
+            offset = start
+            while offset < stop:
+                chunk = os.pread(handle.fd, min(BLOCK_SIZE, stop - offset), offset)
+                if not chunk:
+                    return
+                offset += len(chunk)
+                yield chunk
+        yield trailer
+
+    return ClosingIterator(generate(), lambda: file_handles.release(handle)), length
+
+
+def satisfiable_ranges(http_range, size):
+    """
+    Resolve a parsed Range header against ``size``.
+
+    Returns a sorted list of ``(start, stop)`` (stop exclusive) with
+    overlapping or adjacent ranges merged, ``[]`` if none is satisfiable,
+    or None if the header should be ignored.
+    """
+    if http_range is None or http_range.units != 'bytes':
+        return None
+    if len(http_range.ranges) > MAX_RANGES:
+        return None
+
+    resolved = []
+    for begin, end in http_range.ranges:
+        if begin < 0:
+            # Suffix range: the last -begin bytes
+            if size == 0:
+                continue
+            resolved.append((max(size + begin, 0), size))
+        elif begin < size:
+            resolved.append((begin, size if end is None else min(end, size)))
+
+    resolved.sort()
+    merged = []
+    for start, stop in resolved:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        # If-Range requires a strong comparison; weak validators never match
+        raw = request.headers.get('If-Range', '')
+        return not raw.startswith('W/') and if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return True
+
+
+def serve_file(path, mimetype, location=None, cacheable=False):
+    """
+    Return a (possibly partial) response for the file at ``path``.
+
+    Pass the ``MediaLocation`` from the media index to skip the ``stat``.
+    With ``cacheable`` a single range small enough for the hot-segment
+    cache (services/segment_cache.py) is answered from memory.
+    """
+    if location is None:
+        location = location_for(path)
+    size = location.size
+    etag = location.etag
+    last_modified = datetime.fromtimestamp(location.mtime_ns // 10**9, tz=timezone.utc)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+    }
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    if request.headers.get('Range') and _if_range_matches(etag, last_modified):
+        ranges = satisfiable_ranges(request.range, size)
+
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if ranges is None:
+        ranges, status = [(0, size)], 200
+    else:
+        status = 206
+
+    if request.method == 'HEAD':
+        start, stop = ranges[0]
+        if status == 206 and len(ranges) == 1:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start) if len(ranges) == 1 else None
+        return Response(status=status, mimetype=mimetype,
+                        headers={k: v for k, v in headers.items() if v is not None})
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        data = cached_segment(location, start, stop) if cacheable else None
+        if data is not None:
+            return Response([data], status=status, mimetype=mimetype, headers=headers,
+                            direct_passthrough=True)
+        return Response(_file_body(location, start, stop - start), status=status,
+                        mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+    boundary = etag.replace('-', '')
+    body, length = _multipart_body(location, ranges, mimetype, boundary)
+    headers['Content-Length'] = str(length)
+    return Response(body, status=206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
+
+
+def offload_response(path, mimetype):
+    """
+    Response that tells the front proxy to send ``path`` itself.
+
+    Returns None when offload is disabled or the file lies outside
+    ``MEDIA_ROOT`` (the proxy location cannot reach it).
+    """
+    mode = current_app.config['MEDIA_DELIVERY']
+    if mode == 'direct':
+        return None
+
+    root = os.path.realpath(media_root())
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([root, real_path]) != root:
+        return None
+
+    response = Response(status=200, mimetype=mimetype)
+    if mode == 'x-accel':
+        relative = os.path.relpath(real_path, root).replace(os.sep, '/')
+        location = current_app.config['MEDIA_ACCEL_LOCATION'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{location}/{quote(relative)}'
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = real_path
+    else:
+        raise ValueError(f'Unknown MEDIA_DELIVERY {mode!r}')
+    return response
+
+
+def deliver_file(path, mimetype, location=None, cacheable=False):
+    """Serve ``path`` directly or via the proxy, per ``MEDIA_DELIVERY``."""
+    response = offload_response(path, mimetype)
+    if response is not None:
+        return response
+    return serve_file(path, mimetype, location, cacheable)
@@ -0,0 +1,183 @@
+"""
+Resolved media locations and shared open file descriptors.
+
+A player seeking through a movie sends a range request every few seconds,
+and each one used to rebuild the file path, ``stat`` it twice and
+``open()`` it. ``MediaIndex`` remembers, per key (a movie's MP4, one HLS
+segment...), the resolved path with its size, mtime and ETag, and only
+re-``stat``s it once ``MEDIA_INDEX_RECHECK`` seconds have passed, which is
+also how replaced files are noticed. Missing files are remembered the same
+way so 404s stay cheap.
+
+``FileHandleCache`` keeps a bounded LRU of read-only descriptors shared by
+all requests in a worker. Readers use ``os.pread`` so they never depend on
+a shared file offset; handles are reference counted so eviction never
+closes a descriptor another request is still reading. A file whose size or
+mtime changes gets a fresh descriptor.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+
+MediaLocation = namedtuple('MediaLocation', 'path size mtime_ns etag')
+
+_MISSING = object()
+
+VIDEO_URL_PREFIX = '/static/videos/'
+
+
+def media_root():
+    """Directory all locally served media lives under."""
+    return current_app.config['MEDIA_ROOT'] or \
+        os.path.join(current_app.root_path, 'static', 'videos')
+
+
+def strong_etag(stat):
+    """Strong validator derived from modification time and size."""
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def location_for(path):
+    """Stat ``path`` into a ``MediaLocation`` (raises OSError if missing)."""
+    stat = os.stat(path)
+    return MediaLocation(path, stat.st_size, stat.st_mtime_ns, strong_etag(stat))
+
+
+def resolve_video_path(video_url):
+    """
+    Map ``Movie.video_url`` to a file under the media root.
+
+    Strips the ``/static/videos/`` prefix (as a prefix, not as a set of
+    characters) and refuses paths that escape the media root.
+    """
+    root = os.path.realpath(media_root())
+    relative = video_url[len(VIDEO_URL_PREFIX):] if video_url.startswith(VIDEO_URL_PREFIX) \
+        else video_url.lstrip('/')
+    path = os.path.realpath(os.path.join(root, relative))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+class MediaIndex:
+    """key -> (path, checked_at, MediaLocation or _MISSING)."""
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, path):
+        """Return the ``MediaLocation`` for ``path`` or None if it is missing."""
+        now = time.monotonic()
+        recheck = current_app.config['MEDIA_INDEX_RECHECK']
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == path and now - entry[1] < recheck:
+                self._entries.move_to_end(key)
+                return None if entry[2] is _MISSING else entry[2]
+
+        try:
+            location = location_for(path)
+        except OSError:
+            location = _MISSING
+
+        with self._lock:
+            self._entries[key] = (path, now, location)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return None if location is _MISSING else location
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileHandle:
+    """A shared read-only descriptor; read with ``os.pread(handle.fd, ...)``."""
+
+    __slots__ = ('fd', 'identity', 'refs', 'evicted')
+
+    def __init__(self, fd, identity):
+        self.fd = fd
+        self.identity = identity
+        self.refs = 0
+        self.evicted = False
+
+
+class FileHandleCache:
+    """Bounded LRU of open descriptors keyed by path (``MEDIA_FD_CACHE_SIZE``)."""
+
+    def __init__(self):
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, location):
+        """Return a referenced ``FileHandle``; pair with ``release()``."""
+        identity = (location.size, location.mtime_ns)
+        max_handles = current_app.config['MEDIA_FD_CACHE_SIZE']
+        with self._lock:
+            handle = self._handles.get(location.path)
+            if handle is not None and handle.identity == identity:
+                self._handles.move_to_end(location.path)
+                handle.refs += 1
+                return handle
+            if handle is not None:
+                self._evict(location.path)
+
+        fd = os.open(location.path, os.O_RDONLY)
+        handle = FileHandle(fd, identity)
+        handle.refs = 1
+        with self._lock:
+            if location.path in self._handles:
+                self._evict(location.path)
+            self._handles[location.path] = handle
+            while len(self._handles) > max_handles:
+                self._evict(next(iter(self._handles)))
+        return handle
+
+    def release(self, handle):
+        with self._lock:
+            handle.refs -= 1
+            if handle.evicted and handle.refs == 0:
+                os.close(handle.fd)
+
+    def _evict(self, path):
+        handle = self._handles.pop(path)
+        handle.evicted = True
+        if handle.refs == 0:
+            os.close(handle.fd)
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._handles):
+                self._evict(path)
+
+
+media_index = MediaIndex()
+file_handles = FileHandleCache()
+
+
+def video_location(movie):
+    """Location of a movie's local MP4, or None if it is not on disk."""
+    path = resolve_video_path(movie.video_url)
+    if path is None:
+        return None
+    return media_index.get(('video', movie.id), path)
+
+
+def playlist_location(movie_id, quality):
+    """Location of a packaged rendition's ``playlist.m3u8``, or None."""
+    path = os.path.join(media_root(), 'hls', str(movie_id), quality, 'playlist.m3u8')
+    return media_index.get(('playlist', movie_id, quality), path)
+
+
+def segment_location(movie_id, quality, segment):
+    """Location of a packaged HLS ``.ts`` segment, or None."""
+    path = os.path.join(media_root(), 'hls', str(movie_id), quality, f'{segment}.ts')
+    return media_index.get(('segment', movie_id, quality, segment), path)
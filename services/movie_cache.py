@@ -0,0 +1,122 @@
+"""
+Read-through cache for movie metadata.
+
+The detail and watch pages and every streaming request (token, playlists,
+segments, MP4 ranges) look a movie up by id. A player fetching segments
+would otherwise cost a database round trip every few seconds per viewer
+just to re-read metadata that almost never changes.
+
+Cached values are ``MovieSnapshot``s: read-only copies of a movie's
+columns and quality ``variants``. Attribute and helper-method access
+(``to_dict()``, ``formatted_duration``, ``get_qualities()``...) works as on
+``Movie``, but a snapshot is not a mapped object, so it can never be added
+to a session or flushed, and assigning to it raises. Code that modifies a
+movie must load it with ``Movie.query``. Lookups for ids that do not exist are
+cached too (for a shorter time) so probing bad ids cannot hammer the
+database.
+
+Entries expire after ``MOVIE_CACHE_TTL`` seconds and the least recently
+used entries are evicted beyond ``MOVIE_CACHE_SIZE``. Any committed insert,
+update or delete of a movie or one of its variants drops its entry in this
+process.
+"""
+
+from collections import namedtuple
+
+from flask import abort, current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload
+
+from extensions import db
+from models import Movie, MovieVariant
+from services.commit_hooks import on_commit
+from services.lru import LRUCache
+
+_MISSING = object()
+
+
+def _column_values(obj):
+    state = inspect(obj)
+    return {
+        attr.key: getattr(obj, attr.key)
+        for attr in state.mapper.column_attrs
+        if attr.key not in state.unloaded
+    }
+
+
+class VariantSnapshot(namedtuple('VariantSnapshot', MovieVariant.__table__.columns.keys())):
+    """Read-only copy of a ``MovieVariant`` row."""
+
+    __slots__ = ()
+
+    to_dict = MovieVariant.to_dict
+
+
+class MovieSnapshot:
+    """Read-only copy of a ``Movie``'s loaded columns and its variants."""
+
+    # Movie's helpers only read attributes, so they work on the copy
+    trailer_embed_url = Movie.trailer_embed_url
+    formatted_duration = Movie.formatted_duration
+    get_quality_url = Movie.get_quality_url
+    get_qualities = Movie.get_qualities
+    to_dict = Movie.to_dict
+
+    def __init__(self, movie):
+        self.__dict__.update(_column_values(movie))
+        self.__dict__['variants'] = tuple(VariantSnapshot(**_column_values(v))
+                                          for v in movie.variants)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MovieSnapshot is read-only; load the Movie to modify it')
+
+    def __delattr__(self, name):
+        raise AttributeError('MovieSnapshot is read-only; load the Movie to modify it')
+
+    def __repr__(self):
+        return f'<MovieSnapshot {self.title}>'
+
+
+class MovieCache(LRUCache):
+    """LRU of movie id -> ``MovieSnapshot`` (or _MISSING), bounded by ``MOVIE_CACHE_SIZE``."""
+
+    def __init__(self):
+        super().__init__('MOVIE_CACHE_SIZE')
+
+    def get(self, movie_id):
+        """Return the movie for ``movie_id`` or None if it does not exist."""
+        config = current_app.config
+
+        def load():
+            movie = db.session.get(Movie, movie_id, options=[selectinload(Movie.variants)])
+            return _MISSING if movie is None else MovieSnapshot(movie)
+
+        def ttl(value):
+            if value is _MISSING:
+                return config['MOVIE_CACHE_NEGATIVE_TTL']
+            return config['MOVIE_CACHE_TTL']
+
+        value = self.fetch(movie_id, load, ttl=ttl)
+        return None if value is _MISSING else value
+
+
+movie_cache = MovieCache()
+
+
+def get_movie_or_404(movie_id):
+    """Cached, read-only equivalent of ``Movie.query.get_or_404`` (a ``MovieSnapshot``)."""
+    movie = movie_cache.get(movie_id)
+    if movie is None:
+        abort(404)
+    return movie
+
+
+def _drop_movies(movie_ids):
+    for movie_id in movie_ids:
+        movie_cache.invalidate(movie_id)
+
+
+# Drop written movies once the transaction commits; inserts matter too
+# because the id may be negatively cached.
+on_commit(Movie, lambda movie: movie.id, _drop_movies)
+on_commit(MovieVariant, lambda variant: variant.movie_id, _drop_movies)
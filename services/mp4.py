@@ -0,0 +1,561 @@
+"""
+Minimal ISO BMFF (MP4) reader and fragment writer for HLS.
+
+Only the boxes needed to find samples and where their bytes live are
+parsed: ``moov/trak`` (``tkhd`` track id and size, ``mdhd`` timescale,
+``hdlr`` type), each track's ``stsd`` sample entry (for the codecs
+string) and the sample tables in ``minf/stbl``:
+
+- ``stts``  sample durations
+- ``ctts``  composition offsets (B-frames); absent means none
+- ``stss``  sync (key) frames; absent means every sample is a keyframe
+- ``stsz``  sample sizes
+- ``stsc``  samples per chunk
+- ``stco`` / ``co64``  chunk file offsets
+
+``read_mp4`` keeps the first video and the first audio track.
+``keyframe_segments`` cuts the video track at keyframes into segments of
+roughly the target duration, and the audio track at the same times.
+
+Players decode HLS segments as MPEG-TS or fragmented MP4, not as byte
+ranges of a progressive file, so segments are served as fMP4 without
+re-encoding: ``init_segment`` is the original ``moov`` with empty sample
+tables and an ``mvex`` box, and ``media_segment`` wraps a segment's
+samples, copied from the source file, in a ``moof`` + ``mdat``.
+
+Only progressive files (a ``moov`` with sample tables) are supported;
+fragmented MP4 raises ``UnsupportedMP4``.
+"""
+
+import bisect
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from itertools import accumulate
+
+# Segment: start time and duration in seconds, bytes of media data, and
+# per track of the source the [first, stop) range of its samples
+Segment = namedtuple('Segment', 'start duration size samples')
+
+# moov: the moov box payload; tracks: the video and (if any) audio
+# ``SampleTable``
+SourceMP4 = namedtuple('SourceMP4', 'moov tracks')
+
+# File ranges of one segment closer than this are read as one
+READ_GAP = 64 * 1024
+
+# trun sample flags: sync sample / sample depending on others (non-sync)
+SYNC_SAMPLE = 0x02000000
+NON_SYNC_SAMPLE = 0x01010000
+
+
+class UnsupportedMP4(ValueError):
+    """Raised for files this reader cannot segment."""
+
+
+def _u32_array(data, typecode='I'):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _iter_boxes(data, start=0, end=None):
+    """Yield ``(type, payload_start, box_end)`` for boxes in ``data``."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise UnsupportedMP4(f'truncated {box_type!r} box at {offset}')
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def top_level_boxes(fileobj):
+    """Return ``[(type, offset, header_size, size)]`` for the whole file."""
+    fileobj.seek(0, 2)
+    file_size = fileobj.tell()
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        fileobj.seek(offset)
+        header = fileobj.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise UnsupportedMP4(f'bad {box_type!r} box size at {offset}')
+        boxes.append((box_type, offset, header_size, size))
+        offset += size
+    return boxes
+
+
+def _children(data, start, end):
+    found = {}
+    for box_type, payload, box_end in _iter_boxes(data, start, end):
+        found.setdefault(box_type, []).append((payload, box_end))
+    return found
+
+
+class SampleTable:
+    """Per-sample decode times, sizes and file offsets of one track."""
+
+    def __init__(self, timescale, durations, sizes, offsets, sync_samples,
+                 composition_offsets=None, composition_version=0):
+        self.timescale = timescale
+        self.durations = durations
+        self.sizes = sizes
+        self.offsets = offsets
+        # 0-based indexes of keyframes, ascending; None if every sample is one
+        self.sync_samples = sync_samples
+        # Raw ctts value per sample (signed if the version is 1), or None
+        self.composition_offsets = composition_offsets
+        self.composition_version = composition_version
+        self.handler = None
+        self.track_id = None
+        # Display size from the track header and RFC 6381 codec, when known
+        self.width = self.height = None
+        self.codec = None
+        self._times = None
+
+    def __len__(self):
+        return len(self.sizes)
+
+    @property
+    def duration(self):
+        return sum(self.durations) / self.timescale
+
+    def decode_times(self):
+        """Decode time of every sample, followed by the end of the last one."""
+        if self._times is None:
+            self._times = array('Q', accumulate(self.durations, initial=0))
+        return self._times
+
+    def sample_flags(self, first, stop):
+        """trun sample flags of samples ``[first, stop)``."""
+        if self.sync_samples is None:
+            return array('I', [SYNC_SAMPLE]) * (stop - first)
+        flags = array('I', [NON_SYNC_SAMPLE]) * (stop - first)
+        lo = bisect.bisect_left(self.sync_samples, first)
+        hi = bisect.bisect_left(self.sync_samples, stop)
+        for sample in self.sync_samples[lo:hi]:
+            flags[sample - first] = SYNC_SAMPLE
+        return flags
+
+
+def _expand_runs(pairs):
+    """Expand ``(count, value)`` pairs (stts, ctts) into one value per sample."""
+    values = array('I')
+    for i in range(0, len(pairs), 2):
+        values.extend(array('I', [pairs[i + 1]]) * pairs[i])
+    return values
+
+
+def _parse_stbl(data, boxes, timescale):
+    try:
+        (stts, _), = boxes[b'stts']
+        (stsz, _), = boxes[b'stsz']
+        (stsc, _), = boxes[b'stsc']
+    except (KeyError, ValueError):
+        raise UnsupportedMP4('track has no sample tables') from None
+
+    # Full boxes: skip the 4-byte version/flags field
+    count = struct.unpack_from('>I', data, stts + 4)[0]
+    durations = _expand_runs(_u32_array(data[stts + 8:stts + 8 + 8 * count]))
+
+    sample_size, sample_count = struct.unpack_from('>II', data, stsz + 4)
+    if sample_size:
+        sizes = array('I', [sample_size]) * sample_count
+    else:
+        sizes = _u32_array(data[stsz + 12:stsz + 12 + 4 * sample_count])
+
+    if b'stco' in boxes:
+        (chunk_box, _), = boxes[b'stco']
+        chunk_count = struct.unpack_from('>I', data, chunk_box + 4)[0]
+        chunk_offsets = _u32_array(data[chunk_box + 8:chunk_box + 8 + 4 * chunk_count])
+    elif b'co64' in boxes:
+        (chunk_box, _), = boxes[b'co64']
+        chunk_count = struct.unpack_from('>I', data, chunk_box + 4)[0]
+        chunk_offsets = _u32_array(data[chunk_box + 8:chunk_box + 8 + 8 * chunk_count], 'Q')
+    else:
+        raise UnsupportedMP4('track has no chunk offsets')
+
+    count = struct.unpack_from('>I', data, stsc + 4)[0]
+    runs = _u32_array(data[stsc + 8:stsc + 8 + 12 * count])
+
+    # Expand chunks into per-sample offsets
+    offsets = array('Q')
+    sample = 0
+    for r in range(0, len(runs), 3):
+        first_chunk, per_chunk = runs[r] - 1, runs[r + 1]
+        last_chunk = runs[r + 3] - 1 if r + 3 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk):
+            position = chunk_offsets[chunk]
+            for size in sizes[sample:sample + per_chunk]:
+                offsets.append(position)
+                position += size
+            sample += per_chunk
+    if len(offsets) != sample_count or len(durations) != sample_count:
+        raise UnsupportedMP4('inconsistent sample tables')
+
+    sync_samples = None
+    if b'stss' in boxes:
+        (stss, _), = boxes[b'stss']
+        count = struct.unpack_from('>I', data, stss + 4)[0]
+        sync_samples = [n - 1 for n in _u32_array(data[stss + 8:stss + 8 + 4 * count])]
+
+    composition_offsets = None
+    composition_version = 0
+    if b'ctts' in boxes:
+        (ctts, _), = boxes[b'ctts']
+        composition_version = data[ctts]
+        count = struct.unpack_from('>I', data, ctts + 4)[0]
+        composition_offsets = _expand_runs(_u32_array(data[ctts + 8:ctts + 8 + 8 * count]))
+        if len(composition_offsets) != sample_count:
+            raise UnsupportedMP4('inconsistent composition offsets')
+
+    return SampleTable(timescale, durations, sizes, offsets, sync_samples,
+                       composition_offsets, composition_version)
+
+
+def _read_descriptor(data, offset):
+    """Return ``(tag, payload_start, payload_end)`` of an MPEG-4 descriptor."""
+    tag = data[offset]
+    length = 0
+    offset += 1
+    for _ in range(4):
+        byte = data[offset]
+        offset += 1
+        length = (length << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            break
+    return tag, offset, offset + length
+
+
+def _mp4a_codec(data, esds):
+    """RFC 6381 string (``mp4a.40.2``...) from an ``esds`` box payload, or None."""
+    tag, pos, _ = _read_descriptor(data, esds + 4)
+    if tag != 0x03:
+        return None
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + data[pos]
+    if flags & 0x20:
+        pos += 2
+    tag, pos, end = _read_descriptor(data, pos)
+    if tag != 0x04:
+        return None
+    object_type = data[pos]
+    codec = f'mp4a.{object_type:x}'
+    if pos + 13 < end:
+        tag, info, _ = _read_descriptor(data, pos + 13)
+        if tag == 0x05:
+            codec += f'.{data[info] >> 3}'
+    return codec
+
+
+def _sample_entry_codec(data, stbl_boxes):
+    """
+    RFC 6381 codecs string of a track's first sample entry if it is AVC or
+    MPEG-4 audio, else None (a guessed string could make players reject
+    the variant).
+    """
+    stsd = stbl_boxes.get(b'stsd')
+    if not stsd:
+        return None
+    # Full box header and entry count, then the sample entries themselves
+    entry = next(_iter_boxes(data, stsd[0][0] + 8, stsd[0][1]), None)
+    if entry is None:
+        return None
+    entry_type, payload, entry_end = entry
+    if entry_type in (b'avc1', b'avc3'):
+        # VisualSampleEntry fields take 78 bytes before the child boxes
+        config = _children(data, payload + 78, entry_end).get(b'avcC')
+        if config:
+            profile, compat, level = data[config[0][0] + 1:config[0][0] + 4]
+            return f'{entry_type.decode()}.{profile:02x}{compat:02x}{level:02x}'
+    elif entry_type == b'mp4a':
+        # AudioSampleEntry: 28 bytes, plus 16/36 for QuickTime v1/v2
+        version = struct.unpack_from('>H', data, payload + 8)[0]
+        skip = 28 + {1: 16, 2: 36}.get(version, 0)
+        esds = _children(data, payload + skip, entry_end).get(b'esds')
+        if esds:
+            return _mp4a_codec(data, esds[0][0])
+    return None
+
+
+def _tracks(moov):
+    """Yield ``(handler_type, trak_boxes, mdia_boxes, stbl_boxes)`` per track."""
+    for trak, trak_end in _children(moov, 0, len(moov)).get(b'trak', []):
+        trak_boxes = _children(moov, trak, trak_end)
+        mdia = trak_boxes.get(b'mdia')
+        if not mdia:
+            continue
+        mdia_boxes = _children(moov, *mdia[0])
+        hdlr = mdia_boxes.get(b'hdlr')
+        minf = mdia_boxes.get(b'minf')
+        if not hdlr:
+            continue
+        stbl = _children(moov, *minf[0]).get(b'stbl') if minf else None
+        stbl_boxes = _children(moov, *stbl[0]) if stbl else {}
+        yield moov[hdlr[0][0] + 8:hdlr[0][0] + 12], trak_boxes, mdia_boxes, stbl_boxes
+
+
+def _track_id(moov, tkhd):
+    version = moov[tkhd]
+    return struct.unpack_from('>I', moov, tkhd + (20 if version == 1 else 12))[0]
+
+
+def _read_track(moov, handler, trak_boxes, mdia_boxes, stbl_boxes):
+    kind = handler.decode('latin-1')
+    if not stbl_boxes or b'tkhd' not in trak_boxes or b'mdhd' not in mdia_boxes:
+        raise UnsupportedMP4(f'{kind} track has no sample tables')
+    mdhd = mdia_boxes[b'mdhd'][0][0]
+    version = moov[mdhd]
+    timescale = struct.unpack_from('>I', moov, mdhd + (20 if version == 1 else 12))[0]
+    if not timescale:
+        raise UnsupportedMP4(f'{kind} track has no timescale')
+
+    table = _parse_stbl(moov, stbl_boxes, timescale)
+    table.handler = handler
+    table.codec = _sample_entry_codec(moov, stbl_boxes)
+    tkhd, tkhd_end = trak_boxes[b'tkhd'][0]
+    table.track_id = _track_id(moov, tkhd)
+    if handler == b'vide':
+        # Width and height are the last two 16.16 fixed-point fields
+        width, height = struct.unpack_from('>II', moov, tkhd_end - 8)
+        table.width, table.height = width >> 16, height >> 16
+    return table
+
+
+def read_mp4(fileobj):
+    """
+    Parse the first video and the first audio track of an open MP4.
+
+    Returns a ``SourceMP4`` whose ``tracks`` start with the video track.
+    """
+    boxes = top_level_boxes(fileobj)
+    moov = [b for b in boxes if b[0] == b'moov']
+    if not moov:
+        raise UnsupportedMP4('no moov box')
+    if any(b[0] == b'moof' for b in boxes):
+        raise UnsupportedMP4('fragmented MP4')
+
+    _, offset, header_size, size = moov[0]
+    fileobj.seek(offset + header_size)
+    moov = fileobj.read(size - header_size)
+
+    found = {}
+    for handler, trak_boxes, mdia_boxes, stbl_boxes in _tracks(moov):
+        if handler in (b'vide', b'soun') and handler not in found:
+            found[handler] = _read_track(moov, handler, trak_boxes, mdia_boxes, stbl_boxes)
+    if b'vide' not in found:
+        raise UnsupportedMP4('no video track')
+    tracks = [found[b'vide']] + ([found[b'soun']] if b'soun' in found else [])
+    return SourceMP4(moov, tracks)
+
+
+def keyframe_segments(tracks, target_duration):
+    """
+    Cut ``tracks[0]`` (video) at keyframes into segments of about
+    ``target_duration`` seconds (a segment only ends on a keyframe, so it
+    may run longer) and the other tracks at the same times.
+    """
+    video = tracks[0]
+    if not len(video):
+        raise UnsupportedMP4('empty video track')
+
+    timescale = video.timescale
+    times = video.decode_times()
+    target = target_duration * timescale
+    sync_samples = range(len(video)) if video.sync_samples is None else video.sync_samples
+
+    cuts = [0]
+    for sample in sync_samples:
+        if sample and times[sample] - times[cuts[-1]] >= target:
+            cuts.append(sample)
+
+    bounds = [cuts + [len(video)]]
+    for track in tracks[1:]:
+        track_times = track.decode_times()
+        # First sample at or after each cut (ceiling of the rescaled time)
+        bounds.append([0] + [
+            bisect.bisect_left(track_times, -(-times[cut] * track.timescale // timescale),
+                               0, len(track))
+            for cut in cuts[1:]
+        ] + [len(track)])
+
+    segments = []
+    for i, cut in enumerate(cuts):
+        samples = tuple((b[i], b[i + 1]) for b in bounds)
+        size = sum(sum(track.sizes[first:stop]) for track, (first, stop) in zip(tracks, samples))
+        segments.append(Segment(
+            times[cut] / timescale,
+            (times[bounds[0][i + 1]] - times[cut]) / timescale,
+            size,
+            samples,
+        ))
+    return segments
+
+
+def segment_reads(tracks, segment):
+    """Sorted ``(start, stop)`` file ranges holding ``segment``'s samples."""
+    spans = []
+    for track, (first, stop) in zip(tracks, segment.samples):
+        spans.extend(zip(track.offsets[first:stop], track.sizes[first:stop]))
+    spans.sort()
+
+    reads = []
+    for start, size in spans:
+        if reads and start <= reads[-1][1] + READ_GAP:
+            reads[-1][1] = max(reads[-1][1], start + size)
+        else:
+            reads.append([start, start + size])
+    return [tuple(r) for r in reads]
+
+
+def _box(box_type, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+
+def _full_box(box_type, version, flags, *payload):
+    return _box(box_type, struct.pack('>I', version << 24 | flags), *payload)
+
+
+# Offset of the duration field in version 0 / version 1 payloads
+_DURATION_AT = {b'mvhd': (16, 24), b'mdhd': (16, 24), b'tkhd': (20, 28)}
+
+_EMPTY_SAMPLE_TABLES = b''.join([
+    _full_box(b'stts', 0, 0, bytes(4)),
+    _full_box(b'stsc', 0, 0, bytes(4)),
+    _full_box(b'stsz', 0, 0, bytes(8)),
+    _full_box(b'stco', 0, 0, bytes(4)),
+])
+
+
+def _without_duration(data, box_type, payload, end):
+    """Copy of a mvhd/tkhd/mdhd box with its duration set to 0."""
+    body = bytearray(data[payload:end])
+    version = body[0]
+    at = _DURATION_AT[box_type][version == 1]
+    width = 8 if version == 1 else 4
+    body[at:at + width] = bytes(width)
+    return _box(box_type, body)
+
+
+def _init_box(data, box_type, payload, end):
+    """Copy of a ``trak`` (or descendant) for the init segment, or None to drop it."""
+    if box_type in (b'tkhd', b'mdhd'):
+        return _without_duration(data, box_type, payload, end)
+    if box_type == b'stbl':
+        stsd = _children(data, payload, end).get(b'stsd')
+        if not stsd:
+            raise UnsupportedMP4('track has no sample description')
+        return _box(b'stbl', _box(b'stsd', data[stsd[0][0]:stsd[0][1]]), _EMPTY_SAMPLE_TABLES)
+    if box_type in (b'trak', b'mdia', b'minf'):
+        children = [_init_box(data, *child) for child in _iter_boxes(data, payload, end)]
+        return _box(box_type, *(child for child in children if child is not None))
+    if box_type in (b'edts', b'hdlr', b'vmhd', b'smhd', b'dinf'):
+        return _box(box_type, data[payload:end])
+    return None
+
+
+def init_segment(source):
+    """``ftyp`` + ``moov`` describing the fragments of ``source.tracks``."""
+    moov = source.moov
+    track_ids = [track.track_id for track in source.tracks]
+    boxes = []
+    for box_type, payload, end in _iter_boxes(moov):
+        if box_type == b'mvhd':
+            boxes.append(_without_duration(moov, box_type, payload, end))
+        elif box_type == b'trak':
+            tkhd = _children(moov, payload, end).get(b'tkhd')
+            if tkhd and _track_id(moov, tkhd[0][0]) in track_ids:
+                boxes.append(_init_box(moov, box_type, payload, end))
+    boxes.append(_box(b'mvex', *(
+        _full_box(b'trex', 0, 0, struct.pack('>IIIII', track_id, 1, 0, 0, 0))
+        for track_id in track_ids
+    )))
+    ftyp = _box(b'ftyp', b'iso5', struct.pack('>I', 512), b'iso5iso6mp41')
+    return ftyp + _box(b'moov', *boxes)
+
+
+def _trun(track, first, stop, data_offset):
+    fields = [track.durations[first:stop], track.sizes[first:stop],
+              track.sample_flags(first, stop)]
+    flags = 0x000001 | 0x000100 | 0x000200 | 0x000400
+    if track.composition_offsets is not None:
+        fields.append(track.composition_offsets[first:stop])
+        flags |= 0x000800
+
+    # One (duration, size, flags[, composition offset]) entry per sample
+    entries = array('I', bytes(4 * len(fields) * (stop - first)))
+    for i, values in enumerate(fields):
+        entries[i::len(fields)] = values
+    if sys.byteorder == 'little':
+        entries.byteswap()
+    return _full_box(b'trun', track.composition_version, flags,
+                     struct.pack('>Ii', stop - first, data_offset), entries.tobytes())
+
+
+def _moof(tracks, samples, sequence, data_offsets):
+    trafs = []
+    for track, (first, stop), data_offset in zip(tracks, samples, data_offsets):
+        if first == stop:
+            continue
+        trafs.append(_box(
+            b'traf',
+            # default-base-is-moof: data offsets count from the moof's start
+            _full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id)),
+            _full_box(b'tfdt', 1, 0, struct.pack('>Q', track.decode_times()[first])),
+            _trun(track, first, stop, data_offset),
+        ))
+    return _box(b'moof', _full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), *trafs)
+
+
+def media_segment(source, segment, sequence, read):
+    """
+    ``moof`` + ``mdat`` of ``segment``; ``read(start, stop)`` returns the
+    file bytes of each range from ``segment_reads``.
+    """
+    tracks = source.tracks
+    buffers = [(start, memoryview(read(start, stop)))
+               for start, stop in segment_reads(tracks, segment)]
+    starts = [start for start, _ in buffers]
+
+    chunks = []
+    track_starts = []
+    position = 0
+    for track, (first, stop) in zip(tracks, segment.samples):
+        track_starts.append(position)
+        for n in range(first, stop):
+            offset, size = track.offsets[n], track.sizes[n]
+            start, buffer = buffers[bisect.bisect_right(starts, offset) - 1]
+            chunk = buffer[offset - start:offset - start + size]
+            if len(chunk) != size:
+                raise UnsupportedMP4('sample data past the end of the file')
+            chunks.append(chunk)
+            position += size
+
+    # Box sizes do not depend on the data offsets: build once to measure
+    moof_size = len(_moof(tracks, segment.samples, sequence, track_starts))
+    moof = _moof(tracks, segment.samples, sequence,
+                 [moof_size + 8 + start for start in track_starts])
+    return moof + _box(b'mdat', *chunks)
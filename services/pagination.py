@@ -0,0 +1,242 @@
+"""
+Catalog pagination: keyset cursors for browsing, and numbered pages with a
+configurable count strategy for everything else.
+
+OFFSET pagination makes Postgres walk and discard every row before the
+requested page, and ``paginate()`` adds a ``COUNT(*)`` on top. Keyset
+pagination instead remembers the sort key of the last row shown and asks
+for rows strictly after it, so every page costs the same index range scan
+no matter how deep the user has scrolled.
+
+The catalog is ordered by ``(created_at DESC, id DESC)``; ``id`` breaks ties
+between movies inserted in the same instant. ``created_at`` is NOT NULL
+(migration f3a9c6d1b2e8) because a row comparison never matches NULL. Cursors are opaque to clients:
+a URL-safe base64 blob carrying the boundary key and the direction.
+
+Numbered pages are still used where there is no stable sort key (relevance
+ranked search) or when a client asks for a page number; ``count_paginate``
+lets those avoid an exact ``COUNT(*)``.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask_sqlalchemy.pagination import QueryPagination
+from sqlalchemy import func, text, tuple_
+
+from extensions import db
+from models import Movie
+from services.sql import explain_json
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+def encode_cursor(movie, direction):
+    """Build an opaque cursor pointing just past ``movie``."""
+    payload = {
+        'c': movie.created_at.isoformat(),
+        'i': movie.id,
+        'd': direction,
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id, direction)`` for an opaque cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.fromisoformat(payload['c'])
+        movie_id = int(payload['i'])
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(str(exc)) from exc
+
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor(f'unknown direction {direction!r}')
+    return created_at, movie_id, direction
+
+
+class KeysetPage:
+    """
+    One page of keyset-paginated results.
+
+    Mirrors the attributes of Flask-SQLAlchemy's ``Pagination`` that the
+    templates use (``items``, ``has_next``, ``has_prev``, ``total``) and adds
+    the opaque ``next_cursor``/``prev_cursor``. ``total`` is ``None`` unless
+    the caller explicitly asked for a count.
+    """
+
+    def __init__(self, items, per_page, has_next, has_prev, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(self.items[-1], 'next')
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(self.items[0], 'prev')
+
+    def to_dict(self):
+        return {
+            'items': [movie.to_dict() for movie in self.items],
+            'per_page': self.per_page,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'total': self.total,
+        }
+
+
+def keyset_query(query, per_page, boundary=None, direction='next'):
+    """
+    The statement ``keyset_paginate`` runs for one page: ``per_page + 1``
+    rows of ``query`` past ``boundary`` (a ``(created_at, id)`` pair, or
+    None for the first page). 'prev' pages come back in ascending order.
+    """
+    if boundary is None:
+        return query.order_by(Movie.created_at.desc(), Movie.id.desc()).limit(per_page + 1)
+
+    key = tuple_(Movie.created_at, Movie.id)
+    if direction == 'next':
+        return query.filter(key < tuple_(*boundary)) \
+            .order_by(Movie.created_at.desc(), Movie.id.desc()).limit(per_page + 1)
+    return query.filter(key > tuple_(*boundary)) \
+        .order_by(Movie.created_at.asc(), Movie.id.asc()).limit(per_page + 1)
+
+
+def keyset_paginate(query, per_page, cursor=None, with_total=False):
+    """
+    Paginate a movie query by ``(created_at, id)`` descending.
+
+    ``query`` must be unordered; ordering is applied here so it always
+    matches the cursor key. One extra row is fetched to learn whether a
+    further page exists, which keeps the browse path free of ``COUNT(*)``.
+    Pass ``with_total=True`` only where an exact total is really needed.
+
+    Raises ``InvalidCursor`` for malformed cursors.
+    """
+    total = query.order_by(None).count() if with_total else None
+
+    if cursor is None:
+        rows = keyset_query(query, per_page).all()
+        has_next = len(rows) > per_page
+        return KeysetPage(rows[:per_page], per_page, has_next, False, total)
+
+    created_at, movie_id, direction = decode_cursor(cursor)
+    rows = keyset_query(query, per_page, (created_at, movie_id), direction).all()
+
+    if direction == 'next':
+        has_next = len(rows) > per_page
+        return KeysetPage(rows[:per_page], per_page, has_next, True, total)
+
+    # Walking backwards: rows were read ascending from the boundary; flip.
+    has_prev = len(rows) > per_page
+    items = list(reversed(rows[:per_page]))
+    return KeysetPage(items, per_page, True, has_prev, total)
+
+
+class CountedPagination(QueryPagination):
+    """
+    Numbered-page pagination with a configurable total-count strategy.
+
+    Flask-SQLAlchemy always runs an exact ``COUNT(*)`` over the filtered
+    query, which on a large catalog costs more than fetching the page. Here
+    ``has_next`` is decided by fetching one extra row, so the total only
+    drives the page links and can be cheaper:
+
+    - 'exact':     ``COUNT(*)`` over the whole query
+    - 'capped':    count at most ``count_cap + 1`` rows; larger results show
+                   as "1,000+"
+    - 'estimated': the planner's row estimate (``pg_class.reltuples`` when
+                   unfiltered, EXPLAIN otherwise); small estimates are
+                   replaced by a capped count so short lists stay exact.
+                   Falls back to 'capped' off PostgreSQL.
+    """
+
+    def _query_items(self):
+        query = self._query_args['query']
+        rows = query.limit(self.per_page + 1).offset(self._query_offset).all()
+        self._has_more = len(rows) > self.per_page
+        return rows[:self.per_page]
+
+    def _query_count(self):
+        query = self._query_args['query'].order_by(None)
+        strategy = self._query_args['count_strategy']
+        cap = self._query_args['count_cap']
+        self.total_is_exact = True
+        self.total_is_capped = False
+
+        if strategy == 'exact':
+            return query.count()
+
+        if strategy == 'estimated' and db.engine.dialect.name == 'postgresql':
+            estimate = _estimate_rows(query)
+            if estimate is not None and estimate > cap:
+                self.total_is_exact = False
+                # Never advertise fewer rows than we have already walked past
+                return max(estimate, self._query_offset + len(self.items) + int(self._has_more))
+
+        total = db.session.query(func.count()) \
+            .select_from(query.limit(cap + 1).subquery()).scalar()
+        if total > cap:
+            self.total_is_exact = False
+            self.total_is_capped = True
+            return cap
+        return total
+
+    @property
+    def has_next(self):
+        return self._has_more
+
+    @property
+    def pages(self):
+        pages = super().pages
+        # Inexact totals must still allow moving past the current page
+        return max(pages, self.page + (1 if self._has_more else 0))
+
+    @property
+    def total_label(self):
+        if self.total is None:
+            return ''
+        if self.total_is_capped:
+            return f'{self.total:,}+'
+        if not self.total_is_exact:
+            return f'about {self.total:,}'
+        return f'{self.total:,}'
+
+
+def _estimate_rows(query):
+    """Planner row estimate for ``query``, or None if unavailable."""
+    if query.whereclause is None:
+        table = Movie.__table__.name
+        estimate = db.session.execute(
+            text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:t AS regclass)'),
+            {'t': table}
+        ).scalar()
+        # reltuples is -1 (or 0 on older servers) until the table is analyzed
+        return estimate if estimate and estimate > 0 else None
+
+    return int(explain_json(query)['Plan Rows'])
+
+
+def count_paginate(query, page, per_page, strategy='exact', cap=1000):
+    """Offset-paginate ``query`` using the given total-count strategy."""
+    return CountedPagination(
+        query=query, page=page, per_page=per_page, max_per_page=None,
+        error_out=False, count_strategy=strategy, count_cap=cap
+    )
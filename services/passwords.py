@@ -0,0 +1,171 @@
+"""
+Password hashing off the request threads, and login throttling.
+
+Hashing or verifying a password with Werkzeug's scrypt costs tens of
+milliseconds of CPU. After an outage every client logs in again at once;
+done inline, that pins every worker and stalls playback requests. So:
+
+- Hashing and verification run on a small pool of
+  ``PASSWORD_HASH_WORKERS`` threads (hashlib's scrypt releases the GIL).
+  At most ``PASSWORD_HASH_QUEUE_MAX`` more calls may wait for a thread;
+  beyond that, or when a call has waited ``PASSWORD_HASH_TIMEOUT``
+  seconds, ``PasswordHashBusy`` is raised at once and the route answers
+  503 rather than queueing more work.
+- ``login_throttle`` limits attempts over a sliding
+  ``LOGIN_THROTTLE_WINDOW`` (429 before any hashing is done): per client
+  IP, per username from one IP (``LOGIN_USERNAME_IP_LIMIT``), and per
+  username across all IPs (``LOGIN_USERNAME_LIMIT``, higher, so guesses
+  spread over many addresses are still bounded while one noisy address
+  cannot lock the owner out). Behind a reverse proxy, set
+  ``PROXY_FIX_X_FOR`` so the client IP is not the proxy's.
+- A successful login whose stored hash was made with other parameters than
+  ``PASSWORD_HASH_METHOD`` is rehashed, so raising the cost takes effect
+  as users log in.
+
+Both limits are per worker process.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHashBusy(Exception):
+    """The hashing pool is saturated; retry after ``retry_after`` seconds."""
+
+    retry_after = 1
+
+
+class PasswordPool:
+    """Bounded executor for password hashing and verification."""
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _start(self):
+        config = current_app.config
+        with self._lock:
+            if self._executor is None:
+                workers = config['PASSWORD_HASH_WORKERS']
+                self._slots = threading.BoundedSemaphore(workers + config['PASSWORD_HASH_QUEUE_MAX'])
+                self._executor = ThreadPoolExecutor(max_workers=workers,
+                                                    thread_name_prefix='password-hash')
+
+    def run(self, func, *args):
+        """Run ``func(*args)`` on the pool and return its result."""
+        if self._executor is None:
+            self._start()
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHashBusy()
+
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            self.rejected += 1
+            raise PasswordHashBusy() from None
+
+    def stats(self):
+        return {'rejected': self.rejected}
+
+
+password_pool = PasswordPool()
+
+
+def _method_of(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+def hash_password(password):
+    """Hash with ``PASSWORD_HASH_METHOD`` on the pool."""
+    return password_pool.run(generate_password_hash, password,
+                             current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def set_password(user, password):
+    user.password_hash = hash_password(password)
+
+
+def check_password(user, password):
+    """
+    Verify ``password`` on the pool; rehash it if the stored hash uses
+    outdated parameters (the caller commits).
+    """
+    if not password_pool.run(check_password_hash, user.password_hash, password):
+        return False
+    if _method_of(user.password_hash) != current_app.config['PASSWORD_HASH_METHOD']:
+        try:
+            set_password(user, password)
+        except PasswordHashBusy:
+            pass  # rehash on a later login
+    return True
+
+
+class SlidingWindowThrottle:
+    """Attempts per key within the last ``window`` seconds, LRU-bounded."""
+
+    def __init__(self):
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def hit(self, key, limit, window):
+        """
+        Record an attempt for ``key``. Returns 0 if allowed, else the
+        seconds until the oldest attempt leaves the window.
+        """
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            self._attempts.move_to_end(key)
+            while attempts and now - attempts[0] >= window:
+                attempts.popleft()
+            if len(attempts) >= limit:
+                self.throttled += 1
+                return max(1, int(window - (now - attempts[0])) + 1)
+            attempts.append(now)
+            while len(self._attempts) > current_app.config['LOGIN_THROTTLE_MAX_KEYS']:
+                self._attempts.popitem(last=False)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._attempts.clear()
+
+    def stats(self):
+        return {'keys': len(self._attempts), 'throttled': self.throttled}
+
+
+login_throttle = SlidingWindowThrottle()
+
+
+def clear_login_attempts(ip, username):
+    """Forget a username's attempts from ``ip`` after it logged in successfully."""
+    login_throttle.reset(('user_ip', username.lower(), ip))
+
+
+def throttle_login(ip, username=None):
+    """Seconds to wait before another attempt from ``ip``/``username``, or 0."""
+    config = current_app.config
+    window = config['LOGIN_THROTTLE_WINDOW']
+    wait = login_throttle.hit(('ip', ip), config['LOGIN_IP_LIMIT'], window)
+    if not wait and username:
+        name = username.lower()
+        wait = login_throttle.hit(('user_ip', name, ip), config['LOGIN_USERNAME_IP_LIMIT'], window) \
+            or login_throttle.hit(('user', name), config['LOGIN_USERNAME_LIMIT'], window)
+    return wait
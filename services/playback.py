@@ -0,0 +1,135 @@
+"""
+Stream tokens and the playback session handed to players.
+
+Used by the streaming routes and by ``movies.watch``, which inlines
+``watch_bootstrap`` into the rendered watch page.
+"""
+
+import secrets
+import time
+
+from flask import current_app, url_for
+from flask_login import current_user
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from services.continue_watching import continue_watching_cache
+from services.progress import progress_dict
+
+# Token-based streaming security
+# By default tokens are signed rather than stored, so any worker process on
+# any host sharing SECRET_KEY can validate them without shared state. Set
+# STREAM_TOKEN_BACKEND to 'memory' or 'sqlite' for revocable server-side
+# tokens (see services/token_store.py).
+STREAM_TOKEN_SALT = 'stream-token'
+
+_token_serializers = {}
+
+
+def _token_serializer():
+    """Serializer for the current SECRET_KEY (key derivation is cached)."""
+    secret = current_app.config['SECRET_KEY']
+    serializer = _token_serializers.get(secret)
+    if serializer is None:
+        serializer = URLSafeTimedSerializer(secret, salt=STREAM_TOKEN_SALT)
+        _token_serializers[secret] = serializer
+    return serializer
+
+
+def generate_stream_token(movie_id, user_id):
+    """
+    Generate a secure streaming token for a movie.
+    
+    Architecture:
+    - Token is generated when user accesses the movie
+    - Token is valid for a limited time (STREAM_TOKEN_TTL, 4 hours by default)
+    - Token is tied to specific movie and user
+    - Prevents sharing of direct video URLs
+    
+    With the default 'signed' backend the token is an HMAC-signed,
+    timestamped payload of movie and user id and nothing is kept
+    server-side. Otherwise a random token is recorded in the token store.
+    """
+    store = current_app.extensions['stream_token_store']
+    if store is None:
+        return _token_serializer().dumps({'m': movie_id, 'u': user_id})
+    
+    token = secrets.token_urlsafe(32)
+    store.issue(token, movie_id, user_id, time.time() + current_app.config['STREAM_TOKEN_TTL'])
+    return token
+
+
+def validate_stream_token(token, movie_id):
+    """
+    Validate a streaming token.
+    
+    Checks the signature (constant-time compare), the expiry and the
+    movie binding. Returns True if valid, False otherwise.
+    """
+    store = current_app.extensions['stream_token_store']
+    if store is not None:
+        token_data = store.get(token)
+        return token_data is not None and token_data['movie_id'] == movie_id
+    
+    try:
+        payload = _token_serializer().loads(
+            token, max_age=current_app.config['STREAM_TOKEN_TTL']
+        )
+    except BadSignature:
+        return False
+    
+    # Verify movie match
+    return isinstance(payload, dict) and payload.get('m') == movie_id
+
+
+def stream_session(movie):
+    """
+    Token, stream URL and resume position for ``movie`` and the current user.
+    
+    Returns None if the movie cannot be streamed. Read-only: no progress
+    row is created until the player reports a position.
+    """
+    if not movie.video_url and not movie.hls_url:
+        return None
+    
+    # Check subscription/access (extend for subscription system)
+    # For now, any authenticated user can stream
+    
+    token = generate_stream_token(movie.id, current_user.id)
+    
+    # Determine stream URL based on available sources
+    if movie.hls_url:
+        # Use HLS streaming with token protection
+        stream_base = url_for('streaming.stream_hls_manifest', 
+                              movie_id=movie.id, token=token, _external=True)
+        stream_type = 'hls'
+    else:
+        # Use direct MP4 with token protection
+        stream_base = url_for('streaming.stream_video', 
+                              movie_id=movie.id, token=token, _external=True)
+        stream_type = 'mp4'
+    
+    progress = progress_dict(current_user.id, movie.id,
+                             current_user.get_watch_progress(movie.id))
+    
+    return {
+        'token': token,
+        'stream_url': stream_base,
+        'stream_type': stream_type,
+        'movie': movie.to_dict(),
+        'progress': progress
+    }
+
+
+def watch_bootstrap(movie):
+    """
+    Everything the watch page needs before the first frame.
+    
+    ``stream_session`` plus the Continue Watching rail; inlined into the
+    rendered page by ``movies.watch`` so the player starts without any
+    extra round trip.
+    """
+    session_data = stream_session(movie)
+    if session_data is None:
+        return {'error': 'Streaming not available for this movie'}
+    session_data['continue_watching'] = continue_watching_cache.get(current_user.id)
+    return session_data
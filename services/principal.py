@@ -0,0 +1,89 @@
+"""
+Cached identity for logged-in users.
+
+Flask-Login calls the user loader on every request that touches
+``current_user``, which includes every progress report and streaming call.
+Instead of loading the ``User`` row each time, the loader returns a
+``Principal``: an immutable (id, username, is_admin) shared by all
+requests of that user in this worker for ``USER_CACHE_TTL`` seconds.
+
+Everything routes and templates use on ``current_user`` works on a
+principal; code that needs the ORM object (the ``watchlist_movies``
+relationship) loads it through ``Principal.user``, within the request's
+session.
+
+Any committed update or delete of a user (password reset, admin flag
+changes) drops its principal in this process; the TTL bounds how long
+other workers keep a stale one.
+"""
+
+from flask import current_app
+from flask_login import UserMixin
+
+from extensions import db, login_manager
+from models import User, UserLibrary
+from services.commit_hooks import on_commit
+from services.lru import LRUCache
+
+
+class Principal(UserLibrary, UserMixin):
+    """What requests need to know about the logged-in user."""
+
+    __slots__ = ('id', 'username', 'is_admin')
+
+    def __init__(self, id, username, is_admin):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'username', username)
+        object.__setattr__(self, 'is_admin', bool(is_admin))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Principal is immutable')
+
+    @property
+    def user(self):
+        """The full ``User`` row (one query per request at most)."""
+        return db.session.get(User, self.id)
+
+    @property
+    def watchlist_movies(self):
+        return self.user.watchlist_movies
+
+    def __repr__(self):
+        return f'<Principal {self.username}>'
+
+
+class PrincipalCache(LRUCache):
+    """LRU of user id -> Principal, bounded by ``USER_CACHE_SIZE``."""
+
+    def __init__(self):
+        super().__init__('USER_CACHE_SIZE')
+
+    def get(self, user_id):
+        """Return the principal for ``user_id`` or None if there is no such user."""
+        def load():
+            row = db.session.query(User.id, User.username, User.is_admin) \
+                .filter(User.id == user_id).first()
+            return None if row is None else Principal(*row)
+
+        return self.fetch(user_id, load, ttl=current_app.config['USER_CACHE_TTL'])
+
+
+user_principals = PrincipalCache()
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        return user_principals.get(int(user_id))
+    except ValueError:
+        return None
+
+
+def _drop_principals(user_ids):
+    for user_id in user_ids:
+        user_principals.invalidate(user_id)
+
+
+# Drop a user's principal once a write to the user commits
+on_commit(User, lambda user: user.id, _drop_principals,
+          events=('after_update', 'after_delete'))
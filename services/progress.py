@@ -0,0 +1,262 @@
+"""
+Write-behind buffer for watch progress.
+
+The player reports its position every few seconds, and only the latest
+position per (user, movie) matters. Reports are therefore coalesced in
+memory and written by a background thread every
+``PROGRESS_FLUSH_INTERVAL`` seconds (sooner once ``PROGRESS_FLUSH_MAX``
+entries are waiting), as one batched
+``INSERT ... ON CONFLICT (user_id, movie_id) DO UPDATE``.
+
+- Crash loss: a worker that dies without a clean shutdown loses at most
+  the last ``PROGRESS_FLUSH_INTERVAL`` seconds of its reports. The buffer
+  is flushed on a normal interpreter exit.
+- Read-your-writes, within one worker: ``progress_dict`` overlays a
+  buffered report (including one being written at that moment) on the
+  stored row, so ``get_progress`` answers with what was just posted to
+  the same worker. A read served by another worker sees the report only
+  once this worker has flushed it.
+- Several workers: an update only applies when its ``last_watched_at`` is
+  not older than the stored one, so a late flush from another worker
+  cannot move a viewer's position backwards.
+
+A flush that fails as a whole (database unreachable) is merged back into
+the buffer (newer reports win) and retried on the next cycle. Rows the
+database rejects one by one (a deleted user or movie) are dropped and
+counted, so they cannot hold back everyone else's reports. A successful
+flush drops the Continue Watching
+rails of the users it wrote (services/continue_watching.py).
+``PROGRESS_FLUSH_INTERVAL = 0`` writes each report straight through.
+"""
+
+import atexit
+import math
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, or_
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
+
+from extensions import db
+from models import WatchProgress
+from services.continue_watching import continue_watching_cache
+from services.sql import dialect_insert
+
+
+def _upsert_statement():
+    """``INSERT ... ON CONFLICT DO UPDATE`` of watch_progress rows."""
+    table = WatchProgress.__table__
+    stmt = dialect_insert(table)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.movie_id],
+        set_={
+            'current_time': excluded.current_time,
+            # A report without a duration keeps the stored one
+            'total_duration': func.coalesce(
+                func.nullif(excluded.total_duration, 0), table.c.total_duration
+            ),
+            'last_watched_at': excluded.last_watched_at,
+        },
+        where=or_(
+            table.c.last_watched_at.is_(None),
+            table.c.last_watched_at <= excluded.last_watched_at,
+        ),
+    )
+
+
+def parse_seconds(value):
+    """A reported position or duration as a finite float >= 0, else ValueError."""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    seconds = float(value)
+    if not math.isfinite(seconds) or seconds < 0:
+        raise ValueError(value)
+    return seconds
+
+
+class ProgressBuffer:
+    """Latest unsaved report per (user_id, movie_id)."""
+
+    def __init__(self):
+        self._pending = {}
+        # The batch being written; still visible to readers until it commits
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._app = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.failures = 0
+
+    def record(self, user_id, movie_id, current_time, total_duration=None):
+        """Buffer a report and return it as a ``WatchProgress``-style dict."""
+        entry = {
+            'user_id': user_id,
+            'movie_id': movie_id,
+            'current_time': current_time,
+            'total_duration': total_duration or 0.0,
+            'last_watched_at': datetime.utcnow(),
+        }
+        with self._lock:
+            previous = self.pending(user_id, movie_id)
+            if not entry['total_duration'] and previous is not None:
+                entry['total_duration'] = previous['total_duration']
+            self._pending[(user_id, movie_id)] = entry
+            size = len(self._pending)
+
+        config = current_app.config
+        if not config['PROGRESS_FLUSH_INTERVAL']:
+            self.flush()
+        elif size >= config['PROGRESS_FLUSH_MAX']:
+            self._wake.set()
+        return entry
+
+    def pending(self, user_id, movie_id):
+        """The buffered or in-flight report for (user, movie), or None."""
+        key = (user_id, movie_id)
+        entry = self._pending.get(key)
+        return entry if entry is not None else self._flushing.get(key)
+
+    def _restore(self, entries):
+        """Put back entries from a failed flush unless a newer report arrived."""
+        with self._lock:
+            for entry in entries:
+                key = (entry['user_id'], entry['movie_id'])
+                if key not in self._pending:
+                    self._pending[key] = entry
+
+    def _write(self, rows):
+        stmt = _upsert_statement()
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(stmt, rows)
+            return len(rows)
+        except SQLAlchemyError as exc:
+            if _unavailable(exc):
+                raise
+
+        # Some row is rejected (e.g. its user or movie was deleted): write
+        # the rest one by one and drop the rows that still fail
+        written = 0
+        for row in rows:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(stmt, [row])
+                written += 1
+            except SQLAlchemyError as exc:
+                if _unavailable(exc):
+                    raise
+                self.rows_dropped += 1
+                current_app.logger.warning('Dropping watch progress %s/%s: %s',
+                                           row['user_id'], row['movie_id'], exc)
+        return written
+
+    def flush(self):
+        """Write every buffered report; return how many rows were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+
+            rows = list(batch.values())
+            try:
+                written = self._write(rows)
+            except Exception:
+                self.failures += 1
+                self._restore(rows)
+                current_app.logger.exception('Watch progress flush failed; will retry')
+                return 0
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+            self.flushes += 1
+            self.rows_written += written
+            continue_watching_cache.invalidate_users({row['user_id'] for row in rows})
+            return written
+
+    def _flush_forever(self, app, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:  # keep flushing; errors are logged by flush()
+                    pass
+
+    def _flush_at_exit(self):
+        with self._app.app_context():
+            self.flush()
+
+    def start(self, app):
+        """Start the flusher thread for ``app`` and flush again at exit."""
+        if self._app is not None:
+            return
+        self._app = app
+        interval = app.config['PROGRESS_FLUSH_INTERVAL']
+        if interval:
+            threading.Thread(
+                target=self._flush_forever,
+                args=(app, interval),
+                name='progress-flusher',
+                daemon=True,
+            ).start()
+        atexit.register(self._flush_at_exit)
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'failures': self.failures,
+        }
+
+
+def _unavailable(exc):
+    """Whether ``exc`` means the database could not be reached at all."""
+    return isinstance(exc, OperationalError) or \
+        (isinstance(exc, DBAPIError) and exc.connection_invalidated)
+
+
+progress_buffer = ProgressBuffer()
+
+
+def init_progress_buffer(app):
+    progress_buffer.start(app)
+    return progress_buffer
+
+
+def _as_dict(entry, row_id=None):
+    total = entry['total_duration']
+    return {
+        'id': row_id,
+        'user_id': entry['user_id'],
+        'movie_id': entry['movie_id'],
+        'current_time': entry['current_time'],
+        'total_duration': total,
+        'percentage': (entry['current_time'] / total) * 100 if total else 0,
+        'last_watched_at': entry['last_watched_at'].isoformat(),
+    }
+
+
+def progress_dict(user_id, movie_id, row=None):
+    """
+    ``WatchProgress.to_dict()`` for (user, movie) including unsaved reports.
+
+    ``row`` is the stored ``WatchProgress`` (or None); returns None when
+    there is neither a row nor a buffered report.
+    """
+    entry = progress_buffer.pending(user_id, movie_id)
+    if entry is None:
+        return row.to_dict() if row is not None else None
+    if not entry['total_duration'] and row is not None and row.total_duration:
+        entry = dict(entry, total_duration=row.total_duration)
+    return _as_dict(entry, row.id if row is not None else None)
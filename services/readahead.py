@@ -0,0 +1,176 @@
+"""
+Predictive readahead for HLS playback.
+
+A player that just fetched segment N of a rendition will ask for N+1,
+N+2... next. After each segment request the next ``k`` segments are
+handed to a small thread pool which, per ``READAHEAD_MODE``, either
+
+- 'fadvise': calls ``posix_fadvise(WILLNEED)`` on their bytes (for fMP4
+  segments of a source MP4, the file ranges holding their samples) so the
+  kernel starts reading them into the page cache (cheap, no Python-side
+  memory), or
+- 'cache': reads (or builds) them into the hot-segment cache
+  (services/segment_cache.py), so the next request is served from RAM.
+
+'fadvise' falls back to 'cache' where ``posix_fadvise`` is unavailable.
+
+``k`` starts at ``READAHEAD_SEGMENTS`` and grows by one each time the
+number of viewers active on the title in the last
+``READAHEAD_SESSION_WINDOW`` seconds doubles, up to
+``READAHEAD_MAX_SEGMENTS``: prefetched segments of a popular title are
+shared by everybody watching it. The request thread only enqueues work;
+duplicates already queued are skipped, and nothing is queued once
+``READAHEAD_QUEUE_MAX`` jobs are waiting.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from services.hls import source_files, source_media_segment
+from services.media_index import file_handles, segment_location
+from services.mp4 import segment_reads
+from services.segment_cache import cached_segment
+
+
+class ViewerTracker:
+    """
+    Recently active viewers per title: movie id -> {viewer: last seen}.
+
+    Recording a viewer is O(1). Viewers idle for more than ``window``
+    seconds (and titles nobody watches) are swept out at most every
+    ``window / 2`` seconds, so a viewer may be counted for up to 1.5
+    windows after their last request.
+    """
+
+    def __init__(self):
+        self._viewers = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def _prune(self, now, window):
+        for movie_id, viewers in list(self._viewers.items()):
+            for stale in [v for v, seen in viewers.items() if now - seen > window]:
+                del viewers[stale]
+            if not viewers:
+                del self._viewers[movie_id]
+        self._next_prune = now + window / 2
+
+    def touch(self, movie_id, viewer, window):
+        """Record ``viewer`` and return how many are active on the title."""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now, window)
+            viewers = self._viewers.setdefault(movie_id, {})
+            viewers[viewer] = now
+            return len(viewers)
+
+
+class Readahead:
+    """Bounded, de-duplicated queue of prefetch jobs on a thread pool."""
+
+    def __init__(self):
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.viewers = ViewerTracker()
+        self.scheduled = 0
+        self.skipped = 0
+
+    def depth(self, movie_id, viewer):
+        """Segments to prefetch for this request (``k``)."""
+        config = current_app.config
+        active = self.viewers.touch(movie_id, viewer, config['READAHEAD_SESSION_WINDOW'])
+        return min(config['READAHEAD_SEGMENTS'] + active.bit_length() - 1,
+                   config['READAHEAD_MAX_SEGMENTS'])
+
+    def submit(self, key, func, *args):
+        config = current_app.config
+        with self._lock:
+            if key in self._pending or len(self._pending) >= config['READAHEAD_QUEUE_MAX']:
+                self.skipped += 1
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=config['READAHEAD_WORKERS'],
+                    thread_name_prefix='readahead',
+                )
+            self._pending.add(key)
+            self.scheduled += 1
+        app = current_app._get_current_object()
+        self._executor.submit(self._run, app, key, func, args)
+
+    def _run(self, app, key, func, args):
+        try:
+            with app.app_context():
+                func(*args)
+        except Exception:  # prefetching is best effort
+            app.logger.debug('Readahead of %r failed', key, exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'scheduled': self.scheduled,
+            'skipped': self.skipped,
+        }
+
+
+readahead = Readahead()
+
+
+def _mode():
+    mode = current_app.config['READAHEAD_MODE']
+    if mode == 'fadvise' and not hasattr(os, 'posix_fadvise'):
+        return 'cache'
+    return mode
+
+
+def _prefetch(location, start, stop):
+    if _mode() == 'cache':
+        cached_segment(location, start, stop)
+        return
+    handle = file_handles.acquire(location)
+    try:
+        os.posix_fadvise(handle.fd, start, stop - start, os.POSIX_FADV_WILLNEED)
+    finally:
+        file_handles.release(handle)
+
+
+def _prefetch_segment_file(movie_id, quality, segment):
+    location = segment_location(movie_id, quality, segment)
+    if location is not None:
+        _prefetch(location, 0, location.size)
+
+
+def prefetch_after_segment(movie_id, quality, segment, viewer):
+    """Queue the packaged ``.ts`` segments following ``segment``."""
+    if _mode() == 'off':
+        return
+    for n in range(segment + 1, segment + 1 + readahead.depth(movie_id, viewer)):
+        readahead.submit(('ts', movie_id, quality, n), _prefetch_segment_file,
+                         movie_id, quality, n)
+
+
+def _prefetch_fragment(location, index, segment):
+    if _mode() == 'cache':
+        source_media_segment(location, index, segment)
+        return
+    source = source_files.get(location)
+    for start, stop in segment_reads(source.tracks, index.segments[segment]):
+        _prefetch(location, start, stop)
+
+
+def prefetch_after_fragment(movie_id, location, index, segment, viewer):
+    """Queue the fMP4 segments of the source MP4 following ``segment``."""
+    if _mode() == 'off':
+        return
+    stop = min(segment + 1 + readahead.depth(movie_id, viewer), len(index.segments))
+    for n in range(segment + 1, stop):
+        readahead.submit(('fmp4', location.path, n), _prefetch_fragment, location, index, n)
@@ -0,0 +1,88 @@
+"""
+Catalog search backends.
+
+On PostgreSQL the catalog is searched through ``movies.search_vector``, a
+``tsvector`` over title, description and category that a trigger keeps in
+sync and a GIN index makes cheap to probe. Results are ranked with
+``ts_rank``. Other databases (SQLite in development and tests) fall back to
+the original case-insensitive substring match on the title.
+
+The backend is chosen by ``SEARCH_BACKEND`` in the config:
+- 'auto':     full-text on PostgreSQL, ilike elsewhere (default)
+- 'fulltext': always use the tsvector column
+- 'ilike':    always use the substring match
+
+Independently of the backend, ``mode='fuzzy'`` switches to typo-tolerant
+title matching (see services/fuzzy.py).
+"""
+
+from flask import current_app
+from sqlalchemy import DDL, event, func
+
+from extensions import db
+from models import Movie
+from services.fuzzy import fuzzy_search
+
+# Text search configuration used both by the trigger and by queries;
+# they must agree or stemmed terms will not match.
+SEARCH_CONFIG = 'english'
+
+# Weighted document: title hits outrank description hits, which outrank
+# a category match.
+SEARCH_VECTOR_FUNCTION = DDL(f"""
+CREATE OR REPLACE FUNCTION movies_search_vector(title text, description text, category text)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(category, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE
+""")
+
+SEARCH_VECTOR_TRIGGER_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION movies_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := movies_search_vector(NEW.title, NEW.description, NEW.category);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+""")
+
+SEARCH_VECTOR_TRIGGER = DDL("""
+CREATE TRIGGER movies_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description, category ON movies
+FOR EACH ROW EXECUTE FUNCTION movies_search_vector_update()
+""")
+
+# db.create_all() builds the column and GIN index from the model; the
+# function and trigger that maintain it are attached here so fresh
+# databases match the migrated ones.
+for _ddl in (SEARCH_VECTOR_FUNCTION, SEARCH_VECTOR_TRIGGER_FUNCTION, SEARCH_VECTOR_TRIGGER):
+    event.listen(Movie.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
+
+def search_backend():
+    """Return the active backend name: 'fulltext' or 'ilike'."""
+    backend = current_app.config.get('SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return 'fulltext' if db.engine.dialect.name == 'postgresql' else 'ilike'
+    return backend
+
+
+def apply_search(query, search, mode='default'):
+    """
+    Filter ``query`` by the search string.
+
+    Returns ``(query, ranked)``. When ``ranked`` is True the query is already
+    ordered by relevance and callers must not impose their own ordering.
+    """
+    if mode == 'fuzzy':
+        return fuzzy_search(query, search)
+
+    if search_backend() == 'fulltext':
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, search)
+        rank = func.ts_rank(Movie.search_vector, tsquery)
+        query = query.filter(Movie.search_vector.op('@@')(tsquery)) \
+            .order_by(rank.desc(), Movie.id.desc())
+        return query, True
+
+    return query.filter(Movie.title.ilike(f'%{search}%')), False
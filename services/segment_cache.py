@@ -0,0 +1,149 @@
+"""
+In-memory cache of hot media segments.
+
+Every viewer who presses play on a new release asks for the same first
+few segments. Keeping those bytes in RAM turns each request into a single
+socket write, with no open/read syscalls.
+
+Entries are whole byte ranges, or fMP4 segments built from them
+(services/hls.py), keyed by file identity (path, size, mtime) and range
+or segment number, so a replaced file simply stops matching. The cache is a
+segmented LRU bounded by ``SEGMENT_CACHE_BYTES``:
+
+- new entries go to the probationary segment;
+- a second hit promotes an entry to the protected segment, which may hold
+  at most ``SEGMENT_CACHE_PROTECTED_RATIO`` of the budget; entries pushed
+  out of it drop back to probation rather than out of the cache;
+- eviction takes the least recently used probationary entry first.
+
+So a viewer seeking through an old title (each range read once) cannot
+flush the segments everybody else is reading. Ranges larger than
+``SEGMENT_CACHE_MAX_ITEM`` are never cached; a budget of 0 disables the
+cache.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from services.media_index import file_handles
+
+
+class SegmentCache:
+    """Segmented LRU of key -> bytes with a byte budget."""
+
+    def __init__(self):
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._bytes = 0
+        self._protected_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._protected.get(key)
+            if data is not None:
+                self._protected.move_to_end(key)
+                self.hits += 1
+                return data
+
+            data = self._probation.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._protected[key] = data
+            self._protected_bytes += len(data)
+            config = current_app.config
+            limit = config['SEGMENT_CACHE_BYTES'] * config['SEGMENT_CACHE_PROTECTED_RATIO']
+            while self._protected_bytes > limit and len(self._protected) > 1:
+                demoted_key, demoted = self._protected.popitem(last=False)
+                self._protected_bytes -= len(demoted)
+                self._probation[demoted_key] = demoted
+            return data
+
+    def put(self, key, data):
+        budget = current_app.config['SEGMENT_CACHE_BYTES']
+        if len(data) > min(budget, current_app.config['SEGMENT_CACHE_MAX_ITEM']):
+            return
+        with self._lock:
+            if key in self._probation or key in self._protected:
+                return
+            self._probation[key] = data
+            self._bytes += len(data)
+            while self._bytes > budget:
+                if self._probation:
+                    _, evicted = self._probation.popitem(last=False)
+                else:
+                    _, evicted = self._protected.popitem(last=False)
+                    self._protected_bytes -= len(evicted)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+            self._bytes = self._protected_bytes = 0
+
+    def stats(self):
+        return {
+            'bytes': self._bytes,
+            'protected_bytes': self._protected_bytes,
+            'entries': len(self._probation) + len(self._protected),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+segment_cache = SegmentCache()
+
+
+def segment_key(location, start, stop):
+    return (location.path, location.size, location.mtime_ns, start, stop)
+
+
+def read_segment(location, start, stop):
+    """Read ``[start, stop)`` of ``location`` through the shared descriptor."""
+    handle = file_handles.acquire(location)
+    try:
+        chunks = []
+        while start < stop:
+            chunk = os.pread(handle.fd, stop - start, start)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            start += len(chunk)
+        return b''.join(chunks)
+    finally:
+        file_handles.release(handle)
+
+
+def cached_bytes(key, build):
+    """Bytes for ``key`` from the cache, calling ``build()`` on a miss."""
+    data = segment_cache.get(key)
+    if data is None:
+        data = build()
+        segment_cache.put(key, data)
+    return data
+
+
+def cached_segment(location, start, stop):
+    """
+    Bytes of ``[start, stop)`` from the cache, loading them on a miss.
+
+    Returns None when the range is too large to cache (or caching is
+    off), so the caller streams it from disk instead.
+    """
+    config = current_app.config
+    if stop - start > min(config['SEGMENT_CACHE_BYTES'], config['SEGMENT_CACHE_MAX_ITEM']):
+        return None
+    return cached_bytes(segment_key(location, start, stop),
+                        lambda: read_segment(location, start, stop))
@@ -0,0 +1,36 @@
+"""
+Dialect-specific SQL shared by the services.
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+
+# Dialects whose INSERT supports ON CONFLICT (upserts, insert-or-ignore)
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def explain_json(query):
+    """
+    Top plan node of ``EXPLAIN (FORMAT JSON)`` for an ORM query or
+    statement, run on the session's connection. PostgreSQL only.
+    """
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    return plan[0]['Plan']
+
+
+def dialect_insert(table):
+    """
+    ``INSERT`` into ``table`` for the current database, with
+    ``on_conflict_do_update``/``on_conflict_do_nothing`` available.
+    """
+    name = db.engine.dialect.name
+    try:
+        insert = _UPSERT_INSERTS[name]
+    except KeyError:
+        raise NotImplementedError(f'INSERT ... ON CONFLICT is not supported on {name}') from None
+    return insert(table)
@@ -0,0 +1,177 @@
+"""
+In-memory prefix index for search-box typeahead.
+
+Titles are held in a sorted array of ``(key, movie_id)`` pairs so every
+completion lookup is two ``bisect`` calls plus a scan of the matching
+slice; the database is never touched per keystroke. Each title is indexed
+under its full lower-cased text and under every later word, so "knight"
+completes to "The Dark Knight". Matches are ranked by rating.
+
+The index is built lazily on first use, updated in place by the admin
+create/edit/delete routes, and fully rebuilt after ``SUGGEST_INDEX_TTL``
+seconds so that workers which did not handle a write converge. That
+rebuild runs on a background thread, one at a time per worker, while
+requests keep completing against the previous index.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from flask import current_app
+
+from extensions import db
+from models import Movie
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+# Upper bound for slicing the sorted key array: sorts after any real key
+# that starts with the prefix.
+_PREFIX_END = '\U0010ffff'
+
+# Very short prefixes match large slices of the catalog; their top-N lists
+# are memoised until the next write.
+_MEMO_PREFIX_LEN = 2
+
+
+def normalize(value):
+    return ' '.join(_WORD_RE.findall(value.lower()))
+
+
+def _keys_for(title):
+    words = normalize(title).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over movie titles, weighted by rating."""
+
+    def __init__(self):
+        self._keys = []        # sorted [(key, movie_id)]
+        self._entries = {}     # movie_id -> (title, release_year, weight, keys)
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._built_at = None
+
+    def _add(self, movie_id, title, release_year, rating):
+        keys = _keys_for(title or '')
+        self._entries[movie_id] = (title, release_year, rating or 0.0, keys)
+        for key in keys:
+            bisect.insort(self._keys, (key, movie_id))
+
+    def _remove(self, movie_id):
+        entry = self._entries.pop(movie_id, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            i = bisect.bisect_left(self._keys, (key, movie_id))
+            if i < len(self._keys) and self._keys[i] == (key, movie_id):
+                del self._keys[i]
+
+    def rebuild(self):
+        """Reload every title from the database."""
+        rows = db.session.query(Movie.id, Movie.title, Movie.release_year, Movie.rating).all()
+        with self._lock:
+            self._keys = []
+            self._entries = {}
+            self._memo = {}
+            for row in rows:
+                keys = _keys_for(row.title or '')
+                self._entries[row.id] = (row.title, row.release_year, row.rating or 0.0, keys)
+                self._keys.extend((key, row.id) for key in keys)
+            self._keys.sort()
+            self._built_at = time.monotonic()
+
+    def upsert(self, movie):
+        """Add or refresh a single movie after it was committed."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._remove(movie.id)
+            self._add(movie.id, movie.title, movie.release_year, movie.rating)
+            self._memo = {}
+
+    def remove(self, movie_id):
+        """Drop a movie after its deletion was committed."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._remove(movie_id)
+            self._memo = {}
+
+    def _stale(self, ttl):
+        return self._built_at is None or time.monotonic() - self._built_at > ttl
+
+    def ensure_fresh(self, ttl):
+        """Build the index on first use; start a background rebuild once stale."""
+        if not self._stale(ttl):
+            return
+        if self._built_at is None:
+            # Nothing to serve yet: build now; concurrent callers wait for it
+            with self._rebuild_lock:
+                if self._built_at is None:
+                    self.rebuild()
+            return
+
+        if not self._rebuild_lock.acquire(blocking=False):
+            return  # already rebuilding; keep serving the current index
+        if not self._stale(ttl):  # rebuilt since the check above
+            self._rebuild_lock.release()
+            return
+        threading.Thread(
+            target=self._rebuild_in_background,
+            args=(current_app._get_current_object(),),
+            name='suggest-rebuild',
+            daemon=True,
+        ).start()
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except Exception:
+                    app.logger.exception('Title suggestion rebuild failed; will retry')
+        finally:
+            self._rebuild_lock.release()
+
+    def suggest(self, prefix, limit=8):
+        """Return up to ``limit`` completions for ``prefix``, best rated first."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        memo_key = (prefix, limit)
+        if len(prefix) <= _MEMO_PREFIX_LEN:
+            cached = self._memo.get(memo_key)
+            if cached is not None:
+                return cached
+
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, (prefix,))
+            hi = bisect.bisect_left(self._keys, (prefix + _PREFIX_END,), lo)
+            movie_ids = {movie_id for _, movie_id in self._keys[lo:hi]}
+            best = heapq.nsmallest(
+                limit, movie_ids,
+                key=lambda movie_id: (-self._entries[movie_id][2],
+                                      len(self._entries[movie_id][0] or ''),
+                                      movie_id)
+            )
+            results = [
+                {
+                    'id': movie_id,
+                    'title': self._entries[movie_id][0],
+                    'release_year': self._entries[movie_id][1],
+                }
+                for movie_id in best
+            ]
+
+            if len(prefix) <= _MEMO_PREFIX_LEN:
+                self._memo[memo_key] = results
+        return results
+
+
+title_suggestions = PrefixIndex()
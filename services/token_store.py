@@ -0,0 +1,241 @@
+"""
+Server-side stream-token stores.
+
+Signed tokens (the default, see services/playback.py) need no storage. When
+tokens must be revocable or counted, ``STREAM_TOKEN_BACKEND`` selects one
+of these stores instead:
+
+- 'memory': per-process dict with a min-heap of expiry times. Lookups are
+  O(1); expiring a token is an O(log n) heap pop rather than a scan of
+  every token. Only suitable for a single worker process.
+- 'sqlite': a SQLite file in WAL mode shared by all worker processes on a
+  host. Lookups are primary-key probes; expiry is a range delete on an
+  indexed ``expires_at`` column.
+
+Both stores are purged by a background reaper thread every
+``STREAM_TOKEN_REAP_INTERVAL`` seconds and bounded by ``STREAM_TOKEN_MAX``,
+dropping the tokens closest to expiry first. The memory store enforces the
+bound on every issue; the SQLite store leaves it to the reaper, so issuing
+stays a single insert and it may briefly hold the tokens issued within one
+interval beyond the bound.
+"""
+
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from flask import current_app
+
+
+class TokenStore(ABC):
+    """Interface for stream-token storage. Times are UNIX timestamps."""
+
+    @abstractmethod
+    def issue(self, token, movie_id, user_id, expires_at):
+        pass
+
+    @abstractmethod
+    def get(self, token):
+        """Return ``{'movie_id', 'user_id', 'expires_at'}`` or None."""
+
+    @abstractmethod
+    def revoke(self, token):
+        pass
+
+    @abstractmethod
+    def purge_expired(self, now=None):
+        """Drop expired tokens (and any beyond the bound); return how many were removed."""
+
+    @abstractmethod
+    def stats(self):
+        pass
+
+
+class MemoryTokenStore(TokenStore):
+    """Dict for lookups plus a heap of ``(expires_at, token)`` for expiry."""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self._tokens = {}
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+
+    def _pop_earliest(self):
+        """Remove the live token closest to expiry; skip stale heap entries."""
+        while self._expiry_heap:
+            expires_at, token = heapq.heappop(self._expiry_heap)
+            data = self._tokens.get(token)
+            if data is not None and data['expires_at'] == expires_at:
+                del self._tokens[token]
+                return expires_at
+        return None
+
+    def issue(self, token, movie_id, user_id, expires_at):
+        with self._lock:
+            self._purge_locked(time.time())
+            while len(self._tokens) >= self.max_tokens:
+                self._pop_earliest()
+            self._tokens[token] = {
+                'movie_id': movie_id,
+                'user_id': user_id,
+                'expires_at': expires_at,
+            }
+            heapq.heappush(self._expiry_heap, (expires_at, token))
+
+    def get(self, token):
+        data = self._tokens.get(token)
+        if data is None or data['expires_at'] < time.time():
+            return None
+        return data
+
+    def revoke(self, token):
+        # The heap entry becomes stale and is skipped when popped
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def _purge_locked(self, now):
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            expires_at, token = heapq.heappop(self._expiry_heap)
+            data = self._tokens.get(token)
+            if data is not None and data['expires_at'] == expires_at:
+                del self._tokens[token]
+                removed += 1
+        # Revocations leave stale heap entries; rebuild if they dominate
+        if len(self._expiry_heap) > 2 * len(self._tokens) + 1024:
+            self._expiry_heap = [(d['expires_at'], t) for t, d in self._tokens.items()]
+            heapq.heapify(self._expiry_heap)
+        return removed
+
+    def purge_expired(self, now=None):
+        with self._lock:
+            return self._purge_locked(now if now is not None else time.time())
+
+    def stats(self):
+        with self._lock:
+            users = {data['user_id'] for data in self._tokens.values()}
+            return {'active_tokens': len(self._tokens), 'active_users': len(users)}
+
+
+class SQLiteTokenStore(TokenStore):
+    """Token table in a local SQLite file shared across worker processes."""
+
+    def __init__(self, path, max_tokens):
+        self.path = path
+        self.max_tokens = max_tokens
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stream_tokens (
+                token TEXT PRIMARY KEY,
+                movie_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_stream_tokens_expires_at '
+                     'ON stream_tokens (expires_at)')
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def issue(self, token, movie_id, user_id, expires_at):
+        self._conn().execute('INSERT OR REPLACE INTO stream_tokens VALUES (?, ?, ?, ?)',
+                             (token, movie_id, user_id, expires_at))
+
+    def get(self, token):
+        row = self._conn().execute(
+            'SELECT movie_id, user_id, expires_at FROM stream_tokens '
+            'WHERE token = ? AND expires_at >= ?',
+            (token, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {'movie_id': row[0], 'user_id': row[1], 'expires_at': row[2]}
+
+    def revoke(self, token):
+        self._conn().execute('DELETE FROM stream_tokens WHERE token = ?', (token,))
+
+    def purge_expired(self, now=None):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            removed = conn.execute(
+                'DELETE FROM stream_tokens WHERE expires_at < ?',
+                (now if now is not None else time.time(),)
+            ).rowcount
+            # Counted and trimmed in one statement, under the write lock
+            removed += conn.execute("""
+                DELETE FROM stream_tokens WHERE token IN (
+                    SELECT token FROM stream_tokens ORDER BY expires_at
+                    LIMIT max(0, (SELECT COUNT(*) FROM stream_tokens) - ?)
+                )
+            """, (self.max_tokens,)).rowcount
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return removed
+
+    def stats(self):
+        tokens, users = self._conn().execute(
+            'SELECT COUNT(*), COUNT(DISTINCT user_id) FROM stream_tokens '
+            'WHERE expires_at >= ?', (time.time(),)
+        ).fetchone()
+        return {'active_tokens': tokens, 'active_users': users}
+
+
+def _reap_forever(app, store, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                store.purge_expired()
+            except Exception:  # keep reaping; a locked database is transient
+                current_app.logger.exception('Stream token purge failed; will retry')
+
+
+def init_token_store(app):
+    """
+    Create the configured token store and start its reaper thread.
+
+    The store is kept in ``app.extensions['stream_token_store']``; it is
+    None when tokens are signed and need no storage.
+    """
+    backend = app.config['STREAM_TOKEN_BACKEND']
+    max_tokens = app.config['STREAM_TOKEN_MAX']
+
+    if backend == 'memory':
+        store = MemoryTokenStore(max_tokens)
+    elif backend == 'sqlite':
+        path = app.config['STREAM_TOKEN_STORE_PATH'] or \
+            os.path.join(app.instance_path, 'stream_tokens.sqlite3')
+        store = SQLiteTokenStore(path, max_tokens)
+    elif backend == 'signed':
+        store = None
+    else:
+        raise ValueError(f'Unknown STREAM_TOKEN_BACKEND {backend!r}')
+
+    app.extensions['stream_token_store'] = store
+    if store is not None:
+        reaper = threading.Thread(
+            target=_reap_forever,
+            args=(app, store, app.config['STREAM_TOKEN_REAP_INTERVAL']),
+            name='stream-token-reaper',
+            daemon=True,
+        )
+        reaper.start()
+    return store
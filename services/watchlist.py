@@ -0,0 +1,38 @@
+"""
+Watchlist writes as single statements.
+
+Adding is ``INSERT ... SELECT id FROM movies WHERE id IN (...)
+ON CONFLICT DO NOTHING`` and removing is one ``DELETE ... WHERE``: no
+read-then-write round trips, so repeated or concurrent clicks (a
+double-click, two tabs) are harmless, and ids of movies that do not
+exist are skipped instead of failing the statement. Both take any number
+of movie ids; the caller commits, so several calls form one transaction.
+"""
+
+from sqlalchemy import delete, select
+
+from extensions import db
+from models import Movie, watchlist
+from services.sql import dialect_insert
+
+
+def add_to_watchlist(user_id, movie_ids):
+    """Add existing ``movie_ids`` to the watchlist; return how many were new."""
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return 0
+    rows = select(db.literal(user_id), Movie.id).where(Movie.id.in_(movie_ids))
+    stmt = dialect_insert(watchlist) \
+        .from_select(['user_id', 'movie_id'], rows) \
+        .on_conflict_do_nothing(index_elements=['user_id', 'movie_id'])
+    return db.session.execute(stmt).rowcount
+
+
+def remove_from_watchlist(user_id, movie_ids):
+    """Remove ``movie_ids`` from the watchlist; return how many were there."""
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return 0
+    stmt = delete(watchlist).where(watchlist.c.user_id == user_id,
+                                   watchlist.c.movie_id.in_(movie_ids))
+    return db.session.execute(stmt).rowcount
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing app builds the module-level app; keep it off PostgreSQL
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+
+@pytest.fixture
+def app(tmp_path):
+    from app import create_app
+    from config import Config
+    from services.fuzzy import title_index
+    from services.hls import playlist_cache
+    from services.movie_cache import movie_cache
+    from services.passwords import login_throttle
+    from services.principal import user_principals
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "test.db"}'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        MEDIA_ROOT = str(tmp_path / 'media')
+        HLS_INDEX_DIR = str(tmp_path / 'hls_index')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        PROGRESS_FLUSH_INTERVAL = 0
+
+    os.makedirs(TestConfig.MEDIA_ROOT)
+    # Process-wide caches are keyed by ids that every test database reuses
+    for cache in (login_throttle, movie_cache, playlist_cache, user_principals):
+        cache.clear()
+    title_index.invalidate()
+    app = create_app(TestConfig)
+    yield app
+    from extensions import db
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,138 @@
+"""Synthetic MP4 files with known sample tables for the parser tests."""
+
+import struct
+
+
+def box(box_type, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+
+def full_box(box_type, *payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]), *payload)
+
+
+def _u32s(values):
+    return b''.join(struct.pack('>I', v) for v in values)
+
+
+def _runs(values):
+    """Run-length (count, value) pairs as stored by stts and ctts."""
+    runs = []
+    for value in values:
+        if runs and runs[-1][1] == value:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, value])
+    return runs
+
+
+class TrackSpec:
+    """A track to write: per-sample durations and sizes, chunking, extras."""
+
+    def __init__(self, handler, track_id, timescale, durations, sizes, chunks,
+                 sync=None, ctts=None, constant_size=False, width=320, height=240,
+                 sample_entry=None):
+        self.handler = handler
+        self.track_id = track_id
+        self.timescale = timescale
+        self.durations = durations
+        self.sizes = sizes
+        self.chunks = chunks            # samples per chunk, in order
+        self.sync = sync                # 0-based keyframes, None for all
+        self.ctts = ctts
+        self.constant_size = constant_size
+        self.width = width
+        self.height = height
+        self.sample_entry = sample_entry    # raw stsd entry instead of avc1/mp4a
+
+    def sample_bytes(self, n):
+        return bytes([(self.track_id * 16 + n) % 251]) * self.sizes[n]
+
+    def entry(self):
+        if self.sample_entry is not None:
+            return self.sample_entry
+        if self.handler == b'vide':
+            avcc = box(b'avcC', bytes([1, 0x64, 0, 0x1f, 0xff, 0xe1]))
+            return box(b'avc1', bytes(78), avcc)
+        # esds: ES descriptor > decoder config (AAC) > AAC-LC specific info
+        info = bytes([0x05, 2, 0x12, 0x10])
+        config = bytes([0x04, 13 + len(info), 0x40, 0x15]) + bytes(11) + info
+        esds = full_box(b'esds', bytes([0x03, 3 + len(config), 0, 1, 0]) + config)
+        return box(b'mp4a', bytes(28), esds)
+
+    def trak(self, chunk_offsets, co64):
+        stts = _runs(self.durations)
+        tables = [
+            full_box(b'stsd', _u32s([1]), self.entry()),
+            full_box(b'stts', _u32s([len(stts)] + [v for run in stts for v in run])),
+        ]
+        if self.ctts is not None:
+            ctts = _runs(self.ctts)
+            tables.append(full_box(b'ctts', _u32s([len(ctts)] + [v for run in ctts for v in run])))
+        if self.sync is not None:
+            tables.append(full_box(b'stss', _u32s([len(self.sync)] + [n + 1 for n in self.sync])))
+        if self.constant_size:
+            tables.append(full_box(b'stsz', _u32s([self.sizes[0], len(self.sizes)])))
+        else:
+            tables.append(full_box(b'stsz', _u32s([0, len(self.sizes)] + list(self.sizes))))
+        stsc = []
+        for chunk, count in enumerate(self.chunks):
+            if not stsc or stsc[-1][1] != count:
+                stsc.append([chunk + 1, count, 1])
+        tables.append(full_box(b'stsc', _u32s([len(stsc)] + [v for run in stsc for v in run])))
+        if co64:
+            tables.append(full_box(b'co64', _u32s([len(chunk_offsets)]),
+                                   b''.join(struct.pack('>Q', o) for o in chunk_offsets)))
+        else:
+            tables.append(full_box(b'stco', _u32s([len(chunk_offsets)] + chunk_offsets)))
+
+        duration = sum(self.durations)
+        tkhd = full_box(b'tkhd', bytes(8), _u32s([self.track_id, 0, duration]), bytes(60),
+                        _u32s([self.width << 16, self.height << 16]))
+        mdhd = full_box(b'mdhd', _u32s([0, 0, self.timescale, duration]), bytes(4))
+        hdlr = full_box(b'hdlr', bytes(4), self.handler, bytes(12), b'handler\0')
+        media_header = full_box(b'vmhd', bytes(8)) if self.handler == b'vide' \
+            else full_box(b'smhd', bytes(4))
+        dinf = box(b'dinf', full_box(b'dref', _u32s([1]), full_box(b'url ', b'')))
+        minf = box(b'minf', media_header, dinf, box(b'stbl', *tables))
+        return box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, minf))
+
+
+def build_mp4(tracks, faststart=True, co64=False):
+    """
+    A progressive MP4 with the tracks' chunks interleaved in one mdat.
+
+    Returns ``(data, offsets)``: the file and, per track, each sample's
+    file offset.
+    """
+    ftyp = box(b'ftyp', b'isom', _u32s([512]), b'isomiso2avc1mp41')
+    mvhd = full_box(b'mvhd', _u32s([0, 0, 1000, 0]), bytes(80))
+
+    def moov(chunk_offsets):
+        return box(b'moov', mvhd, *(t.trak(o, co64) for t, o in zip(tracks, chunk_offsets)))
+
+    def layout(start):
+        payload = []
+        position = start
+        chunk_offsets = [[] for _ in tracks]
+        offsets = [[] for _ in tracks]
+        cursors = [0] * len(tracks)
+        for chunk in range(max(len(t.chunks) for t in tracks)):
+            for i, track in enumerate(tracks):
+                if chunk >= len(track.chunks):
+                    continue
+                chunk_offsets[i].append(position)
+                for n in range(cursors[i], cursors[i] + track.chunks[chunk]):
+                    offsets[i].append(position)
+                    payload.append(track.sample_bytes(n))
+                    position += track.sizes[n]
+                cursors[i] += track.chunks[chunk]
+        return chunk_offsets, offsets, b''.join(payload)
+
+    if faststart:
+        placeholder = moov([[0] * len(t.chunks) for t in tracks])
+        chunk_offsets, offsets, payload = layout(len(ftyp) + len(placeholder) + 8)
+        return ftyp + moov(chunk_offsets) + box(b'mdat', payload), offsets
+    chunk_offsets, offsets, payload = layout(len(ftyp) + 8)
+    return ftyp + box(b'mdat', payload) + moov(chunk_offsets), offsets
@@ -0,0 +1,31 @@
+from extensions import db
+from models import Movie
+from services.catalog import catalog_query
+
+
+def add_movies(*movies):
+    db.session.add_all(Movie(title=title, category=category) for title, category in movies)
+    db.session.commit()
+
+
+def titles(search, category=''):
+    return [movie.title for movie in catalog_query(search, category, mode='fuzzy')[0]]
+
+
+def test_category_filter_applies_before_the_limit(app):
+    app.config['FUZZY_SEARCH_LIMIT'] = 3
+    with app.app_context():
+        add_movies(('The Dark Knight', 'Drama'), *[('The Dark Knight', 'Action')] * 5)
+        assert len(titles('dark knigt')) == 3
+        assert titles('dark knigt', 'Drama') == ['The Dark Knight']
+
+
+def test_index_follows_committed_title_changes(app):
+    with app.app_context():
+        add_movies(('Interstellar', 'Sci-Fi'))
+        assert titles('interstelar') == ['Interstellar']
+
+        Movie.query.one().title = 'Inception'
+        db.session.commit()
+        assert titles('interstelar') == []
+        assert titles('inceptoin') == ['Inception']
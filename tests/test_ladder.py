@@ -0,0 +1,88 @@
+import os
+
+from mp4_builder import TrackSpec, build_mp4
+
+from extensions import db
+from models import Movie, MovieVariant
+
+
+def write_mp4(path):
+    sync = list(range(0, 90, 30))
+    video = TrackSpec(b'vide', 1, 30000, [1000] * 90, [4000 if n in sync else 500 for n in range(90)],
+                      [10] * 9, sync=sync, width=1280, height=720)
+    audio = TrackSpec(b'soun', 2, 48000, [1024] * 141, [300] * 141, [16] * 8 + [13],
+                      constant_size=True)
+    with open(path, 'wb') as f:
+        f.write(build_mp4([video, audio])[0])
+
+
+def package(directory, sizes, duration=6.0):
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'playlist.m3u8'), 'w') as f:
+        f.write(''.join(f'#EXTINF:{duration},\n{n}.ts\n' for n in range(len(sizes))))
+    for n, size in enumerate(sizes):
+        with open(os.path.join(directory, f'{n}.ts'), 'wb') as f:
+            f.write(b'G' * size)
+
+
+def create_movie(client, video_url):
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client.post('/movie/new', data={
+        'title': 'Sample', 'poster': '', 'description': '', 'category': 'Drama',
+        'release_year': '2020', 'video_url': video_url,
+    })
+
+
+def master_playlist(client, movie_id):
+    token = client.get(f'/stream/{movie_id}/token').get_json()['token']
+    return client.get(f'/stream/{movie_id}/hls/playlist.m3u8?token={token}')
+
+
+def test_ingest_stores_measurements_on_rows(app, client):
+    media = app.config['MEDIA_ROOT']
+    write_mp4(os.path.join(media, 'sample.mp4'))
+    with app.app_context():
+        # Packaged before the movie is edited in the admin form
+        movie = Movie(title='Sample', category='Drama', video_url='/static/videos/sample.mp4')
+        movie.variants = [MovieVariant(quality='720p', url='/hls/720p.m3u8', height=720)]
+        db.session.add(movie)
+        db.session.commit()
+        movie_id = movie.id
+    package(os.path.join(media, 'hls', str(movie_id), '720p'), [30000, 45000])
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    response = client.post(f'/movie/{movie_id}/edit', data={
+        'title': 'Sample', 'poster': '', 'description': '', 'category': 'Drama',
+        'release_year': '2020', 'video_url': '/static/videos/sample.mp4',
+    })
+    assert response.status_code == 302
+
+    with app.app_context():
+        rows = {row.quality: row for row in db.session.get(Movie, movie_id).variants}
+    assert set(rows) == {'720p', 'source'}
+    assert (rows['720p'].bitrate, rows['720p'].average_bitrate) == (60000, 50000)
+    assert rows['720p'].byte_size == 75000
+    assert rows['source'].url == '/static/videos/sample.mp4'
+    assert rows['source'].codec == 'avc1.64001f,mp4a.40.2'
+    assert (rows['source'].width, rows['source'].height) == (1280, 720)
+
+    # The master playlist comes from the rows, not from the media
+    with app.app_context():
+        db.session.get(Movie, movie_id).variants[0].bitrate = 123
+        db.session.commit()
+    text = master_playlist(client, movie_id).get_data(as_text=True)
+    assert 'BANDWIDTH=123,' in text
+    assert 'CODECS="avc1.64001f,mp4a.40.2"' in text
+
+
+def test_ingest_survives_unwritable_index_dir(app, client):
+    write_mp4(os.path.join(app.config['MEDIA_ROOT'], 'sample.mp4'))
+    blocker = os.path.join(app.config['MEDIA_ROOT'], 'not-a-directory')
+    open(blocker, 'w').close()
+    app.config['HLS_INDEX_DIR'] = os.path.join(blocker, 'hls_index')
+
+    assert create_movie(client, '/static/videos/sample.mp4').status_code == 302
+    with app.app_context():
+        movie = Movie.query.filter_by(title='Sample').one()
+        assert [row.quality for row in movie.variants] == ['source']
+        assert movie.variants[0].bitrate
@@ -0,0 +1,20 @@
+def login(client, username, password, ip):
+    return client.post('/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def test_username_throttled_across_ips(app, client):
+    app.config.update(LOGIN_IP_LIMIT=100, LOGIN_USERNAME_IP_LIMIT=3, LOGIN_USERNAME_LIMIT=6)
+    statuses = [login(client, 'admin', 'wrong', f'10.0.0.{n % 4}').status_code
+                for n in range(6)]
+    assert statuses == [200] * 6
+    assert login(client, 'admin', 'wrong', '10.0.0.9').status_code == 429
+    assert login(client, 'Admin', 'admin123', '10.0.0.10').status_code == 429
+
+
+def test_one_ip_cannot_lock_out_the_owner(app, client):
+    app.config.update(LOGIN_IP_LIMIT=100, LOGIN_USERNAME_IP_LIMIT=3, LOGIN_USERNAME_LIMIT=10)
+    for _ in range(3):
+        login(client, 'admin', 'wrong', '10.0.0.1')
+    assert login(client, 'admin', 'wrong', '10.0.0.1').status_code == 429
+    assert login(client, 'admin', 'admin123', '10.0.0.2').status_code == 302
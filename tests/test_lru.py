@@ -0,0 +1,32 @@
+import pytest
+
+from services.lru import LRUCache
+
+
+@pytest.fixture
+def cache(app):
+    app.config['TEST_CACHE_SIZE'] = 2
+    with app.app_context():
+        yield LRUCache('TEST_CACHE_SIZE')
+
+
+def test_evicts_least_recently_used(cache):
+    for key in 'abc':
+        cache.fetch(key, lambda: key.upper())
+    assert cache.fetch('a', lambda: 'reloaded') == 'reloaded'
+    assert cache.fetch('c', lambda: 'reloaded') == 'C'
+    assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 4}
+
+
+def test_expiry_freshness_and_missing_values(cache, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('services.lru.time.monotonic', lambda: now[0])
+    cache.fetch('a', lambda: 1, ttl=lambda value: value * 10)
+    now[0] = 109.0
+    assert cache.fetch('a', lambda: 2) == 1
+    now[0] = 111.0
+    assert cache.fetch('a', lambda: 2) == 2
+
+    assert cache.fetch('a', lambda: 3, fresh=lambda value: value == 3) == 3
+    assert cache.fetch('b', lambda: None) is None
+    assert cache.fetch('b', lambda: 'found') == 'found'
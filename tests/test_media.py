@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+from services.media import serve_file
+
+DATA = bytes(range(256)) * 160
+
+
+@pytest.fixture
+def media_file(app):
+    path = os.path.join(app.config['MEDIA_ROOT'], 'movie.mp4')
+    with open(path, 'wb') as f:
+        f.write(DATA)
+    return path
+
+
+def serve(app, path, headers, file_wrapper=FileWrapper):
+    environ = {'wsgi.file_wrapper': file_wrapper} if file_wrapper else {}
+    with app.test_request_context('/', headers=headers, environ_base=environ):
+        response = serve_file(path, 'video/mp4')
+        body = b''.join(response.response)
+        response.close()
+    return response, body
+
+
+@pytest.mark.parametrize('file_wrapper', [FileWrapper, None])
+@pytest.mark.parametrize('header, start, stop', [
+    ('bytes=10-19', 10, 20),
+    ('bytes=40000-', 40000, len(DATA)),
+    ('bytes=-5', len(DATA) - 5, len(DATA)),
+])
+def test_range_body_matches_content_length(app, media_file, file_wrapper, header, start, stop):
+    response, body = serve(app, media_file, {'Range': header}, file_wrapper)
+    assert response.status_code == 206
+    assert len(body) == int(response.headers['Content-Length']) == stop - start
+    assert body == DATA[start:stop]
+    assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(DATA)}'
+
+
+def test_full_file_through_file_wrapper(app, media_file):
+    response, body = serve(app, media_file, {})
+    assert response.status_code == 200
+    assert body == DATA
+    assert int(response.headers['Content-Length']) == len(DATA)
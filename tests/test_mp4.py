@@ -0,0 +1,186 @@
+import io
+import struct
+
+import pytest
+
+from mp4_builder import TrackSpec, box, build_mp4
+from services.mp4 import (
+    NON_SYNC_SAMPLE, SYNC_SAMPLE, UnsupportedMP4, _children, _iter_boxes, init_segment,
+    keyframe_segments, media_segment, read_mp4, segment_reads,
+)
+
+VIDEO_DURATIONS = [3000] * 60 + [3003] * 30
+VIDEO_SIZES = [500 if n % 30 == 0 else 100 + n % 7 for n in range(90)]
+VIDEO_CTTS = [(0, 6000, 3000)[n % 3] for n in range(90)]
+AUDIO_SAMPLES = 141
+
+
+def video_track(**overrides):
+    spec = dict(
+        handler=b'vide', track_id=1, timescale=90000,
+        durations=VIDEO_DURATIONS, sizes=VIDEO_SIZES,
+        chunks=[5] * 10 + [4] * 10, sync=[0, 30, 60], ctts=VIDEO_CTTS,
+    )
+    spec.update(overrides)
+    return TrackSpec(**spec)
+
+
+def audio_track(**overrides):
+    return TrackSpec(b'soun', 2, 48000, [1024] * AUDIO_SAMPLES, [200] * AUDIO_SAMPLES,
+                     chunks=[8] * 17 + [5], constant_size=True, **overrides)
+
+
+def parse(data):
+    return read_mp4(io.BytesIO(data))
+
+
+def test_sample_tables():
+    data, offsets = build_mp4([video_track(), audio_track()])
+    video, audio = parse(data).tracks
+
+    assert (video.handler, video.track_id, video.timescale) == (b'vide', 1, 90000)
+    assert list(video.durations) == VIDEO_DURATIONS                    # stts, two runs
+    assert list(video.sizes) == VIDEO_SIZES                            # stsz, per sample
+    assert list(video.offsets) == offsets[0]                           # stsc, two runs + stco
+    assert video.sync_samples == [0, 30, 60]                           # stss, 0-based
+    assert list(video.composition_offsets) == VIDEO_CTTS               # ctts
+    assert (video.width, video.height) == (320, 240)
+    assert video.codec == 'avc1.64001f'
+    assert video.duration == pytest.approx((60 * 3000 + 30 * 3003) / 90000)
+
+    assert list(audio.sizes) == [200] * AUDIO_SAMPLES                  # stsz, constant
+    assert list(audio.offsets) == offsets[1]
+    assert audio.sync_samples is None
+    assert audio.composition_offsets is None
+    assert audio.codec == 'mp4a.40.2'
+
+
+def test_co64_and_moov_at_end():
+    data, offsets = build_mp4([video_track(), audio_track()], faststart=False, co64=True)
+    video, audio = parse(data).tracks
+    assert list(video.offsets) == offsets[0]
+    assert list(audio.offsets) == offsets[1]
+
+
+def test_unknown_codec_is_none():
+    hevc = box(b'hvc1', bytes(78), box(b'hvcC', bytes(23)))
+    audio = box(b'mp4a', bytes(28))    # no esds
+    data, _ = build_mp4([video_track(sample_entry=hevc), audio_track(sample_entry=audio)])
+    tracks = parse(data).tracks
+    assert [track.codec for track in tracks] == [None, None]
+
+
+def test_video_without_stss_is_all_keyframes():
+    video, = parse(build_mp4([video_track(sync=None, ctts=None)])[0]).tracks
+    assert video.sync_samples is None
+    assert list(video.sample_flags(10, 13)) == [SYNC_SAMPLE] * 3
+
+
+def test_sample_flags():
+    video, _ = parse(build_mp4([video_track(), audio_track()])[0]).tracks
+    flags = video.sample_flags(29, 32)
+    assert list(flags) == [NON_SYNC_SAMPLE, SYNC_SAMPLE, NON_SYNC_SAMPLE]
+
+
+def test_rejects_unsupported_files():
+    with pytest.raises(UnsupportedMP4):
+        parse(build_mp4([audio_track()])[0])
+    data, _ = build_mp4([video_track()])
+    with pytest.raises(UnsupportedMP4):
+        parse(data + struct.pack('>I4s', 8, b'moof'))
+    with pytest.raises(UnsupportedMP4):
+        parse(data[:200])
+
+
+def test_keyframe_cuts():
+    tracks = parse(build_mp4([video_track(), audio_track()])[0]).tracks
+    segments = keyframe_segments(tracks, 1)
+
+    # Cut at the first keyframe at least a second after the previous cut;
+    # audio at the first sample at or after the same time
+    assert [seg.samples for seg in segments] == [
+        ((0, 30), (0, 47)),
+        ((30, 60), (47, 94)),
+        ((60, 90), (94, AUDIO_SAMPLES)),
+    ]
+    assert [seg.start for seg in segments] == [0, 1, 2]
+    assert [seg.duration for seg in segments] == pytest.approx([1, 1, 30 * 3003 / 90000])
+    assert segments[0].size == sum(VIDEO_SIZES[:30]) + 47 * 200
+
+    # A longer target skips keyframes; a segment never ends between them
+    assert [seg.samples[0] for seg in keyframe_segments(tracks, 1.5)] == [(0, 60), (60, 90)]
+
+
+def test_segment_reads_cover_samples():
+    tracks = parse(build_mp4([video_track(), audio_track()])[0]).tracks
+    segment = keyframe_segments(tracks, 1)[1]
+    reads = segment_reads(tracks, segment)
+    assert reads == sorted(reads)
+    for track, (first, stop) in zip(tracks, segment.samples):
+        for n in range(first, stop):
+            assert any(start <= track.offsets[n] and track.offsets[n] + track.sizes[n] <= end
+                       for start, end in reads)
+
+
+def boxes(data, start=0, end=None):
+    return [(box_type, payload, box_end) for box_type, payload, box_end in
+            _iter_boxes(data, start, end)]
+
+
+def test_init_segment():
+    source = parse(build_mp4([video_track(), audio_track()])[0])
+    init = init_segment(source)
+
+    (ftyp, _, _), (moov_type, moov, moov_end) = boxes(init)
+    assert (ftyp, moov_type) == (b'ftyp', b'moov')
+    children = _children(init, moov, moov_end)
+    assert len(children[b'trak']) == 2
+    trex = [struct.unpack_from('>I', init, payload + 4)[0]
+            for payload, _ in _children(init, *children[b'mvex'][0])[b'trex']]
+    assert trex == [1, 2]
+
+    # Sample tables are empty; the sample description is kept as is
+    mdia = _children(init, *_children(init, *children[b'trak'][0])[b'mdia'][0])
+    stbl = _children(init, *_children(init, *mdia[b'minf'][0])[b'stbl'][0])
+    assert sorted(stbl) == [b'stco', b'stsc', b'stsd', b'stsz', b'stts']
+    assert struct.unpack_from('>I', init, stbl[b'stts'][0][0] + 4)[0] == 0
+    stsd = init[stbl[b'stsd'][0][0]:stbl[b'stsd'][0][1]]
+    assert stsd in source.moov
+
+
+def test_media_segment():
+    data, _ = build_mp4([video_track(), audio_track()])
+    source = parse(data)
+    segment = keyframe_segments(source.tracks, 1)[1]
+    fragment = media_segment(source, segment, 2, lambda start, stop: data[start:stop])
+
+    (moof_type, moof, moof_end), (mdat_type, _, mdat_end) = boxes(fragment)
+    assert (moof_type, mdat_type, mdat_end) == (b'moof', b'mdat', len(fragment))
+    children = _children(fragment, moof, moof_end)
+    assert struct.unpack_from('>I', fragment, children[b'mfhd'][0][0] + 4)[0] == 2
+
+    moof_start = moof - 8
+    for track, (traf, traf_end) in zip(source.tracks, children[b'traf']):
+        first, stop = segment.samples[source.tracks.index(track)]
+        traf_boxes = _children(fragment, traf, traf_end)
+        tfhd = traf_boxes[b'tfhd'][0][0]
+        assert struct.unpack_from('>II', fragment, tfhd) == (0x020000, track.track_id)
+        tfdt = traf_boxes[b'tfdt'][0][0]
+        assert struct.unpack_from('>Q', fragment, tfdt + 4)[0] == track.decode_times()[first]
+
+        trun = traf_boxes[b'trun'][0][0]
+        flags, count, data_offset = struct.unpack_from('>IIi', fragment, trun)
+        assert count == stop - first
+        fields = 4 if flags & 0x800 else 3
+        entries = struct.unpack_from(f'>{fields * count}I', fragment, trun + 12)
+        position = moof_start + data_offset
+        for i, n in enumerate(range(first, stop)):
+            duration, size, sample_flags = entries[i * fields:i * fields + 3]
+            assert (duration, size) == (track.durations[n], track.sizes[n])
+            assert sample_flags == (SYNC_SAMPLE if n == first else
+                                    track.sample_flags(n, n + 1)[0])
+            if fields == 4:
+                assert entries[i * fields + 3] == track.composition_offsets[n]
+            offset = track.offsets[n]
+            assert fragment[position:position + size] == data[offset:offset + size]
+            position += size